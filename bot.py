@@ -1,13 +1,19 @@
+import time
+
+_import_started_at = time.perf_counter()  # Start of the startup timing breakdown
+
 import asyncio
 import gc
+import hashlib
+import json
 import logging
 import math
 import random
+from collections import deque
 from datetime import datetime, timedelta
 from enum import Enum, auto
 from pathlib import Path
-from typing import Dict, Optional
-import time
+from typing import TYPE_CHECKING, Deque, Dict, List, Optional, Tuple
 import subprocess
 import discord
 import yaml
@@ -15,17 +21,71 @@ from discord import app_commands
 from discord.ext import commands, tasks
 
 try:
-    from PLANA.music.plugins.ytdlp_wrapper import Track, extract as extract_audio_data, ensure_stream
-    from PLANA.music.error.errors import MusicCogExceptionHandler
-    from PLANA.music.plugins.audio_mixer import AudioMixer, MusicAudioSource
+    from services.ytdlp_wrapper import Track, extract as extract_audio_data, ensure_stream, search_provider
+    from services.ytdlp_wrapper import is_permanent_failure
+    from services.ytdlp_wrapper import set_nico_credentials
+    from services.ytdlp_wrapper import related_mix_url
+    from services.ytdlp_wrapper import (create_backend as create_extractor_backend,
+                                        get_backend as get_extractor_backend, set_backend as set_extractor_backend)
+    from services.failure_policy import CircuitBreaker, CircuitOpenError, NegativeCache, RetryPolicy
+    from services.errors import MusicCogExceptionHandler
+    from services.audio_mixer import AudioMixer, FrameStats, MusicAudioSource, OpusPassthroughSource
+    from services.ffmpeg_profiles import input_options_for, load_profiles
+    from services.message_scheduler import MessageScheduler
+    from services.now_playing_panel import NowPlayingPanels, NowPlayingView, PanelRender
+    from services.metrics import MetricsRegistry
+    from services.voice_connections import VoiceConnectionManager
+    from services.track_queue import MemoryBudget, TrackQueue, resolve_in_order
+    from services.admission import PASSTHROUGH, TRANSCODE, AdmissionController, set_encoder_complexity
+    from services.encoder_bitrate import BitrateStats, EncoderMeter, channel_bitrate_kbps
 except ImportError as e:
     print(f"[CRITICAL] MusicBot: 必須コンポーネントのインポートに失敗しました。エラー: {e}")
     Track = None
     extract_audio_data = None
     ensure_stream = None
+    search_provider = None
+    is_permanent_failure = None
+    set_nico_credentials = None
+    create_extractor_backend = None
+    get_extractor_backend = None
+    set_extractor_backend = None
+    CircuitBreaker = None
+    CircuitOpenError = None
+    NegativeCache = None
+    RetryPolicy = None
     MusicCogExceptionHandler = None
     AudioMixer = None
+    FrameStats = None
     MusicAudioSource = None
+    OpusPassthroughSource = None
+    input_options_for = None
+    load_profiles = None
+    MessageScheduler = None
+    NowPlayingPanels = None
+    NowPlayingView = None
+    PanelRender = None
+    MetricsRegistry = None
+    VoiceConnectionManager = None
+    MemoryBudget = None
+    AdmissionController = None
+    set_encoder_complexity = None
+    PASSTHROUGH = TRANSCODE = None
+    TrackQueue = None
+    resolve_in_order = None
+    BitrateStats = None
+    EncoderMeter = None
+    channel_bitrate_kbps = None
+    related_mix_url = None
+
+if TYPE_CHECKING:
+    # Optional features are imported in MusicBot.__init__ only when they are enabled
+    from services.broadcast import RadioStation, RadioStations, StationListener
+    from services.co_play import CoPlayIndex
+    from services.hedged_search import HedgedSearch
+    from services.loudness import LoudnessCache
+    from services.play_history import PlayHistory
+    from services.profiling import Profiler
+    from services.stream_relay import StreamRelay
 
 logger = logging.getLogger(__name__)
 
@@ -62,6 +122,45 @@ def parse_time_to_seconds(time_str: str) -> Optional[int]:
     return None
 
 
+# Outbound channel message policy: message_key -> (coalesce_key, batch_key).
+# A pending message is replaced by a newer one with the same coalesce key, and
+# pending messages with the same batch key are merged into a single message.
+BACKGROUND_MESSAGE_POLICY = {
+    "now_playing": ("playback_status", None),
+    "queue_ended": ("playback_status", None),
+    "radio_ended": ("playback_status", None),
+    "autoplay_next": ("autoplay", None),
+    "max_queue_size_reached": ("max_queue_size", None),
+    "queue_memory_limited": ("max_queue_size", None),
+    "waiting_for_capacity": ("capacity", None),
+    "host_busy": ("capacity", None),
+    "error_message_wrapper": (None, "errors"),
+    "playback_failures_halted": (None, "errors"),
+    "added_to_queue": (None, "queue_additions"),
+    "added_playlist_to_queue": (None, "queue_additions"),
+    "search_no_results": (None, "errors"),
+}
+
+
+class StartupTimer:
+    """Collects per-phase durations from process start until the bot is ready."""
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self._last_mark = started_at
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last_mark))
+        self._last_mark = now
+
+    def report(self) -> str:
+        total = self._last_mark - self.started_at
+        breakdown = ", ".join(f"{phase} {elapsed:.2f}s" for phase, elapsed in self.phases)
+        return f"Startup took {total:.2f}s ({breakdown})"
+
+
 class LoopMode(Enum):
     OFF = auto()
     ONE = auto()
@@ -74,8 +173,10 @@ class GuildState:
         self.guild_id = guild_id
         self.voice_client: Optional[discord.VoiceClient] = None
         self.current_track: Optional[Track] = None
-        self.queue: asyncio.Queue[Track] = asyncio.Queue()
+        # Queued track metadata is charged to the bot-wide memory budget
+        self.queue: TrackQueue = TrackQueue(getattr(bot, 'memory_budget', None), guild_id)
         self.volume: float = cog_config.get('music', {}).get('default_volume', 20) / 100.0
+        self.track_gain: float = 1.0  # Static loudness-normalization gain of the current track
         self.loop_mode: LoopMode = LoopMode.OFF
         self.is_playing: bool = False
         self.is_paused: bool = False
@@ -84,47 +185,64 @@ class GuildState:
         self.connection_lock = asyncio.Lock()
         self.last_activity = datetime.now()
         self.cleanup_in_progress = False
-        self.playback_start_time: Optional[float] = None
         self.seek_position: int = 0
-        self.paused_at: Optional[float] = None
+        # Playback clock: the current music source counts the frames it actually delivered
+        self.music_source: Optional[discord.AudioSource] = None
+        self.frame_stats = FrameStats()
         self.is_seeking: bool = False
         self.is_loading: bool = False
         self.mixer: Optional[AudioMixer] = None
+        self.is_passthrough: bool = False
+        self.consecutive_failures: int = 0
+        self.pending_retry: Optional[Track] = None  # Track held back while its site's circuit is open
+        self.advance_task: Optional[asyncio.Task] = None
+        self.stop_requested: bool = False  # Set by skip/stop so the supervisor does not treat the end as a stall
+        self.recovery_attempts: int = 0
+        self.recovery_started_at: Optional[float] = None
+        self.radio_listener: Optional[StationListener] = None  # Set while tuned into a shared radio station
+        # Long pauses release FFmpeg and the mixer; current_track and seek_position are kept for /resume
+        self.is_suspended: bool = False
+        self.pause_release_task: Optional[asyncio.Task] = None
+        self.encoder_meter: Optional[EncoderMeter] = None  # Measures the Opus encoder of the mixer path
+        autoplay_config = cog_config.get('music', {}).get('autoplay', {})
+        self.autoplay: bool = autoplay_config.get('default_enabled', False)
+        # Tracks started recently; autoplay seeds from the last one and never picks any of them again
+        self.recent_urls: Deque[str] = deque(maxlen=autoplay_config.get('recent_exclude', 50))
+        # Autoplay picks that failed to play; excluded from later picks but never used as a seed
+        self.autoplay_rejects: Deque[str] = deque(maxlen=autoplay_config.get('recent_exclude', 50))
+
+    def cancel_advance(self):
+        if self.advance_task and not self.advance_task.done() and self.advance_task is not asyncio.current_task():
+            self.advance_task.cancel()
+        self.advance_task = None
+
+    def cancel_pause_release(self):
+        if self.pause_release_task and not self.pause_release_task.done():
+            self.pause_release_task.cancel()
+        self.pause_release_task = None
 
     def update_activity(self):
         self.last_activity = datetime.now()
 
+    def effective_volume(self) -> float:
+        return self.volume * self.track_gain
+
     def update_last_text_channel(self, channel_id: int):
         self.last_text_channel_id = channel_id
         self.update_activity()
 
     def get_current_position(self) -> int:
-        if not self.is_playing:
+        # Frames stop counting while paused or while the send loop stalls, so no wall-clock correction is needed
+        if not self.is_playing or self.music_source is None:
             return self.seek_position
-
-        if self.is_paused and self.paused_at:
-            elapsed = self.paused_at - self.playback_start_time
-            return self.seek_position + int(elapsed)
-
-        if self.playback_start_time:
-            elapsed = time.time() - self.playback_start_time
-            return self.seek_position + int(elapsed)
-
-        return self.seek_position
+        return self.seek_position + int(self.music_source.elapsed_seconds)
 
     def reset_playback_tracking(self):
-        self.playback_start_time = None
         self.seek_position = 0
-        self.paused_at = None
+        self.music_source = None
 
     async def clear_queue(self):
-        while not self.queue.empty():
-            try:
-                self.queue.get_nowait()
-                self.queue.task_done()
-            except asyncio.QueueEmpty:
-                break
-        self.queue = asyncio.Queue()
+        self.queue.clear()
 
     async def cleanup_voice_client(self):
         if self.cleanup_in_progress:
@@ -134,6 +252,7 @@ class GuildState:
             if self.mixer:
                 self.mixer.stop()
                 self.mixer = None
+            self.is_passthrough = False
             if self.voice_client:
                 try:
                     if self.voice_client.is_playing():
@@ -162,8 +281,9 @@ def load_config() -> dict:
         return {}
 
 
-class MusicBot(commands.Bot): # Inherit from commands.Bot
-    def __init__(self, config: dict, intents: discord.Intents):
+# Also a Cog so that the slash commands defined on this class are bound and registered with add_cog
+class MusicBot(commands.Bot, commands.Cog): # Inherit from commands.Bot
+    def __init__(self, config: dict, intents: discord.Intents, startup_timer: Optional[StartupTimer] = None):
         self.config = config
         self.music_config = self.config.get('music', {})
         super().__init__(command_prefix=self.config.get('prefix', '!'), intents=intents) # Initialize commands.Bot
@@ -173,31 +293,249 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
         self.ffmpeg_before_options = self.music_config.get('ffmpeg_before_options',
                                                            "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5")
         self.ffmpeg_options = self.music_config.get('ffmpeg_options', "-vn")
+        self.ffmpeg_profiles = load_profiles(self.music_config.get('ffmpeg_profiles'))
+        self.metrics = MetricsRegistry()
+        failure_config = self.music_config.get('failure_handling', {})
+        self.negative_cache = NegativeCache(ttl=failure_config.get('negative_cache_ttl', 600),
+                                            max_entries=failure_config.get('negative_cache_size', 5000))
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=failure_config.get('circuit_failure_threshold', 5),
+            window=failure_config.get('circuit_window', 60),
+            cooldown=failure_config.get('circuit_cooldown', 30),
+            max_cooldown=failure_config.get('circuit_max_cooldown', 600)
+        )
+        recovery_config = self.music_config.get('stream_recovery', {})
+        self.stream_recovery_enabled = recovery_config.get('enabled', True)
+        self.max_recovery_attempts = recovery_config.get('max_attempts', 3)
+        self.recovery_end_tolerance = recovery_config.get('end_tolerance', 5)
+        self.retry_policy = RetryPolicy(
+            max_consecutive_failures=failure_config.get('max_consecutive_failures', 5),
+            base_delay=failure_config.get('retry_base_delay', 1.0),
+            max_delay=failure_config.get('retry_max_delay', 30.0)
+        )
+        # Where info dicts come from: live yt-dlp, yt-dlp while recording fixtures, or recorded fixtures only
+        set_extractor_backend(create_extractor_backend(self.music_config.get('extractor')))
+        nico_config = self.music_config.get('niconico', {})
+        set_nico_credentials(nico_config.get('email'), nico_config.get('password'))
+        logger.info(f"Extractor backend: {get_extractor_backend().name}")
+        hedge_config = self.music_config.get('hedged_search', {})
+        self.hedged_search: Optional[HedgedSearch] = None
+        if hedge_config.get('enabled', False):
+            from services.hedged_search import HedgedSearch
+            # The first provider is the primary; the others are only asked when it is slower than usual or fails
+            self.hedged_search = HedgedSearch(
+                [(prefix, search_provider(prefix)) for prefix in hedge_config.get('providers', ['ytsearch', 'scsearch'])],
+                hedge_percentile=hedge_config.get('hedge_percentile', 95.0),
+                initial_delay=hedge_config.get('initial_delay', 1.5),
+                min_delay=hedge_config.get('min_delay', 0.3),
+                max_delay=hedge_config.get('max_delay', 5.0)
+            )
+        self.opus_passthrough = self.music_config.get('opus_passthrough', True)
+        self.passthrough_tolerance_db = self.music_config.get('opus_passthrough_tolerance_db', 0.5)
+        self.relay_config = self.music_config.get('stream_relay', {})
+        self.stream_relay: Optional[StreamRelay] = None
+        if self.relay_config.get('enabled', False):
+            self.stream_relay = self._create_stream_relay(progressive=True)
+        loudness_config = self.music_config.get('loudness_normalization', {})
+        self.passthrough_gain_tolerance_db = loudness_config.get('passthrough_gain_tolerance_db', 1.0)
+        self.loudness: Optional[LoudnessCache] = None
+        if loudness_config.get('enabled', True):
+            from services.loudness import LoudnessCache
+            self.loudness = LoudnessCache(
+                Path(loudness_config.get('cache_file', './cache/loudness.json')),
+                ffmpeg_path=self.ffmpeg_path,
+                target_lufs=loudness_config.get('target_lufs', -14.0),
+                max_boost_db=loudness_config.get('max_boost_db', 6.0),
+                max_cut_db=loudness_config.get('max_cut_db', 20.0),
+                max_concurrent=loudness_config.get('max_concurrent_measurements', 2),
+                sample_seconds=loudness_config.get('sample_seconds', 60)
+            )
         self.auto_leave_timeout = self.music_config.get('auto_leave_timeout', 10)
+        self.pause_release_timeout = self.music_config.get('pause_release_timeout', 300)
         self.max_queue_size = self.music_config.get('max_queue_size', 9000)
         self.max_guilds = self.music_config.get('max_guilds', 100000000)
         self.inactive_timeout_minutes = self.music_config.get('inactive_timeout_minutes', 30)
+        budget_config = self.music_config.get('memory_budget', {})
+        self.memory_budget = MemoryBudget(
+            int(budget_config.get('max_queue_memory_mb', 256) * 1024 * 1024),
+            soft_ratio=budget_config.get('soft_limit_ratio', 0.8),
+            max_owner_share=budget_config.get('max_guild_share', 0.25),
+            throttled_batch=budget_config.get('throttled_import_size', 50)
+        )
+        admission_config = self.music_config.get('admission', {})
+        self.admission: Optional[AdmissionController] = None
+        if admission_config.get('enabled', False):
+            self.admission = AdmissionController(
+                max_transcodes=admission_config.get('max_transcodes', 0),
+                max_load=admission_config.get('max_load', 0.9),
+                pressure_ratio=admission_config.get('pressure_ratio', 0.75),
+                queue_timeout=admission_config.get('queue_timeout', 20)
+            )
+        self.reduced_encoder_complexity = admission_config.get('reduced_complexity', 5)
+        bitrate_config = self.music_config.get('encoder_bitrate', {})
+        self.match_channel_bitrate = bitrate_config.get('match_channel', True)
+        self.min_encoder_kbps = bitrate_config.get('min_kbps', 16)
+        self.max_encoder_kbps = bitrate_config.get('max_kbps', 128)
+        self.bitrate_stats = BitrateStats()
+        self.profiling_config = self.music_config.get('profiling', {})
+        self.profiler: Optional[Profiler] = None  # Created by the first /profile
+        history_config = self.music_config.get('play_history', {})
+        self.play_history: Optional[PlayHistory] = None
+        if history_config.get('enabled', True):
+            from services.play_history import PlayHistory
+            self.play_history = PlayHistory(
+                Path(history_config.get('path', './cache/play_history.jsonl')),
+                max_entries=history_config.get('max_entries', 200000)
+            )
+        warm_up_config = self.music_config.get('warm_up', {})
+        self.warm_up_enabled = warm_up_config.get('enabled', True)
+        self.warm_up_tracks = warm_up_config.get('tracks', 50)
+        self.warm_up_delay = warm_up_config.get('delay', 30)
+        self.warm_up_interval = warm_up_config.get('interval', 1.0)
+        self.warm_up_relay_blocks = warm_up_config.get('relay_blocks', 0)
+        self.warm_up_loudness = warm_up_config.get('measure_loudness', False)
+        self.warm_up_task: Optional[asyncio.Task] = None
+        autoplay_config = self.music_config.get('autoplay', {})
+        self.autoplay_related = autoplay_config.get('related_fallback', True)
+        self.autoplay_related_items = autoplay_config.get('related_items', 25)
+        self.extractor_cache_enabled = self.music_config.get('extractor', {}).get('cache_ttl', 0) > 0
+        self.co_play: Optional[CoPlayIndex] = None
+        if self.play_history:
+            # Built from every history entry as it is loaded or recorded, so it is complete once load() returns
+            from services.co_play import CoPlayIndex
+            self.co_play = CoPlayIndex(
+                max_followers=autoplay_config.get('max_followers', 16),
+                session_gap=autoplay_config.get('session_gap', 600)
+            )
+            self.play_history.add_listener(self.co_play.observe)
+        playmany_config = self.music_config.get('playmany', {})
+        self.playmany_max_queries = playmany_config.get('max_queries', 25)
+        self.playmany_concurrency = playmany_config.get('concurrency', 4)
+        radio_config = self.music_config.get('radio', {})
+        self.radio_enabled = radio_config.get('enabled', True)
+        self.radio: Optional[RadioStations] = None
+        if self.radio_enabled:
+            from services.broadcast import RadioStations
+            self.radio = RadioStations(
+                max_stations=radio_config.get('max_stations', 10),
+                budget=self.memory_budget,
+                ring_frames=radio_config.get('buffer_frames', 50),
+                volume_step=radio_config.get('volume_step', 5) / 100.0,
+                max_volume_groups=radio_config.get('max_volume_groups', 8),
+                on_closed=self._on_radio_closed
+            )
         self.global_connection_lock = asyncio.Lock()
+        self.voice_connections = VoiceConnectionManager(self, self.metrics)
         self.cleanup_task = None # Will be started in on_ready
+        self.startup_timer = startup_timer
+        scheduler_config = self.music_config.get('message_scheduler', {})
+        self.message_scheduler = MessageScheduler(
+            self,
+            channel_rate=scheduler_config.get('channel_rate', 5),
+            channel_period=scheduler_config.get('channel_period', 5.0),
+            global_rate=scheduler_config.get('global_rate', 50),
+            batch_window=scheduler_config.get('batch_window', 1.5)
+        )
+        panel_config = self.music_config.get('now_playing_panel', {})
+        self.panel_min_interval = panel_config.get('min_refresh_interval', 10)
+        self.panel_max_interval = panel_config.get('max_refresh_interval', 60)
+        self.now_playing_panels: Optional[NowPlayingPanels] = None
+        if panel_config.get('enabled', True):
+            self.now_playing_panels = NowPlayingPanels(
+                self.message_scheduler,
+                self._render_now_playing_panel,
+                lambda guild_id: NowPlayingView(guild_id, self._panel_toggle_pause, self._panel_skip),
+                edits_per_second=panel_config.get('edits_per_second', 2.0)
+            )
+        self.command_hash_file = Path(self.music_config.get('command_hash_file', './cache/command_tree.sha256'))
+        self.force_command_sync = self.music_config.get('force_command_sync', False)
+        self._commands_synced = False
 
         # Ensure components are imported
-        if not all((Track, extract_audio_data, ensure_stream, MusicCogExceptionHandler, AudioMixer, MusicAudioSource)):
+        if not all((Track, extract_audio_data, ensure_stream, create_extractor_backend, MusicCogExceptionHandler,
+                    AudioMixer, FrameStats, MusicAudioSource, OpusPassthroughSource, input_options_for,
+                    search_provider, NegativeCache, MessageScheduler, NowPlayingPanels, MetricsRegistry,
+                    VoiceConnectionManager, MemoryBudget, TrackQueue, AdmissionController, BitrateStats,
+                    related_mix_url, is_permanent_failure, set_nico_credentials)):
             raise RuntimeError("必須コンポーネントのインポート失敗")
 
-    @commands.Bot.event
+    async def setup_hook(self):
+        await self.add_cog(self)
+        if self.startup_timer:
+            self.startup_timer.mark("login")
+        if self.stream_relay:
+            try:
+                await self.stream_relay.start()
+            except OSError as e:
+                # Without the relay FFmpeg simply reads from the upstream host directly
+                logger.error(f"Stream relay could not start, streaming directly: {e}")
+        if self.play_history:
+            await self.play_history.load()
+
+    async def close(self):
+        if self.warm_up_task and not self.warm_up_task.done():
+            self.warm_up_task.cancel()
+        if self.play_history:
+            await self.play_history.close()
+        if self.now_playing_panels:
+            await self.now_playing_panels.close_all()
+        await self.message_scheduler.close()
+        if self.stream_relay:
+            await self.stream_relay.close()
+        await super().close()
+
     async def on_ready(self):
         logger.info(f"{self.user.name} の MusicBot が正常にロードされました。")
         if not self.cleanup_task or self.cleanup_task.done():
             self.cleanup_task = self.cleanup_task_loop.start()
         logger.info("MusicBot loaded and cleanup task started")
-        # Sync slash commands
+        # on_ready fires again after every reconnect; the command tree only needs checking once per process
+        if self._commands_synced:
+            return
+        self._commands_synced = True
+        if self.startup_timer:
+            self.startup_timer.mark("gateway")
+        await self._sync_commands_if_changed()
+        if self.startup_timer:
+            self.startup_timer.mark("command_sync")
+            logger.info(self.startup_timer.report())
+        if self.warm_up_enabled and self.play_history and self.warm_up_tracks > 0:
+            self.warm_up_task = asyncio.create_task(self._warm_up_popular_tracks())
+
+    def _command_tree_hash(self) -> str:
+        payloads = []
+        for command in self.tree.get_commands():
+            try:
+                payloads.append(command.to_dict(self.tree))
+            except TypeError:  # discord.py < 2.4
+                payloads.append(command.to_dict())
+        payloads.sort(key=lambda p: (p.get('type', 1), p.get('name', '')))
+        serialized = json.dumps({'application_id': self.application_id, 'commands': payloads},
+                                sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    async def _sync_commands_if_changed(self):
+        # Syncing is slow and rate-limited, so only push the tree when its contents changed
+        current_hash = self._command_tree_hash()
+        try:
+            stored_hash = self.command_hash_file.read_text(encoding='utf-8').strip()
+        except OSError:
+            stored_hash = None
+        if stored_hash == current_hash and not self.force_command_sync:
+            logger.info("Command tree unchanged, skipping sync.")
+            return
         try:
             synced = await self.tree.sync()
             logger.info(f"Synced {len(synced)} commands.")
         except Exception as e:
             logger.error(f"Failed to sync commands: {e}")
+            return
+        try:
+            self.command_hash_file.parent.mkdir(parents=True, exist_ok=True)
+            self.command_hash_file.write_text(current_hash, encoding='utf-8')
+        except OSError as e:
+            logger.warning(f"Failed to store command tree hash: {e}")
 
-    @commands.Bot.event
     async def on_disconnect(self):
         logger.info("MusicBot disconnected. Performing cleanup...")
         if hasattr(self, 'cleanup_task') and self.cleanup_task:
@@ -276,12 +614,11 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
             logger.error(f"Guild {interaction.guild.id} ({interaction.guild.name}): Response error: {e}")
 
     async def _send_background_message(self, channel_id: int, message_key: str, **kwargs):
+        # Queued per channel: superseded messages are dropped and sends are paced under the rate limits
         try:
-            channel = self.get_channel(channel_id)
-            if isinstance(channel, discord.TextChannel):
-                await channel.send(self.exception_handler.get_message(message_key, **kwargs))
-        except discord.Forbidden:
-            logger.debug(f"No permission to send to channel {channel_id}")
+            coalesce_key, batch_key = BACKGROUND_MESSAGE_POLICY.get(message_key, (None, None))
+            self.message_scheduler.enqueue(channel_id, self.exception_handler.get_message(message_key, **kwargs),
+                                           coalesce_key=coalesce_key, batch_key=batch_key)
         except Exception as e:
             logger.error(f"Background message error: {e}")
 
@@ -313,44 +650,70 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
                                               error="現在接続数が上限に達しています。")
                     return None
 
-            vc = state.voice_client
-            if vc:
-                if not vc.is_connected():
-                    await state.cleanup_voice_client()
-                    vc = None
-                elif vc.channel == user_voice.channel:
-                    return vc
-                else:
-                    await state.cleanup_voice_client()
-                    await asyncio.sleep(0.5)
-                    vc = None
-
-            for voice_client in list(self.voice_clients): # Use self.voice_clients
-                if voice_client.guild.id == interaction.guild.id and voice_client != state.voice_client:
-                    try:
-                        await asyncio.wait_for(voice_client.disconnect(force=True), timeout=3.0)
-                    except:
-                        pass
-
-            if not vc and connect_if_not_in:
-                try:
-                    await asyncio.sleep(0.3)
-                    state.voice_client = await asyncio.wait_for(
-                        user_voice.channel.connect(timeout=30.0, reconnect=True, self_deaf=True),
-                        timeout=35.0
-                    )
-                    logger.info(
-                        f"Guild {interaction.guild.id} ({interaction.guild.name}): Connected to {user_voice.channel.name}")
-                    return state.voice_client
-                except Exception as e:
-                    await self._handle_error(interaction, e)
-                    state.voice_client = None
-                    return None
-            elif not vc:
+            if state.voice_client and not state.voice_client.is_connected():
+                # A dead session cannot be moved; drop it together with its pipeline
+                await state.cleanup_voice_client()
+
+            try:
+                # Healthy sessions are reused or moved with move_to, so the mixer keeps playing across the move
+                vc, action = await self.voice_connections.ensure(
+                    user_voice.channel, state.voice_client, connect=connect_if_not_in
+                )
+            except Exception as e:
+                await self._handle_error(interaction, e)
+                state.voice_client = None
+                return None
+
+            if not vc:
                 await self._send_response(interaction, "bot_not_in_voice_channel", ephemeral=True)
                 return None
+            state.voice_client = vc
+            if action != "reused":
+                logger.info(f"Guild {interaction.guild.id} ({interaction.guild.name}): "
+                            f"Voice {action} to {user_voice.channel.name}")
             return vc
 
+    def _encoder_kbps(self, channel) -> int:
+        if not self.match_channel_bitrate:
+            return self.max_encoder_kbps
+        return channel_bitrate_kbps(channel, self.min_encoder_kbps, self.max_encoder_kbps)
+
+    def _play_mixer(self, state: GuildState):
+        guild_id = state.guild_id
+        vc = state.voice_client
+        kbps = self._encoder_kbps(vc.channel)
+        vc.play(state.mixer, after=lambda e: self.mixer_finished_callback(e, guild_id), bitrate=kbps)
+        # play() created a fresh encoder; account what the previous one sent before measuring the new one
+        self._flush_encoder_meter(state)
+        if vc.encoder is not None:
+            state.encoder_meter = EncoderMeter(vc.encoder, kbps)
+
+    def _flush_encoder_meter(self, state: GuildState):
+        if state.encoder_meter:
+            state.encoder_meter.flush(self.bitrate_stats)
+            state.encoder_meter = None
+
+    def _adapt_encoder_bitrate(self, state: GuildState, channel):
+        meter = state.encoder_meter
+        vc = state.voice_client
+        if not meter or not state.mixer or state.is_passthrough or not vc or vc.encoder is None:
+            return
+        kbps = self._encoder_kbps(channel)
+        if kbps == meter.kbps:
+            return
+        encoder = vc.encoder
+        stats = self.bitrate_stats
+
+        def _apply():
+            # Runs on the voice thread between two encodes, so the meter's counters stay attributed correctly
+            meter.flush(stats)
+            encoder.set_bitrate(kbps)
+            meter.kbps = kbps
+
+        state.mixer.call_soon(_apply)
+        stats.adaptations += 1
+        logger.info(f"Guild {state.guild_id}: Encoder bitrate {meter.kbps}kbps -> {kbps}kbps for {channel.name}")
+
     def mixer_finished_callback(self, error: Optional[Exception], guild_id: int):
         if error:
             logger.error(f"Guild {guild_id}: Mixer unexpectedly finished with error: {error}")
@@ -362,20 +725,60 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
             asyncio.run_coroutine_threadsafe(self._song_finished_callback(error, guild_id), self.loop)
 
 
-    async def _play_next_song(self, guild_id: int, seek_seconds: int = 0):
+    def _can_passthrough(self, state: GuildState, track: Track) -> bool:
+        # Opus packets can only be forwarded untouched when nothing has to be mixed or scaled
+        if not self.opus_passthrough or not state.voice_client:
+            return False
+        if state.mixer and state.mixer.is_playing():
+            return False
+        if not self._unity_level(state):
+            return False
+        return track.acodec == 'opus' and track.asr == 48000
+
+    def _unity_level(self, state: GuildState) -> bool:
+        # Levels this close to 100% are played unscaled; passthrough saves far more than the difference is worth.
+        # The loudness gain has its own allowance so normalization does not push most repeated tracks to the mixer.
+        return (state.volume > 0 and abs(20 * math.log10(state.volume)) <= self.passthrough_tolerance_db
+                and abs(20 * math.log10(state.track_gain)) <= self.passthrough_gain_tolerance_db)
+
+    async def _restart_current_track(self, guild_id: int, position: int):
+        state = self._get_guild_state(guild_id)
+        if not state or not state.current_track:
+            return
+        state.is_seeking = True
+        # Stop current playback (also when paused) so the new pipeline can take over at the given position
+        if state.voice_client:
+            state.voice_client.stop()
+        if state.mixer:
+            state.mixer.stop()
+        await self._play_next_song(guild_id, seek_seconds=position)
+        state.is_seeking = False # Reset after _play_next_song is called
+
+    async def _play_next_song(self, guild_id: int, seek_seconds: Optional[int] = None):
         state = self._get_guild_state(guild_id)
         if not state:
             return
 
-        # If mixer is playing, and it's not a seek operation, don't interrupt
-        if state.mixer and state.mixer.is_playing() and not seek_seconds > 0:
+        is_seek_operation = seek_seconds is not None
+        # Any explicit advance supersedes a pending backoff retry
+        state.cancel_advance()
+        if state.radio_listener:
+            # The guild's own queue waits while it is tuned into a radio station
             return
 
-        is_seek_operation = seek_seconds > 0
+        # If something is playing, and it's not a seek operation, don't interrupt
+        if not is_seek_operation:
+            if state.mixer and state.mixer.is_playing():
+                return
+            if state.is_passthrough and state.voice_client and state.voice_client.is_playing():
+                return
+
         track_to_play: Optional[Track] = None
 
         if is_seek_operation and state.current_track:
             track_to_play = state.current_track
+        elif state.pending_retry and not is_seek_operation:
+            track_to_play, state.pending_retry = state.pending_retry, None
         elif state.loop_mode == LoopMode.ONE and state.current_track and not is_seek_operation:
             track_to_play = state.current_track
         elif not state.queue.empty() and not is_seek_operation: # Only get from queue if not seeking and not looping one
@@ -385,73 +788,141 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
             except asyncio.QueueEmpty:
                 pass # Should not happen if queue is not empty
 
+        if not track_to_play and state.autoplay and not is_seek_operation:
+            track_to_play = await self._pick_autoplay_track(state)
+
         if not track_to_play:
             state.current_track = None
             state.is_playing = False
             state.reset_playback_tracking()
+            if self.admission:
+                self.admission.release(guild_id)
             if state.last_text_channel_id:
-                await self._send_background_message(state.last_text_channel_id, "queue_ended")
+                # The live panel turns into the queue-ended notice instead of posting another message
+                if not (self.now_playing_panels and self.now_playing_panels.close(
+                        guild_id, self.exception_handler.get_message("queue_ended"))):
+                    await self._send_background_message(state.last_text_channel_id, "queue_ended")
             return
 
         if not is_seek_operation:
             state.current_track = track_to_play
+            state.recovery_attempts = 0
+        state.stop_requested = False
 
         state.is_playing = True
         state.is_paused = False
+        state.is_suspended = False
+        state.cancel_pause_release()
         state.update_activity()
 
-        state.seek_position = seek_seconds
-        state.playback_start_time = time.time()
-        state.paused_at = None
+        state.seek_position = seek_seconds or 0
+        state.music_source = None
 
         try:
-            is_local_file = False
-            if track_to_play.stream_url:
-                try:
-                    is_local_file = Path(track_to_play.stream_url).is_file()
-                except Exception:
-                    pass
-
-            if not is_local_file:
-                updated_track = await ensure_stream(track_to_play)
-                if not updated_track or not updated_track.stream_url:
-                    raise RuntimeError(f"'{track_to_play.title}' の有効なストリームURLを取得できませんでした。")
-                track_to_play.stream_url = updated_track.stream_url
-
-            ffmpeg_before_opts = self.ffmpeg_before_options
-            if seek_seconds > 0:
-                ffmpeg_before_opts = f"-ss {seek_seconds} {ffmpeg_before_opts}"
-
-            source = MusicAudioSource(
-                track_to_play.stream_url,
-                title=track_to_play.title,
-                guild_id=guild_id,
-                executable=self.ffmpeg_path,
-                before_options=ffmpeg_before_opts,
-                options=self.ffmpeg_options,
-                stderr=subprocess.PIPE
-            )
+            if not self._is_local_file(track_to_play):
+                await self._resolve_stream(track_to_play)
+
+            state.track_gain = self.loudness.get_gain(track_to_play.url) if self.loudness else 1.0
+            if self.loudness and not self.loudness.has_measurement(track_to_play.url):
+                # Measure in the background; playback starts right away at neutral gain
+                self.loudness.request_measurement(
+                    track_to_play.url, self._input_url(track_to_play),
+                    before_options=self._input_options(track_to_play)[1],
+                    on_done=lambda key, gain: self._on_loudness_measured(guild_id, key, gain)
+                )
 
-            if state.mixer is None:
-                state.mixer = AudioMixer()
-            else:
-                # Stop current mixer source if any, before adding new one
-                if state.mixer.is_playing():
-                    state.mixer.stop()
+            use_passthrough = self._can_passthrough(state, track_to_play)
+            if not await self._admit_playback(state, PASSTHROUGH if use_passthrough else TRANSCODE):
+                # Host is saturated: keep the track so the next /play picks it up, and do not count a failure
+                state.pending_retry = track_to_play
+                state.current_track = None
+                state.is_playing = False
+                state.is_seeking = False
+                state.reset_playback_tracking()
+                if state.last_text_channel_id:
+                    await self._send_background_message(state.last_text_channel_id, "host_busy")
+                return
 
-            await state.mixer.add_source('music', source, volume=state.volume)
+            # Per-extractor probe settings: a known container/codec lets FFmpeg skip most of its input analysis
+            profile_name, ffmpeg_before_opts = self._input_options(track_to_play, seek_seconds)
+
+            if use_passthrough:
+                # 48kHz Opus source at unity gain: demux the packets and send them as-is,
+                # skipping the PCM decode, the mixer and the Opus re-encode entirely.
+                source = OpusPassthroughSource(
+                    self._input_url(track_to_play),
+                    title=track_to_play.title,
+                    guild_id=guild_id,
+                    on_first_frame=self._first_frame_recorder(state, profile_name, "passthrough"),
+                    stats=state.frame_stats,
+                    executable=self.ffmpeg_path,
+                    before_options=ffmpeg_before_opts,
+                    options=self.ffmpeg_options,
+                    stderr=subprocess.PIPE
+                )
+                if state.mixer:
+                    state.mixer.stop()
+                    state.mixer = None
+                self._flush_encoder_meter(state)
+                state.is_passthrough = True
+                state.music_source = source
+                if state.voice_client:
+                    state.voice_client.play(source, after=lambda e: self.mixer_finished_callback(e, guild_id))
+                logger.debug(f"Guild {guild_id}: Opus passthrough for '{track_to_play.title}'")
+            else:
+                source = MusicAudioSource(
+                    self._input_url(track_to_play),
+                    title=track_to_play.title,
+                    guild_id=guild_id,
+                    on_first_frame=self._first_frame_recorder(state, profile_name, "mixer"),
+                    executable=self.ffmpeg_path,
+                    before_options=ffmpeg_before_opts,
+                    options=self.ffmpeg_options,
+                    stderr=subprocess.PIPE
+                )
 
-            if state.voice_client and state.voice_client.source is not state.mixer:
-                state.voice_client.play(state.mixer, after=lambda e: self.mixer_finished_callback(e, guild_id))
-            elif state.voice_client and state.voice_client.source is state.mixer and not state.mixer.is_playing():
-                # If mixer is already the source but not playing (e.g., after a seek), start it
-                state.voice_client.play(state.mixer, after=lambda e: self.mixer_finished_callback(e, guild_id))
+                if state.mixer is None:
+                    state.mixer = AudioMixer(stats=state.frame_stats)
+                else:
+                    # Stop current mixer source if any, before adding new one
+                    if state.mixer.is_playing():
+                        state.mixer.stop()
+
+                state.is_passthrough = False
+                await state.mixer.add_source('music', source, volume=state.effective_volume())
+                state.music_source = source
+
+                started_player = False
+                if state.voice_client and state.voice_client.source is not state.mixer:
+                    self._play_mixer(state)
+                    started_player = True
+                elif state.voice_client and state.voice_client.source is state.mixer and not state.mixer.is_playing():
+                    # If mixer is already the source but not playing (e.g., after a seek), start it
+                    self._play_mixer(state)
+                    started_player = True
+                if started_player and self.admission and self.admission.under_pressure():
+                    # A fresh encoder was created by play(); make it cheaper before it encodes its first frame
+                    vc = state.voice_client
+                    state.mixer.call_soon(lambda: set_encoder_complexity(vc.encoder, self.reduced_encoder_complexity))
+                    self.metrics.counter("music_encoder_downgrades_total").inc()
 
 
             if is_seek_operation:
                 state.is_seeking = False
-
-            if state.last_text_channel_id and track_to_play.requester_id and not is_seek_operation:
+            state.consecutive_failures = 0
+            if not is_seek_operation:
+                state.recent_urls.append(track_to_play.url)
+                if self.play_history and track_to_play.url.startswith(("http://", "https://")):
+                    self.play_history.record(guild_id, track_to_play)
+                if state.autoplay and state.queue.empty():
+                    self._prepare_autoplay(state, track_to_play)
+
+            if self.now_playing_panels:
+                if state.last_text_channel_id and not is_seek_operation:
+                    self.now_playing_panels.show(guild_id, state.last_text_channel_id)
+                else:
+                    self.now_playing_panels.touch(guild_id)
+            elif state.last_text_channel_id and track_to_play.requester_id and not is_seek_operation:
                 try:
                     requester = self.get_user(track_to_play.requester_id) or await self.fetch_user( # Use self.get_user
                         track_to_play.requester_id)
@@ -464,22 +935,252 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
                 )
         except Exception as e:
             guild = self.get_guild(guild_id)
-            logger.error(f"Guild {guild_id} ({guild.name if guild else ''}): Playback error: {e}", exc_info=True)
-            error_message = self.exception_handler.handle_error(e, guild)
-            if state.last_text_channel_id:
-                await self._send_background_message(state.last_text_channel_id, "error_message_wrapper",
-                                                    error=error_message)
-            if state.loop_mode == LoopMode.ALL and track_to_play and not is_seek_operation:
-                await state.queue.put(track_to_play)
             state.current_track = None
             state.is_seeking = False
             state.is_playing = False
+            state.is_passthrough = False
             state.reset_playback_tracking()
-            asyncio.create_task(self._play_next_song(guild_id))
+            state.consecutive_failures += 1
+            if track_to_play and track_to_play.autoplay and not is_seek_operation:
+                state.autoplay_rejects.append(track_to_play.url)
+            retry_in = self.retry_policy.delay(state.consecutive_failures)
+
+            if isinstance(e, CircuitOpenError) and retry_in is not None and not is_seek_operation:
+                # The whole site is failing: hold the track and try it again once the circuit allows
+                logger.warning(f"Guild {guild_id} ({guild.name if guild else ''}): {e}")
+                state.pending_retry = track_to_play
+                retry_in = max(retry_in, e.retry_after)
+            else:
+                logger.error(f"Guild {guild_id} ({guild.name if guild else ''}): Playback error: {e}", exc_info=True)
+                error_message = self.exception_handler.handle_error(e, guild)
+                if state.last_text_channel_id:
+                    await self._send_background_message(state.last_text_channel_id, "error_message_wrapper",
+                                                        error=error_message)
+                # Tracks whose extraction failed are not requeued, so LoopMode.ALL cannot cycle them forever
+                if (state.loop_mode == LoopMode.ALL and track_to_play and not is_seek_operation
+                        and track_to_play.url not in self.negative_cache):
+                    await state.queue.put(track_to_play)
+
+            if retry_in is None:
+                # Too many failures in a row: stop advancing until someone plays or skips again
+                logger.warning(f"Guild {guild_id}: {state.consecutive_failures} consecutive playback failures, "
+                               f"pausing queue advance")
+                if state.last_text_channel_id:
+                    await self._send_background_message(state.last_text_channel_id, "playback_failures_halted",
+                                                        count=state.consecutive_failures)
+                state.consecutive_failures = 0
+                if self.admission:
+                    self.admission.release(guild_id)
+                return
+            self._schedule_advance(guild_id, retry_in)
+
+    def _cookies_relayed(self, track: Track) -> bool:
+        return bool(track.http_cookies and self.stream_relay and self.stream_relay.running)
+
+    def _input_url(self, track: Track) -> str:
+        if self._cookies_relayed(track):
+            # Session cookies are attached by the relay; on FFmpeg's command line any local user could read them
+            return self.stream_relay.proxy_url(track.stream_url, track.http_headers, track.http_cookies)
+        # Progressive HTTP streams go through the local relay so repeats, seeks and other guilds hit its cache
+        if self.stream_relay and self.stream_relay.accepts(track):
+            return self.stream_relay.local_url(track.url, track.stream_url, track.http_headers)
+        return track.stream_url
+
+    def _input_options(self, track: Track, seek_seconds: Optional[int] = None) -> Tuple[str, str]:
+        return input_options_for(self.ffmpeg_profiles, track, base_options=self.ffmpeg_before_options,
+                                 seek_seconds=seek_seconds, relayed=self._cookies_relayed(track))
+
+    @staticmethod
+    def _is_local_file(track: Track) -> bool:
+        if not track.stream_url:
+            return False
+        try:
+            return Path(track.stream_url).is_file()
+        except Exception:
+            return False
+
+    async def _admit_playback(self, state: GuildState, kind: str) -> bool:
+        if not self.admission:
+            return True
+        if not self.admission.is_admitted(state.guild_id) and kind == TRANSCODE and self.admission.is_saturated():
+            if state.last_text_channel_id:
+                await self._send_background_message(state.last_text_channel_id, "waiting_for_capacity")
+        started = time.perf_counter()
+        admitted = await self.admission.acquire(state.guild_id, kind)
+        self.metrics.histogram("music_admission_wait_seconds").observe(time.perf_counter() - started)
+        return admitted
+
+    def _schedule_advance(self, guild_id: int, delay: float):
+        state = self._get_guild_state(guild_id)
+        if not state:
+            return
+        state.cancel_advance()
+
+        async def _advance_later():
+            await asyncio.sleep(delay)
+            await self._play_next_song(guild_id)
+
+        state.advance_task = asyncio.create_task(_advance_later())
+
+    def _create_stream_relay(self, *, progressive: bool) -> "StreamRelay":
+        from services.stream_relay import StreamRelay
+        return StreamRelay(
+            Path(self.relay_config.get('cache_dir', './cache/relay')),
+            max_cache_bytes=int(self.relay_config.get('max_cache_mb', 1024) * 1024 * 1024),
+            block_size=int(self.relay_config.get('block_size_kb', 512) * 1024),
+            readahead_blocks=self.relay_config.get('readahead_blocks', 2),
+            per_host_connections=self.relay_config.get('per_host_connections', 4),
+            max_streams=self.relay_config.get('max_streams', 4096),
+            port=self.relay_config.get('port', 0),
+            progressive=progressive
+        )
+
+    async def _ensure_cookie_relay(self):
+        # Streams that need session cookies always go through the relay, even when its caching is disabled
+        if self.stream_relay is None:
+            self.stream_relay = self._create_stream_relay(progressive=False)
+        if not self.stream_relay.running:
+            try:
+                await self.stream_relay.start()
+            except OSError as e:
+                logger.error(f"Stream relay could not start, passing cookies to FFmpeg directly: {e}")
+
+    async def _resolve_stream(self, track: Track):
+        # Known-bad URLs and sites that are failing broadly are not sent to the extractor again
+        failure = self.negative_cache.get(track.url)
+        if failure:
+            raise RuntimeError(failure)
+        extractor = track.extractor or "generic"
+        retry_after = self.circuit_breaker.retry_after(extractor)
+        if retry_after > 0:
+            raise CircuitOpenError(extractor, retry_after)
+
+        resolve_started = time.perf_counter()
+        try:
+            updated_track = await ensure_stream(track)
+            if not updated_track or not updated_track.stream_url:
+                raise RuntimeError(f"'{track.title}' の有効なストリームURLを取得できませんでした。")
+        except Exception as e:
+            self.metrics.counter("music_resolve_failures_total", extractor=extractor).inc()
+            self.circuit_breaker.record_failure(extractor)
+            # Only failures that will not change on retry (removed, private, geo-blocked) are pinned to the URL;
+            # transient network errors just count toward the breaker, and a tripped breaker is blamed on the site
+            if self.circuit_breaker.retry_after(extractor) == 0 and is_permanent_failure(e):
+                self.negative_cache.record(track.url, str(e))
+            raise
+        self.circuit_breaker.record_success(extractor)
+        track.stream_url = updated_track.stream_url
+        if track.http_cookies:
+            await self._ensure_cookie_relay()
+        self.metrics.histogram("music_resolve_seconds", extractor=extractor).observe(
+            time.perf_counter() - resolve_started)
+
+    async def _warm_up_popular_tracks(self):
+        # Low priority: wait for startup to settle, go one track at a time, and back off whenever playback is busy
+        await asyncio.sleep(self.warm_up_delay)
+        started = time.perf_counter()
+        warmed = 0
+        for entry in self.play_history.top(self.warm_up_tracks):
+            while self.admission and self.admission.under_pressure():
+                await asyncio.sleep(max(self.warm_up_interval, 5.0))
+            track = Track(url=entry.url, title=entry.title, duration=entry.duration, extractor=entry.extractor)
+            try:
+                await self._resolve_stream(track)
+                if self.warm_up_relay_blocks > 0 and self.stream_relay and self.stream_relay.accepts(track):
+                    await self.stream_relay.warm(track.url, track.stream_url, track.http_headers,
+                                                 self.warm_up_relay_blocks)
+            except Exception as e:
+                logger.debug(f"Warm-up: skipping '{entry.title}': {e}")
+                continue
+            if self.warm_up_loudness and self.loudness and not self.loudness.has_measurement(track.url):
+                self.loudness.request_measurement(
+                    track.url, self._input_url(track),
+                    before_options=self._input_options(track)[1]
+                )
+            warmed += 1
+            self.metrics.counter("music_warm_up_tracks_total").inc()
+            await asyncio.sleep(self.warm_up_interval)
+        logger.info(f"Warm-up: resolved {warmed} popular tracks in {time.perf_counter() - started:.1f}s")
+
+    def _prepare_autoplay(self, state: GuildState, track: Track):
+        # Runs as a track starts: if the index has no follower for it, fetch the related mix now so the
+        # track boundary finds it in the extractor cache instead of waiting on yt-dlp
+        if self.co_play and self.co_play.next_for(track.url, self._autoplay_exclusions(state)):
+            return
+        mix_url = related_mix_url(track.url) if self.autoplay_related and self.extractor_cache_enabled else None
+        if mix_url:
+            asyncio.create_task(self._related_tracks(mix_url))
+
+    async def _related_tracks(self, mix_url: str) -> List[Track]:
+        try:
+            result = await extract_audio_data(mix_url, max_playlist_items=self.autoplay_related_items)
+        except Exception as e:
+            logger.warning(f"Autoplay: related extraction failed for {mix_url}: {e}")
+            return []
+        return result if isinstance(result, list) else [result] if result else []
+
+    @staticmethod
+    def _autoplay_exclusions(state: GuildState) -> set:
+        return set(state.recent_urls).union(state.autoplay_rejects)
+
+    async def _pick_autoplay_track(self, state: GuildState) -> Optional[Track]:
+        if not state.recent_urls:
+            return None
+        seed = state.recent_urls[-1]
+        exclude = self._autoplay_exclusions(state)
+        url = self.co_play.next_for(seed, exclude) if self.co_play else None
+        if url:
+            entry = self.play_history.tracks[url]
+            track = Track(url=url, title=entry.title, duration=entry.duration, extractor=entry.extractor)
+            source = "index"
+        else:
+            # Index miss only: ask the site for related videos
+            mix_url = related_mix_url(seed) if self.autoplay_related else None
+            if not mix_url:
+                return None
+            track = next((t for t in await self._related_tracks(mix_url) if t.url not in exclude), None)
+            if not track:
+                return None
+            track.stream_url = None  # Flat playlist entries carry the watch page, not a stream
+            source = "related"
+        track.autoplay = True
+        self.metrics.counter("music_autoplay_picks_total", source=source).inc()
+        if state.last_text_channel_id:
+            await self._send_background_message(state.last_text_channel_id, "autoplay_next", title=track.title)
+        return track
+
+    def _first_frame_recorder(self, state: GuildState, profile_name: str, path: str):
+        histogram = self.metrics.histogram("music_first_frame_seconds", profile=profile_name, path=path)
+
+        def record(seconds: float):
+            # Called once from the voice thread with the seconds between FFmpeg spawn and the first audio frame
+            histogram.observe(seconds)
+            recovery_started_at, state.recovery_started_at = state.recovery_started_at, None
+            if recovery_started_at is not None:
+                self.metrics.histogram("music_recovery_seconds").observe(time.perf_counter() - recovery_started_at)
+
+        return record
+
+    def _ended_early(self, state: GuildState, track: Track) -> bool:
+        # A source that stops before the track's known end (or a livestream that stops at all) died mid-stream
+        if track.is_live:
+            return True
+        if not track.duration:
+            return False
+        return state.get_current_position() < track.duration - self.recovery_end_tolerance
+
+    def _on_loudness_measured(self, guild_id: int, track_url: str, gain: float):
+        state = self.guild_states.get(guild_id)
+        if not state or not state.current_track or state.current_track.url != track_url:
+            return
+        state.track_gain = gain
+        # Apply to the running mixer; a passthrough stream keeps unity gain until the next play
+        if state.mixer and not state.is_passthrough:
+            asyncio.create_task(state.mixer.set_volume('music', state.effective_volume()))
 
     async def _song_finished_callback(self, error: Optional[Exception], guild_id: int):
         state = self._get_guild_state(guild_id)
-        if not state or state.is_seeking:
+        if not state or state.is_seeking or state.is_suspended:
             return
 
         if state.mixer:
@@ -488,7 +1189,24 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
             pass
 
         finished_track = state.current_track
+        user_stopped, state.stop_requested = state.stop_requested, False
+        if (self.stream_recovery_enabled and finished_track and not user_stopped
+                and state.recovery_attempts < self.max_recovery_attempts
+                and self._ended_early(state, finished_track)):
+            # The stream URL expired or the connection died: re-resolve and resume where it stopped
+            position = 0 if finished_track.is_live else state.get_current_position()
+            state.recovery_attempts += 1
+            get_extractor_backend().invalidate(finished_track.url)  # a cached resolve would hand back the dead URL
+            state.recovery_started_at = time.perf_counter()
+            self.metrics.counter("music_stream_recoveries_total",
+                                 extractor=finished_track.extractor or "generic").inc()
+            logger.warning(f"Guild {guild_id}: '{finished_track.title}' ended early at {position}s "
+                           f"(error: {error}), recovering (attempt {state.recovery_attempts})")
+            await self._restart_current_track(guild_id, position)
+            return
+
         state.is_playing = False
+        state.is_passthrough = False
         state.current_track = None
         state.reset_playback_tracking()
 
@@ -525,20 +1243,31 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
 
     async def _cleanup_guild_state(self, guild_id: int):
         state = self.guild_states.pop(guild_id, None)
+        if self.now_playing_panels:
+            self.now_playing_panels.close(guild_id)
         if state:
+            self._leave_radio(state)
             await state.cleanup_voice_client()
+            state.cancel_advance()
+            state.cancel_pause_release()
+            self._flush_encoder_meter(state)
+            if self.admission:
+                self.admission.release(guild_id)
             if state.auto_leave_task and not state.auto_leave_task.done():
                 state.auto_leave_task.cancel()
             await state.clear_queue()
             guild = self.get_guild(guild_id)
             logger.info(f"Guild {guild_id} ({guild.name if guild else ''}): State cleaned up")
 
-    @commands.Bot.event
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState,
                                     after: discord.VoiceState):
         if member.id == self.user.id and before.channel and not after.channel:
             await self._cleanup_guild_state(member.guild.id)
             return
+        if member.id == self.user.id and after.channel and before.channel != after.channel:
+            moved_state = self.guild_states.get(member.guild.id)
+            if moved_state:
+                self._adapt_encoder_bitrate(moved_state, after.channel)
 
         guild_id = member.guild.id
         if guild_id not in self.guild_states:
@@ -559,6 +1288,13 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
         elif state.auto_leave_task and not state.auto_leave_task.done():
             state.auto_leave_task.cancel()
 
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        if getattr(before, "bitrate", None) == getattr(after, "bitrate", None):
+            return
+        state = self.guild_states.get(after.guild.id)
+        if state and state.voice_client and state.voice_client.channel and state.voice_client.channel.id == after.id:
+            self._adapt_encoder_bitrate(state, after)
+
     @app_commands.command(name="play", description="曲を再生またはキューに追加します。")
     @app_commands.describe(query="再生したい曲のタイトル、またはURL")
     async def play_slash(self, interaction: discord.Interaction, query: str):
@@ -586,53 +1322,118 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
                 self.exception_handler.get_message("searching_for_song", query=query)
             )
 
-            extracted_media = await extract_audio_data(query, shuffle_playlist=False)
+            extracted_media = await extract_audio_data(query, shuffle_playlist=False,
+                                                       hedged_search=self.hedged_search)
 
             if not extracted_media:
-                await interaction.channel.send(
-                    self.exception_handler.get_message("search_no_results", query=query)
-                )
+                await self._send_background_message(interaction.channel.id, "search_no_results", query=query)
                 return
 
             tracks = extracted_media if isinstance(extracted_media, list) else [extracted_media]
-            added_count, first_track = 0, None
-
-            for track in tracks:
-                if state.queue.qsize() < self.max_queue_size:
-                    track.requester_id = interaction.user.id
-                    track.stream_url = None
-                    await state.queue.put(track)
-                    if added_count == 0:
-                        first_track = track
-                    added_count += 1
-                else:
-                    await interaction.channel.send(
-                        self.exception_handler.get_message("max_queue_size_reached",
-                                                           max_size=self.max_queue_size)
-                    )
-                    break
+            added_count = await self._enqueue_tracks(interaction, state, tracks)
+            first_track = tracks[0] if added_count else None
 
             if added_count > 1:
-                await interaction.channel.send(
-                    self.exception_handler.get_message("added_playlist_to_queue",
-                                                       count=added_count)
-                )
+                await self._send_background_message(interaction.channel.id, "added_playlist_to_queue",
+                                                    count=added_count)
             elif added_count == 1 and first_track:
-                await interaction.channel.send(
-                    self.exception_handler.get_message("added_to_queue",
-                                                       title=first_track.title,
-                                                       duration=format_duration(first_track.duration),
-                                                       requester_display_name=interaction.user.display_name)
-                )
+                await self._send_background_message(interaction.channel.id, "added_to_queue",
+                                                    title=first_track.title,
+                                                    duration=format_duration(first_track.duration),
+                                                    requester_display_name=interaction.user.display_name)
 
             if not was_playing:
                 await self._play_next_song(interaction.guild.id)
 
         except Exception as e:
             error_message = self.exception_handler.handle_error(e, interaction.guild)
-            await interaction.channel.send(
-                self.exception_handler.get_message("error_message_wrapper", error=error_message)
+            await self._send_background_message(interaction.channel.id, "error_message_wrapper",
+                                                error=error_message)
+        finally:
+            state.is_loading = False
+
+    async def _enqueue_tracks(self, interaction: discord.Interaction, state: GuildState, tracks: List[Track]) -> int:
+        for track in tracks:
+            track.requester_id = interaction.user.id
+            track.stream_url = None
+        # One bulk operation admits as many tracks as fit in the queue size limit and the memory budget
+        added_count = state.queue.extend(tracks, max_size=self.max_queue_size)
+        if added_count < len(tracks):
+            if state.queue.qsize() >= self.max_queue_size:
+                await self._send_background_message(interaction.channel.id, "max_queue_size_reached",
+                                                    max_size=self.max_queue_size)
+            else:
+                logger.warning(f"Guild {interaction.guild.id}: memory budget admitted {added_count}/{len(tracks)} "
+                               f"tracks (global {self.memory_budget.used_bytes} bytes)")
+                await self._send_background_message(interaction.channel.id, "queue_memory_limited",
+                                                    added=added_count, requested=len(tracks))
+        return added_count
+
+    @app_commands.command(name="playmany", description="複数の曲をまとめてキューに追加します。")
+    @app_commands.describe(queries="曲のタイトルまたはURLを ; または改行で区切って指定")
+    async def playmany_slash(self, interaction: discord.Interaction, queries: str):
+        await interaction.response.defer()
+
+        state = self._get_guild_state(interaction.guild.id)
+        if not state:
+            await interaction.followup.send("サーバーの上限に達しています。", ephemeral=True)
+            return
+
+        query_list = [q.strip() for q in queries.replace("\n", ";").split(";") if q.strip()]
+        query_list = query_list[:self.playmany_max_queries]
+        if not query_list:
+            await self._send_response(interaction, "search_no_results", ephemeral=True, query=queries)
+            return
+
+        vc = await self._ensure_voice(interaction, connect_if_not_in=True)
+        if not vc:
+            return
+
+        if state.queue.qsize() >= self.max_queue_size:
+            await self._send_response(interaction, "max_queue_size_reached",
+                                      max_size=self.max_queue_size)
+            return
+
+        was_playing = state.is_playing or state.is_loading
+        state.is_loading = True
+        added_total = 0
+        try:
+            await interaction.followup.send(
+                self.exception_handler.get_message("searching_for_song", query=f"{len(query_list)} queries")
             )
+
+            async def resolve(query: str):
+                return await extract_audio_data(query, shuffle_playlist=False, hedged_search=self.hedged_search)
+
+            # Queries resolve concurrently but are enqueued in the order they were given,
+            # as soon as every earlier query has finished
+            results = resolve_in_order(query_list, resolve, concurrency=self.playmany_concurrency)
+            try:
+                async for query, extracted_media, error in results:
+                    if error or not extracted_media:
+                        if error:
+                            logger.warning(f"Guild {interaction.guild.id}: playmany query {query!r} failed: {error}")
+                        await self._send_background_message(interaction.channel.id, "search_no_results", query=query)
+                        continue
+                    tracks = extracted_media if isinstance(extracted_media, list) else [extracted_media]
+                    added = await self._enqueue_tracks(interaction, state, tracks)
+                    added_total += added
+                    if added < len(tracks):
+                        break  # Queue is full
+                    if added and not was_playing and not state.is_playing:
+                        # Start with the first result instead of waiting for the whole batch
+                        await self._play_next_song(interaction.guild.id)
+            finally:
+                # Closing the generator now (not at garbage collection) cancels the resolutions still in flight
+                await results.aclose()
+
+            if added_total:
+                await self._send_background_message(interaction.channel.id, "added_playlist_to_queue",
+                                                    count=added_total)
+        except Exception as e:
+            error_message = self.exception_handler.handle_error(e, interaction.guild)
+            await self._send_background_message(interaction.channel.id, "error_message_wrapper",
+                                                error=error_message)
         finally:
             state.is_loading = False
 
@@ -663,16 +1464,8 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
                                       duration=format_duration(state.current_track.duration))
             return
 
-        state.is_seeking = True
-        # Stop current playback to allow seek to take effect
-        if state.voice_client and state.voice_client.is_playing():
-            state.voice_client.stop()
-        if state.mixer:
-            state.mixer.stop()
-        
         await self._send_response(interaction, "seeked_to_position", position=format_duration(seek_seconds))
-        await self._play_next_song(interaction.guild.id, seek_seconds=seek_seconds)
-        state.is_seeking = False # Reset after _play_next_song is called
+        await self._restart_current_track(interaction.guild.id, seek_seconds)
 
     @app_commands.command(name="pause", description="再生を一時停止します。")
     async def pause_slash(self, interaction: discord.Interaction):
@@ -688,10 +1481,7 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
             await self._send_response(interaction, "error_playing", ephemeral=True, error="既に一時停止中です。")
             return
 
-        if state.voice_client:
-            state.voice_client.pause()
-        state.is_paused = True
-        state.paused_at = time.time()
+        self._pause_playback(state)
         await self._send_response(interaction, "playback_paused")
 
     @app_commands.command(name="resume", description="一時停止中の再生を再開します。")
@@ -704,14 +1494,93 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
             await self._send_response(interaction, "error_playing", ephemeral=True, error="一時停止中ではありません。")
             return
 
+        if state.is_suspended and not interaction.response.is_done():
+            await interaction.response.defer()  # Rebuilding the pipeline re-resolves the stream
+        await self._resume_playback(state)
+        await self._send_response(interaction, "playback_resumed")
+
+    def _pause_playback(self, state: GuildState):
         if state.voice_client:
+            state.voice_client.pause()
+        state.is_paused = True
+        state.cancel_pause_release()
+        if self.pause_release_timeout > 0:
+            state.pause_release_task = asyncio.create_task(self._release_paused_pipeline(state.guild_id))
+        if self.now_playing_panels:
+            self.now_playing_panels.touch(state.guild_id)
+
+    async def _resume_playback(self, state: GuildState):
+        state.cancel_pause_release()
+        if state.is_suspended and state.current_track:
+            # The pipeline was released during a long pause: re-resolve and seek back to where it stopped
+            state.is_suspended = False
+            position = 0 if state.current_track.is_live else state.seek_position
+            self.metrics.counter("music_paused_pipelines_rebuilt_total").inc()
+            logger.info(f"Guild {state.guild_id}: Rebuilding released pipeline at {position}s")
+            await self._restart_current_track(state.guild_id, position)
+        elif state.voice_client:
             state.voice_client.resume()
         state.is_paused = False
-        if state.paused_at and state.playback_start_time:
-            pause_duration = time.time() - state.paused_at
-            state.playback_start_time += pause_duration
-        state.paused_at = None
-        await self._send_response(interaction, "playback_resumed")
+        state.frame_stats.reset_timing()
+        if self.now_playing_panels:
+            self.now_playing_panels.touch(state.guild_id)
+
+    async def _release_paused_pipeline(self, guild_id: int):
+        await asyncio.sleep(self.pause_release_timeout)
+        state = self.guild_states.get(guild_id)
+        if not state or not state.is_paused or state.is_suspended or not state.current_track:
+            return
+        # Keep the track and the position, drop FFmpeg, its HTTP connection, the mixer and the admission slot
+        state.seek_position = state.get_current_position()
+        state.is_suspended = True
+        state.music_source = None
+        if state.mixer:
+            state.mixer.stop()
+            state.mixer = None
+        if state.voice_client:
+            state.voice_client.stop()
+        state.is_passthrough = False
+        if self.admission:
+            self.admission.release(guild_id)
+        self.metrics.counter("music_paused_pipelines_released_total").inc()
+        logger.info(f"Guild {guild_id}: Released the playback pipeline after a {self.pause_release_timeout}s pause "
+                    f"at {state.seek_position}s")
+
+    def _is_listening(self, user, state: GuildState) -> bool:
+        voice = getattr(user, 'voice', None)
+        return bool(voice and voice.channel and state.voice_client and voice.channel == state.voice_client.channel)
+
+    async def _panel_toggle_pause(self, interaction: discord.Interaction, guild_id: int):
+        state = self.guild_states.get(guild_id)
+        if not state or not state.current_track:
+            await self._send_response(interaction, "now_playing_nothing", ephemeral=True)
+            return
+        if not self._is_listening(interaction.user, state):
+            await self._send_response(interaction, "join_voice_channel_first", ephemeral=True)
+            return
+        state.update_activity()
+        # The panel edit itself is the feedback; just acknowledge the click (before a possible pipeline rebuild)
+        await interaction.response.defer()
+        if state.is_paused:
+            await self._resume_playback(state)
+        elif state.is_playing:
+            self._pause_playback(state)
+
+    async def _panel_skip(self, interaction: discord.Interaction, guild_id: int):
+        state = self.guild_states.get(guild_id)
+        if not state or not state.current_track:
+            await self._send_response(interaction, "nothing_to_skip", ephemeral=True)
+            return
+        if not self._is_listening(interaction.user, state):
+            await self._send_response(interaction, "join_voice_channel_first", ephemeral=True)
+            return
+        state.update_activity()
+        await interaction.response.defer()
+        if state.is_suspended:
+            await self._skip_suspended(state)
+        elif state.voice_client:
+            state.stop_requested = True
+            state.voice_client.stop()
 
     @app_commands.command(name="skip", description="再生中の曲をスキップします。")
     async def skip_slash(self, interaction: discord.Interaction):
@@ -722,16 +1591,36 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
 
         await interaction.response.defer()
         vc = await self._ensure_voice(interaction, connect_if_not_in=False)
+        if vc and state.radio_listener:
+            # Skipping on a station skips for every guild tuned into it
+            station = state.radio_listener.station
+            if not station.current_track:
+                await self._send_response(interaction, "nothing_to_skip", ephemeral=True)
+                return
+            await self._send_response(interaction, "skipped_song", title=station.current_track.title)
+            station.skip()
+            return
         if not vc or not state.current_track:
             await self._send_response(interaction, "nothing_to_skip", ephemeral=True)
             return
 
         await self._send_response(interaction, "skipped_song", title=state.current_track.title)
+        if state.is_suspended:
+            await self._skip_suspended(state)
+            return
         # Stop the current playback directly to trigger the mixer_finished_callback
         if state.voice_client and state.voice_client.is_playing():
+            state.stop_requested = True
             state.voice_client.stop()
         # The mixer_finished_callback will then call _song_finished_callback to play the next song.
 
+    async def _skip_suspended(self, state: GuildState):
+        # No pipeline is left to end on its own, so finish the track the way the end-of-track callback would
+        state.is_suspended = False
+        state.cancel_pause_release()
+        state.stop_requested = True
+        await self._song_finished_callback(None, state.guild_id)
+
     @app_commands.command(name="stop", description="再生を停止し、キューをクリアします。")
     async def stop_slash(self, interaction: discord.Interaction):
         state = self._get_guild_state(interaction.guild.id)
@@ -744,7 +1633,17 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
             return
 
         state.loop_mode = LoopMode.OFF
+        self._leave_radio(state)
         await state.clear_queue()
+        state.cancel_advance()
+        state.cancel_pause_release()
+        state.is_suspended = False
+        state.pending_retry = None
+        state.stop_requested = True
+        state.recent_urls.clear()  # Leaves autoplay without a seed, so the stopped track is not followed up
+        state.autoplay_rejects.clear()
+        if self.admission:
+            self.admission.release(interaction.guild.id)
         if state.mixer:
             state.mixer.stop()
             state.mixer = None
@@ -752,8 +1651,11 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
             state.voice_client.stop()
         state.is_playing = False
         state.is_paused = False
+        state.is_passthrough = False
         state.current_track = None
         state.reset_playback_tracking()
+        if self.now_playing_panels:
+            self.now_playing_panels.close(interaction.guild.id, self.exception_handler.get_message("stopped_playback"))
         await self._send_response(interaction, "stopped_playback")
 
     @app_commands.command(name="leave", description="ボットをボイスチャンネルから切断します。")
@@ -784,7 +1686,7 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
             return
 
         items_per_page = 10
-        queue_list = list(state.queue._queue)
+        queue_list = state.queue.snapshot()
         total_items = len(queue_list)
         total_pages = math.ceil(len(queue_list) / items_per_page) if len(queue_list) > 0 else 1
 
@@ -805,8 +1707,7 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
                 status_icon = '▶️' if state.is_playing else '⏸️'
                 current_pos = state.get_current_position()
                 lines.append(
-                    f"**{status_icon} {track.title}** (`{format_duration(current_pos)}/{format_duration(track.duration)}`) - Req: **{requester.display_name if requester else '不明'}**
-"
+                    f"**{status_icon} {track.title}** (`{format_duration(current_pos)}/{format_duration(track.duration)}`) - Req: **{requester.display_name if requester else '不明'}**\n"
                 )
 
             start = (page_num - 1) * items_per_page
@@ -821,8 +1722,7 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
                     f"`{i}.` **{track.title}** (`{format_duration(track.duration)}`) - Req: **{requester.display_name if requester else '不明'}**"
                 )
 
-            embed.description = "
-".join(lines) if lines else "このページには曲がありません。"
+            embed.description = "\n".join(lines) if lines else "このページには曲がありません。"
             if total_pages > 1:
                 embed.set_footer(text=f"ページ {page_num}/{total_pages}")
             return embed
@@ -948,31 +1848,46 @@ class MusicBot(commands.Bot): # Inherit from commands.Bot
             return
 
         track = state.current_track
-        status_icon = "▶️" if state.is_playing else ("⏸️" if state.is_paused else "⏹️")
         try:
             requester = interaction.guild.get_member(track.requester_id) or await self.fetch_user( # Use self.fetch_user
                 track.requester_id)
         except:
             requester = None
 
+        await interaction.response.send_message(embed=self._build_now_playing_embed(state, requester))
+
+    def _build_now_playing_embed(self, state: GuildState, requester) -> discord.Embed:
+        track = state.current_track
+        status_icon = "⏸️" if state.is_paused else ("▶️" if state.is_playing else "⏹️")
         current_pos = state.get_current_position()
         progress_bar = self._create_progress_bar(current_pos, track.duration)
 
         embed = discord.Embed(
             title=f"{status_icon} {track.title}",
             url=track.url,
-            description=f"{progress_bar}
-`{format_duration(current_pos)}` / `{format_duration(track.duration)}`
-
-リクエスト: **{requester.display_name if requester else '不明'}**
-URL: {track.url}
-ループモード: `{state.loop_mode.name.lower()}`",
-            color=discord.Color.green() if state.is_playing else (
-                discord.Color.orange() if state.is_paused else discord.Color.light_grey())
+            description=f"{progress_bar}\n`{format_duration(current_pos)}` / `{format_duration(track.duration)}`\n\nリクエスト: **{requester.display_name if requester else '不明'}**\nURL: {track.url}\nループモード: `{state.loop_mode.name.lower()}`",
+            color=discord.Color.orange() if state.is_paused else (
+                discord.Color.green() if state.is_playing else discord.Color.light_grey())
         )
         if track.thumbnail:
             embed.set_thumbnail(url=track.thumbnail)
-        await interaction.response.send_message(embed=embed)
+        return embed
+
+    def _render_now_playing_panel(self, guild_id: int) -> Optional[PanelRender]:
+        state = self.guild_states.get(guild_id)
+        if not state or not state.current_track:
+            return None
+        track = state.current_track
+        requester = None
+        if track.requester_id:
+            # Cache lookups only: panel refreshes must not spend extra REST calls
+            guild = self.get_guild(guild_id)
+            requester = (guild.get_member(track.requester_id) if guild else None) or self.get_user(track.requester_id)
+        refresh_after = None
+        if state.is_playing and not state.is_paused and track.duration > 0:
+            # Roughly one progress-bar cell per refresh, within the configured bounds
+            refresh_after = min(self.panel_max_interval, max(self.panel_min_interval, track.duration / 20))
+        return PanelRender(self._build_now_playing_embed(state, requester), refresh_after)
 
     def _create_progress_bar(self, current: int, total: int, length: int = 20) -> str:
         if total <= 0:
@@ -993,11 +1908,9 @@ URL: {track.url}
                                       error="シャッフルするにはキューに2曲以上必要です。")
             return
 
-        queue_list = list(state.queue._queue)
+        queue_list = state.queue.snapshot()
         random.shuffle(queue_list)
-        state.queue = asyncio.Queue()
-        for item in queue_list:
-            await state.queue.put(item)
+        state.queue.replace(queue_list)
         await self._send_response(interaction, "queue_shuffled")
 
     @app_commands.command(name="clear", description="再生キューを空にします（再生中の曲は停止しません）。")
@@ -1026,11 +1939,9 @@ URL: {track.url}
             await self._send_response(interaction, "invalid_queue_number", ephemeral=True)
             return
 
-        queue_list = list(state.queue._queue)
+        queue_list = state.queue.snapshot()
         removed_track = queue_list.pop(actual_index)
-        state.queue = asyncio.Queue()
-        for item in queue_list:
-            await state.queue.put(item)
+        state.queue.replace(queue_list)
         await self._send_response(interaction, "song_removed", title=removed_track.title)
 
     @app_commands.command(name="volume", description="音量を変更します (0-200)。")
@@ -1044,8 +1955,16 @@ URL: {track.url}
         state.volume = level / 100.0
         state.update_activity()
         if state.mixer:
-            await state.mixer.set_volume('music', state.volume)
+            await state.mixer.set_volume('music', state.effective_volume())
+        if state.radio_listener:
+            # Moves the guild to the station's encoder for this volume; loudness gain is applied by the station
+            state.radio_listener.set_volume(state.volume)
+        if self.now_playing_panels:
+            self.now_playing_panels.touch(interaction.guild.id)
         await self._send_response(interaction, "volume_set", volume=level)
+        if state.is_passthrough and state.current_track and not self._unity_level(state):
+            # Passthrough cannot scale the signal, so fall back to the mixer at the current position
+            await self._restart_current_track(interaction.guild.id, state.get_current_position())
 
     @app_commands.command(name="loop", description="ループ再生モードを設定します。")
     @app_commands.describe(mode="ループのモードを選択してください。")
@@ -1064,27 +1983,216 @@ URL: {track.url}
         mode_map = {"off": LoopMode.OFF, "one": LoopMode.ONE, "all": LoopMode.ALL}
         state.loop_mode = mode_map.get(mode.value, LoopMode.OFF)
         state.update_activity()
+        if self.now_playing_panels:
+            self.now_playing_panels.touch(interaction.guild.id)
         await self._send_response(interaction, f"loop_{mode.value}")
 
+    @app_commands.command(name="autoplay", description="キューが空になったとき、関連する曲を自動で再生します。")
+    @app_commands.describe(enabled="オン/オフ (省略すると切り替え)")
+    async def autoplay_slash(self, interaction: discord.Interaction, enabled: Optional[bool] = None):
+        state = self._get_guild_state(interaction.guild.id)
+        if not state:
+            await interaction.response.send_message("エラーが発生しました。", ephemeral=True)
+            return
+
+        await interaction.response.defer()
+        state.autoplay = not state.autoplay if enabled is None else enabled
+        state.update_activity()
+        if state.autoplay and state.current_track and state.queue.empty():
+            self._prepare_autoplay(state, state.current_track)
+        await self._send_response(interaction, "autoplay_on" if state.autoplay else "autoplay_off")
+
     @app_commands.command(name="join", description="ボットをあなたのいるボイスチャンネルに接続します。")
     async def join_slash(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         if await self._ensure_voice(interaction, connect_if_not_in=True):
             await interaction.followup.send(self.exception_handler.get_message("already_connected"), ephemeral=True)
 
+    @app_commands.command(name="radio", description="ラジオ局を開局・参加します。局名を省略すると一覧を表示します。")
+    @app_commands.describe(station="ラジオ局の名前", query="局のキューに追加する曲 (新しく開局するときは必須)")
+    async def radio_slash(self, interaction: discord.Interaction, station: Optional[str] = None,
+                          query: Optional[str] = None):
+        await interaction.response.defer()
+        state = self._get_guild_state(interaction.guild.id)
+        if not state:
+            await interaction.followup.send("サーバーの上限に達しています。", ephemeral=True)
+            return
+        if not self.radio_enabled:
+            await self._send_response(interaction, "radio_disabled", ephemeral=True)
+            return
+
+        if not station:
+            listing = [f"📻 **{s.name}** - {s.current_track.title if s.current_track else '準備中'} "
+                       f"({s.listener_count()})" for s in self.radio.stations.values() if not s.closed]
+            if not listing:
+                await self._send_response(interaction, "radio_none", ephemeral=True)
+            else:
+                await self._send_response(interaction, "radio_list", stations="\n".join(listing))
+            return
+
+        name = station.strip().lower()[:32]
+        vc = await self._ensure_voice(interaction, connect_if_not_in=True)
+        if not vc:
+            return
+
+        radio = self.radio.get(name)
+        created = False
+        if radio is None:
+            if not query:
+                await self._send_response(interaction, "radio_not_found", ephemeral=True, name=name)
+                return
+            if len(self.radio) >= self.radio.max_stations:
+                await self._send_response(interaction, "radio_limit_reached", ephemeral=True,
+                                          max_stations=self.radio.max_stations)
+                return
+            radio = self.radio.create(name, self._radio_source_for, self.loop)
+            created = True
+            # The station's single decode/encode counts as one transcode, however many guilds listen
+            if self.admission and not await self.admission.acquire(radio.key, TRANSCODE):
+                radio.close()
+                await self._send_response(interaction, "host_busy")
+                return
+
+        added = 0
+        if query:
+            await interaction.followup.send(self.exception_handler.get_message("searching_for_song", query=query))
+            try:
+                extracted_media = await extract_audio_data(query, shuffle_playlist=False,
+                                                           hedged_search=self.hedged_search)
+            except Exception as e:
+                extracted_media = None
+                logger.warning(f"Radio '{name}': query {query!r} failed: {e}")
+            tracks = (extracted_media if isinstance(extracted_media, list) else [extracted_media]) \
+                if extracted_media else []
+            for track in tracks:
+                track.requester_id = interaction.user.id
+                track.stream_url = None
+            added = radio.queue.extend(tracks, max_size=self.max_queue_size)
+            if not added:
+                await self._send_background_message(interaction.channel.id, "search_no_results", query=query)
+                if created:
+                    radio.close()
+                    return
+
+        state.update_last_text_channel(interaction.channel.id)
+        if not state.radio_listener or state.radio_listener.station is not radio:
+            self._tune_in(state, radio)
+        radio.start()
+        await self._send_response(interaction, "radio_tuned", name=radio.name, added=added,
+                                  listeners=radio.listener_count())
+
+    @app_commands.command(name="radio_leave", description="ラジオ局から抜けて、このサーバーのキューに戻ります。")
+    async def radio_leave_slash(self, interaction: discord.Interaction):
+        state = self._get_guild_state(interaction.guild.id)
+        if not state:
+            await interaction.response.send_message("エラーが発生しました。", ephemeral=True)
+            return
+        station = self._leave_radio(state)
+        if not station:
+            await self._send_response(interaction, "radio_not_tuned", ephemeral=True)
+            return
+        await self._send_response(interaction, "radio_left", name=station.name)
+        if not state.queue.empty() or state.pending_retry:
+            await self._play_next_song(interaction.guild.id)
+
+    def _tune_in(self, state: GuildState, station: "RadioStation"):
+        # Tear down the guild's own pipeline; its queue is kept for when it leaves the station
+        self._leave_radio(state)
+        state.cancel_advance()
+        state.stop_requested = True
+        if state.mixer:
+            state.mixer.stop()
+            state.mixer = None
+        if state.voice_client and (state.voice_client.is_playing() or state.voice_client.is_paused()):
+            state.voice_client.stop()
+        if state.current_track and state.loop_mode == LoopMode.ALL:
+            state.queue.put_nowait(state.current_track)
+        state.current_track = None
+        state.is_playing = False
+        state.is_paused = False
+        state.is_passthrough = False
+        state.reset_playback_tracking()
+        if self.admission:
+            self.admission.release(state.guild_id)
+        if self.now_playing_panels:
+            self.now_playing_panels.close(state.guild_id)
+
+        listener = station.listen(state.volume)
+        state.radio_listener = listener
+        guild_id = state.guild_id
+        if state.voice_client:
+            state.voice_client.play(listener, after=lambda e: self._radio_listener_finished(e, guild_id, listener))
+        logger.info(f"Guild {guild_id}: Tuned into radio '{station.name}' ({station.listener_count()} listeners)")
+
+    def _leave_radio(self, state: GuildState) -> Optional["RadioStation"]:
+        listener, state.radio_listener = state.radio_listener, None
+        if listener is None:
+            return None
+        if state.voice_client and state.voice_client.source is listener:
+            state.voice_client.stop()
+        listener.cleanup()
+        return listener.station
+
+    def _radio_listener_finished(self, error: Optional[Exception], guild_id: int, listener: "StationListener"):
+        # Called from the voice thread when the station closes or the connection ends
+        asyncio.run_coroutine_threadsafe(self._on_radio_listener_ended(error, guild_id, listener), self.loop)
+
+    async def _on_radio_listener_ended(self, error: Optional[Exception], guild_id: int,
+                                       listener: "StationListener"):
+        state = self.guild_states.get(guild_id)
+        if not state or state.radio_listener is not listener:
+            return  # Left on purpose (/radio_leave, /stop, re-tune)
+        state.radio_listener = None
+        if error:
+            logger.error(f"Guild {guild_id}: Radio playback error: {error}")
+        if state.last_text_channel_id:
+            await self._send_background_message(state.last_text_channel_id, "radio_ended",
+                                                name=listener.station.name)
+        if not state.queue.empty() or state.pending_retry:
+            await self._play_next_song(guild_id)
+
+    async def _radio_source_for(self, station: "RadioStation", track: Track) -> Tuple[discord.AudioSource, float]:
+        if not self._is_local_file(track):
+            await self._resolve_stream(track)
+        gain = self.loudness.get_gain(track.url) if self.loudness else 1.0
+        if self.loudness and not self.loudness.has_measurement(track.url):
+            self.loudness.request_measurement(
+                track.url, self._input_url(track),
+                before_options=self._input_options(track)[1],
+                on_done=station.set_track_gain
+            )
+        profile_name, ffmpeg_before_opts = self._input_options(track)
+        histogram = self.metrics.histogram("music_first_frame_seconds", profile=profile_name, path="radio")
+        source = MusicAudioSource(
+            self._input_url(track),
+            title=track.title,
+            guild_id=0,
+            on_first_frame=histogram.observe,
+            executable=self.ffmpeg_path,
+            before_options=ffmpeg_before_opts,
+            options=self.ffmpeg_options,
+            stderr=subprocess.PIPE
+        )
+        return source, gain
+
+    def _on_radio_closed(self, station: "RadioStation"):
+        if self.admission:
+            self.admission.release(station.key)
+
     @app_commands.command(name="music_help", description="音楽機能のコマンド一覧と使い方を表示します。")
     async def music_help_slash(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=False)
         embed = discord.Embed(
             title="🎵 音楽機能 ヘルプ / Music Feature Help",
-            description="音楽再生に関するコマンドの一覧です。
-All commands start with a slash (`/`).",
+            description="音楽再生に関するコマンドの一覧です。\nAll commands start with a slash (`/`).",
             color=discord.Color.from_rgb(79, 194, 255)
         )
         command_info = {
             "▶️ 再生コントロール / Playback Control": [
                 {"name": "play", "args": "<song name or URL>", "desc_ja": "曲を再生/キュー追加",
                  "en": "Play/add a song"},
+                {"name": "playmany", "args": "<query; query; ...>", "desc_ja": "複数の曲をまとめて追加",
+                 "en": "Add several songs at once"},
                 {"name": "pause", "args": "", "desc_ja": "一時停止", "en": "Pause"},
                 {"name": "resume", "args": "", "desc_ja": "再生再開", "en": "Resume"},
                 {"name": "stop", "args": "", "desc_ja": "再生停止＆キュークリア", "en": "Stop & clear queue"},
@@ -1103,15 +2211,18 @@ All commands start with a slash (`/`).",
             "🔊 ボイスチャンネル / Voice Channel": [
                 {"name": "join", "args": "", "desc_ja": "VCに接続", "en": "Join VC"},
                 {"name": "leave", "args": "", "en": "Leave VC", "desc_ja": "VCから切断"}
+            ],
+            "📻 ラジオ / Radio": [
+                {"name": "radio", "args": "[station] [query]", "desc_ja": "ラジオ局の一覧/開局/参加",
+                 "en": "List, open or tune into a station"},
+                {"name": "radio_leave", "args": "", "desc_ja": "ラジオ局から抜ける", "en": "Leave the station"}
             ]
         }
         # Get command names from the bot's tree
         cog_command_names = {cmd.name for cmd in self.tree.get_commands()}
         for category, commands_in_category in command_info.items():
             field_value = "".join(
-                f"`/{c['name']}{' ' + c['args'] if c['args'] else ''}`
-{c['desc_ja']} / {c['en']}
-"
+                f"`/{c['name']}{' ' + c['args'] if c['args'] else ''}`\n{c['desc_ja']} / {c['en']}\n"
                 for c in commands_in_category if c['name'] in cog_command_names
             )
             if field_value:
@@ -1121,13 +2232,117 @@ All commands start with a slash (`/`).",
         embed.set_footer(text=f"<> は引数を表します | Active: {active_guilds}/{self.max_guilds} servers")
         await interaction.followup.send(embed=embed)
 
+    @app_commands.command(name="profile", description="プロファイルを取得してファイルに書き出します (オーナー専用)。")
+    @app_commands.describe(action="取得する内容", seconds="CPUサンプリングの秒数")
+    @app_commands.choices(action=[
+        app_commands.Choice(name="CPUサンプリング (CPU sampling)", value="cpu"),
+        app_commands.Choice(name="メモリ追跡を開始 (Start tracemalloc)", value="memory_start"),
+        app_commands.Choice(name="メモリのスナップショット (Memory snapshot)", value="memory_snapshot"),
+        app_commands.Choice(name="メモリ追跡を停止 (Stop tracemalloc)", value="memory_stop"),
+        app_commands.Choice(name="asyncioタスク一覧 (Task dump)", value="tasks")
+    ])
+    async def profile_slash(self, interaction: discord.Interaction, action: app_commands.Choice[str],
+                            seconds: app_commands.Range[int, 1, 600] = 10):
+        if not await self.is_owner(interaction.user):
+            await interaction.response.send_message("このコマンドはボットのオーナーのみ使用できます。", ephemeral=True)
+            return
+        if self.profiler is None:
+            from services.profiling import Profiler
+            self.profiler = Profiler(
+                self.profiling_config.get('output_dir', './cache/profiles'),
+                sample_interval=self.profiling_config.get('sample_interval_ms', 5) / 1000,
+                max_seconds=self.profiling_config.get('max_seconds', 120),
+                top_n=self.profiling_config.get('top_n', 30)
+            )
+        profiler = self.profiler
+        if action.value == "memory_start":
+            started = profiler.memory_start()
+            await interaction.response.send_message(
+                "tracemalloc を開始しました。" if started else "tracemalloc は既に動いています。", ephemeral=True)
+            return
+        if action.value == "memory_stop":
+            stopped = profiler.memory_stop()
+            await interaction.response.send_message(
+                "tracemalloc を停止しました。" if stopped else "tracemalloc は動いていません。", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        try:
+            if action.value == "cpu":
+                path, samples, top = await profiler.sample_cpu(seconds)
+                lines = [f"CPU: {samples} samples -> {path}"]
+                lines.extend(f"{count:>6} {frame}" for frame, count in top)
+            elif action.value == "memory_snapshot":
+                path, total = await profiler.memory_snapshot()
+                lines = [f"memory: traced={total / 1048576:.1f}MiB -> {path}"]
+            else:
+                path, count = await profiler.dump_tasks()
+                lines = [f"tasks: {count} -> {path}"]
+        except (RuntimeError, OSError) as e:
+            await interaction.followup.send(f"プロファイルを取得できませんでした: {e}", ephemeral=True)
+            return
+        logger.info(f"Profile '{action.value}' written to {path}")
+        body = "\n".join(lines)
+        await interaction.followup.send(f"```\n{body}\n```", ephemeral=True)
+
+    @app_commands.command(name="music_stats", description="再生パイプラインの統計を表示します (オーナー専用)。")
+    async def music_stats_slash(self, interaction: discord.Interaction):
+        if not await self.is_owner(interaction.user):
+            await interaction.response.send_message("このコマンドはボットのオーナーのみ使用できます。", ephemeral=True)
+            return
+        lines = self.metrics.format_lines()
+        lines.append(f"message_scheduler sent={self.message_scheduler.sent_count} "
+                     f"coalesced={self.message_scheduler.coalesced_count} "
+                     f"pending={self.message_scheduler.pending_count()}")
+        if self.now_playing_panels:
+            lines.append(f"now_playing_panels edits={self.now_playing_panels.edit_count}")
+        lines.append(get_extractor_backend().format_stats())
+        if self.play_history:
+            lines.append(self.play_history.format_stats())
+            lines.append(self.co_play.format_stats())
+            for entry in self.play_history.top(5):
+                lines.append(f"top {entry.plays}x {entry.title[:60]}")
+        if self.hedged_search:
+            lines.append(self.hedged_search.format_stats())
+        lines.append(f"negative_cache entries={len(self.negative_cache)} hits={self.negative_cache.hits}")
+        for extractor, remaining in self.circuit_breaker.open_circuits().items():
+            lines.append(f"circuit_open {extractor} retry_in={remaining:.0f}s")
+        lines.append(f"guilds active={len(self.guild_states)} "
+                     f"suspended={sum(1 for state in self.guild_states.values() if state.is_suspended)}")
+        if self.admission:
+            lines.append(self.admission.format_stats())
+        budget = self.memory_budget
+        lines.append(f"queue_memory used={budget.used_bytes / 1048576:.1f}MiB "
+                     f"limit={budget.limit_bytes / 1048576:.0f}MiB rejected={budget.rejected_count}")
+        for guild_id, used in budget.top_owners():
+            lines.append(f"queue_memory guild {guild_id} {used / 1024:.0f}KiB")
+        if self.radio:
+            lines.extend(self.radio.format_stats())
+        if self.stream_relay:
+            lines.append(self.stream_relay.format_stats())
+        lines.extend(self.bitrate_stats.format_stats(
+            [state.encoder_meter for state in self.guild_states.values() if state.encoder_meter]))
+        for guild_id, state in self.guild_states.items():
+            if state.is_playing:
+                path = "passthrough" if state.is_passthrough else "mixer"
+                lines.append(f"guild {guild_id} {path} pos={state.get_current_position()}s "
+                             f"{state.frame_stats.format()}")
+        body = "\n".join(lines)
+        if len(body) > 1900:
+            body = body[:1900] + "\n..."
+        await interaction.response.send_message(f"```\n{body}\n```", ephemeral=True)
+
 # Main execution block
 async def main():
+    startup_timer = StartupTimer(_import_started_at)
+    startup_timer.mark("imports")
+
     # Configure logging
     logging.basicConfig(level=logging.INFO,
                         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
     config = load_config()
+    startup_timer.mark("config")
     if not config:
         logger.critical("Failed to load config. Exiting.")
         return
@@ -1143,7 +2358,8 @@ async def main():
     intents.guilds = True
     intents.members = True # Required for fetching members in queue/nowplaying
 
-    bot = MusicBot(config=config, intents=intents)
+    bot = MusicBot(config=config, intents=intents, startup_timer=startup_timer)
+    startup_timer.mark("bot_init")
 
     try:
         await bot.start(token)
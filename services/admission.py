@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+CTL_SET_COMPLEXITY = 4010  # OPUS_SET_COMPLEXITY_REQUEST (discord.py にはラッパーが無い)
+
+TRANSCODE = "transcode"  # FFmpeg デコード + ミキサー + Opus エンコード
+PASSTHROUGH = "passthrough"  # FFmpeg のデマルチプレクスのみ
+
+
+def set_encoder_complexity(encoder: Optional[discord.opus.Encoder], complexity: int) -> bool:
+    """
+    Opus エンコーダの計算量 (0-10) を変更する。エンコードと同じスレッドから呼ぶこと
+    (AudioMixer.call_soon を使う)。discord.py の内部属性を使うため、それが見つからない版では何もせず False を返す。
+    """
+    if encoder is None:
+        return False
+    encoder_ctl = getattr(getattr(discord.opus, "_lib", None), "opus_encoder_ctl", None)
+    state = getattr(encoder, "_state", None)
+    if encoder_ctl is None or state is None:
+        logger.debug("Opus encoder complexity cannot be set with this discord.py version")
+        return False
+    try:
+        encoder_ctl(state, CTL_SET_COMPLEXITY, max(0, min(10, complexity)))
+        return True
+    except Exception as e:
+        logger.debug(f"Failed to set Opus encoder complexity: {e}")
+        return False
+
+
+def _load_psutil():
+    try:
+        import psutil
+        return psutil
+    except ImportError:
+        return None
+
+
+class AdmissionController:
+    """
+    同時に動いているトランスコード数とホストの負荷を見て、新しい再生開始を受け入れるか決める。
+
+    ギルドごとに1枠で、同じギルドの次の曲や一時的な切り替えは枠を持ったまま行うので、既に再生中の
+    ギルドが待たされることはない。飽和しているときの新規ギルドは queue_timeout 秒まで先着順に待ち、
+    それでも空かなければ断る。負荷の取得には psutil があれば CPU 使用率を、無ければ loadavg を使う。
+    """
+
+    def __init__(self, *, max_transcodes: int = 0, max_load: float = 0.9, pressure_ratio: float = 0.75,
+                 queue_timeout: float = 20.0, sample_interval: float = 2.0):
+        cpus = os.cpu_count() or 1
+        self.max_transcodes = max_transcodes or cpus * 6
+        self.max_load = max_load
+        self.pressure_ratio = pressure_ratio
+        self.queue_timeout = queue_timeout
+        self.sample_interval = sample_interval
+        self._cpus = cpus
+        self._psutil = _load_psutil()
+        if self._psutil is not None:
+            self._psutil.cpu_percent(None)  # 最初の呼び出しは基準点を作るだけ
+        self._load = 0.0
+        self._sampled_at = 0.0
+        self.active: Dict[int, str] = {}
+        self._condition = asyncio.Condition()
+        self.waiting = 0
+        self.rejected_count = 0
+
+    def load(self) -> float:
+        """ホストの負荷 (CPU 1コアあたり、0.0-1.0 程度)。sample_interval ごとに取り直す。"""
+        now = time.monotonic()
+        if now - self._sampled_at >= self.sample_interval:
+            self._sampled_at = now
+            try:
+                if self._psutil is not None:
+                    self._load = self._psutil.cpu_percent(None) / 100
+                else:
+                    self._load = os.getloadavg()[0] / self._cpus
+            except (AttributeError, OSError):
+                self._load = 0.0  # getloadavg が無い環境 (Windows) ではトランスコード数だけで判断する
+        return self._load
+
+    def transcodes(self) -> int:
+        return sum(1 for kind in self.active.values() if kind == TRANSCODE)
+
+    def is_saturated(self) -> bool:
+        return self.transcodes() >= self.max_transcodes or self.load() >= self.max_load
+
+    def under_pressure(self) -> bool:
+        """新しいストリームのエンコード計算量を下げるべき状態か。"""
+        return (self.transcodes() >= self.max_transcodes * self.pressure_ratio
+                or self.load() >= self.max_load * self.pressure_ratio)
+
+    def is_admitted(self, guild_id: int) -> bool:
+        return guild_id in self.active
+
+    async def acquire(self, guild_id: int, kind: str = TRANSCODE) -> bool:
+        """guild_id の再生開始を受け入れれば True。既に枠を持っていれば種類を更新するだけ。"""
+        if guild_id in self.active:
+            self.active[guild_id] = kind
+            return True
+        if kind == PASSTHROUGH or not self.is_saturated():
+            self.active[guild_id] = kind
+            return True
+
+        deadline = time.monotonic() + self.queue_timeout
+        self.waiting += 1
+        try:
+            async with self._condition:
+                while self.is_saturated():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected_count += 1
+                        return False
+                    try:
+                        # 枠の解放で起こされるが、負荷の低下は通知されないので定期的にも確認する
+                        await asyncio.wait_for(self._condition.wait(), timeout=min(remaining, self.sample_interval))
+                    except asyncio.TimeoutError:
+                        pass
+                self.active[guild_id] = kind
+                return True
+        finally:
+            self.waiting -= 1
+
+    def release(self, guild_id: int):
+        if self.active.pop(guild_id, None) is None:
+            return
+
+        async def _notify():
+            async with self._condition:
+                self._condition.notify()
+
+        try:
+            asyncio.get_running_loop().create_task(_notify())
+        except RuntimeError:
+            pass  # イベントループ外 (終了処理中) では待っている人もいない
+
+    def format_stats(self) -> str:
+        return (f"admission transcodes={self.transcodes()}/{self.max_transcodes} "
+                f"passthrough={len(self.active) - self.transcodes()} load={self.load():.2f}/{self.max_load} "
+                f"waiting={self.waiting} rejected={self.rejected_count}")
@@ -0,0 +1,323 @@
+from __future__ import annotations
+
+import ctypes
+import threading
+import time
+from array import array
+from typing import Callable, Dict, Optional
+
+import discord
+
+np = None  # numpy は起動時間短縮のため、最初の AudioMixer 生成時に読み込む
+
+# --- フレーム定数 (discord.py の Opus エンコーダと同じ 20ms / 48kHz / 16bit ステレオ) ---
+SAMPLE_RATE = discord.opus.Encoder.SAMPLING_RATE
+CHANNELS = discord.opus.Encoder.CHANNELS
+FRAME_LENGTH_MS = discord.opus.Encoder.FRAME_LENGTH
+SAMPLES_PER_FRAME = discord.opus.Encoder.SAMPLES_PER_FRAME
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE  # 3840 bytes
+FRAME_VALUES = SAMPLES_PER_FRAME * CHANNELS  # 1フレームあたりの int16 サンプル数
+FRAME_SECONDS = FRAME_LENGTH_MS / 1000
+
+
+class FrameStats:
+    """
+    ボイス送信スレッドの read() 呼び出しを計測する (ギルドごとのジッター統計)。
+
+    - late_frames: 前回の read() から 1.5 フレーム以上空いた回数 (送信ループの遅延)
+    - underruns: read() 自体に 1 フレーム (20ms) 以上かかった回数 (FFmpeg の供給待ち・CPU 飽和)
+    - read() にかかった時間は直近 window 回分をリングバッファに保持してパーセンタイルを出す
+    """
+    __slots__ = ("frames", "late_frames", "underruns", "_durations", "_index", "_last_call")
+
+    LATE_THRESHOLD = FRAME_SECONDS * 1.5
+
+    def __init__(self, window: int = 500):
+        self.frames = 0
+        self.late_frames = 0
+        self.underruns = 0
+        self._durations = array("d", [0.0]) * window
+        self._index = 0
+        self._last_call: Optional[float] = None
+
+    def begin(self) -> float:
+        now = time.perf_counter()
+        if self._last_call is not None and now - self._last_call > self.LATE_THRESHOLD:
+            self.late_frames += 1
+        self._last_call = now
+        return now
+
+    def end(self, started: float, delivered: bool):
+        elapsed = time.perf_counter() - started
+        self._durations[self._index % len(self._durations)] = elapsed
+        self._index += 1
+        if elapsed > FRAME_SECONDS:
+            self.underruns += 1
+        if delivered:
+            self.frames += 1
+
+    def reset_timing(self):
+        """一時停止からの再開時に呼ぶ (停止していた間を遅延として数えない)。"""
+        self._last_call = None
+
+    def read_time_percentiles(self) -> Optional[Dict[str, float]]:
+        """read() にかかった時間のパーセンタイル (ミリ秒)。"""
+        count = min(self._index, len(self._durations))
+        if count == 0:
+            return None
+        values = sorted(self._durations[:count])
+        return {f"p{p}": values[min(count - 1, int(p / 100 * count))] * 1000 for p in (50, 95, 99)}
+
+    def format(self) -> str:
+        text = f"frames={self.frames} late={self.late_frames} underruns={self.underruns}"
+        percentiles = self.read_time_percentiles()
+        if percentiles:
+            text += " read_ms " + " ".join(f"{k}={v:.2f}" for k, v in percentiles.items())
+        return text
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+
+class MusicAudioSource(discord.FFmpegPCMAudio):
+    """
+    FFmpeg の PCM 出力を読むソース。ミキサーのバッファへ直接読み込める。
+
+    on_first_frame を渡すと、FFmpeg の起動から最初のフレームが読めるまでの秒数で一度だけ呼ばれる。
+    frames_read は実際に読めたフレーム数で、再生位置の計算に使う (一時停止中や送信の遅延では増えない)。
+    """
+
+    def __init__(self, source: str, *, title: str, guild_id: int,
+                 on_first_frame: Optional[Callable[[float], None]] = None, **kwargs):
+        self._spawned_at = time.perf_counter()
+        super().__init__(source, **kwargs)
+        self.title = title
+        self.guild_id = guild_id
+        self._on_first_frame = on_first_frame
+        self.frames_read = 0
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return self.frames_read * FRAME_SECONDS
+
+    def read_into(self, buffer: memoryview) -> int:
+        """1フレーム分の PCM を buffer に書き込み、書き込んだバイト数を返す (終端では 0)。"""
+        n = self._stdout.readinto(buffer)
+        if n != FRAME_SIZE:
+            # 途中で読めなくなった場合は FFmpeg の異常終了をチェック
+            self._check_process_returncode()
+            return 0
+        self.frames_read += 1
+        if self._on_first_frame is not None:
+            callback, self._on_first_frame = self._on_first_frame, None
+            callback(time.perf_counter() - self._spawned_at)
+        return n
+
+
+class OpusPassthroughSource(discord.FFmpegOpusAudio):
+    """
+    Opus パケットをそのまま送るソース (codec=copy)。MusicAudioSource と同じ計測フックとフレーム数を持ち、
+    ミキサーを通らないので stats (FrameStats) もここで記録する。
+    """
+
+    def __init__(self, source: str, *, title: str, guild_id: int,
+                 on_first_frame: Optional[Callable[[float], None]] = None, stats: Optional[FrameStats] = None,
+                 **kwargs):
+        self._spawned_at = time.perf_counter()
+        super().__init__(source, codec="copy", **kwargs)
+        self.title = title
+        self.guild_id = guild_id
+        self._on_first_frame = on_first_frame
+        self.stats = stats
+        self.frames_read = 0
+
+    @property
+    def elapsed_seconds(self) -> float:
+        # Discord に送る Opus パケットは 1 つ 20ms
+        return self.frames_read * FRAME_SECONDS
+
+    def read(self) -> bytes:
+        stats = self.stats
+        started = stats.begin() if stats is not None else 0.0
+        packet = super().read()
+        if stats is not None:
+            stats.end(started, bool(packet))
+        if packet:
+            self.frames_read += 1
+            if self._on_first_frame is not None:
+                callback, self._on_first_frame = self._on_first_frame, None
+                callback(time.perf_counter() - self._spawned_at)
+        return packet
+
+
+class _MixerChannel:
+    """ミキサーの1入力。フレームバッファはソース追加時に一度だけ確保する。"""
+    __slots__ = ("source", "gain", "buffer", "view", "pcm")
+
+    def __init__(self, source: discord.AudioSource, volume: float):
+        self.source = source
+        self.gain = np.float32(volume)
+        self.buffer = bytearray(FRAME_SIZE)
+        self.view = memoryview(self.buffer)
+        self.pcm = np.frombuffer(self.buffer, dtype=np.int16)
+
+    def fill(self) -> bool:
+        """次のフレームをバッファへ読み込む。ソースが終わっていれば False。"""
+        read_into = getattr(self.source, "read_into", None)
+        if read_into is not None:
+            return read_into(self.view) == FRAME_SIZE
+        data = self.source.read()
+        if len(data) != FRAME_SIZE:
+            return False
+        self.view[:] = data
+        return True
+
+    def close(self):
+        try:
+            self.source.cleanup()
+        except Exception:
+            pass
+
+
+class AudioMixer(discord.AudioSource):
+    """
+    名前付きの複数 PCM ソースを 20ms フレーム単位で合成する AudioSource。
+
+    ボイス送信スレッドから毎秒50回 read() が呼ばれるホットループなので、合成・音量適用は
+    すべて事前確保した NumPy バッファ上のインプレース演算で行い、フレームごとのメモリ確保を
+    行わない。出力は ctypes 配列で、discord.py の Opus エンコーダがそのままポインタとして参照する。
+    """
+
+    def __init__(self, stats: Optional[FrameStats] = None):
+        _load_numpy()
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._channels: Dict[str, _MixerChannel] = {}
+        self._stopped = False
+        self._output = (ctypes.c_char * FRAME_SIZE)()
+        self._output_pcm = np.frombuffer(self._output, dtype=np.int16)
+        self._accumulator = np.zeros(FRAME_VALUES, dtype=np.float32)
+        self._scratch = np.zeros(FRAME_VALUES, dtype=np.float32)
+        self._active = []  # read() 内で使い回す作業リスト
+        self._pending_calls = []
+
+    async def add_source(self, name: str, source: discord.AudioSource, volume: float = 1.0):
+        if source.is_opus():
+            raise ValueError("AudioMixer は PCM ソースのみ受け付けます。")
+        with self._lock:
+            old = self._channels.pop(name, None)
+            self._channels[name] = _MixerChannel(source, volume)
+            self._stopped = False
+        if old:
+            old.close()
+
+    async def remove_source(self, name: str):
+        with self._lock:
+            channel = self._channels.pop(name, None)
+        if channel:
+            channel.close()
+
+    async def set_volume(self, name: str, volume: float):
+        with self._lock:
+            channel = self._channels.get(name)
+            if channel:
+                channel.gain = np.float32(volume)
+
+    def get_volume(self, name: str) -> Optional[float]:
+        channel = self._channels.get(name)
+        return float(channel.gain) if channel else None
+
+    def call_soon(self, callback: Callable[[], None]):
+        """
+        次の read() の先頭で callback を実行する。read() はエンコードと同じボイス送信スレッドで
+        呼ばれるので、Opus エンコーダの設定変更をエンコード中に割り込ませずに行える。
+        """
+        with self._lock:
+            self._pending_calls.append(callback)
+
+    def _run_pending_calls(self):
+        with self._lock:
+            calls, self._pending_calls = self._pending_calls, []
+        for callback in calls:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def source_count(self) -> int:
+        return len(self._channels)
+
+    def is_playing(self) -> bool:
+        return not self._stopped and bool(self._channels)
+
+    def is_opus(self) -> bool:
+        return False
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            channels = list(self._channels.values())
+            self._channels.clear()
+        for channel in channels:
+            channel.close()
+
+    def cleanup(self):
+        self.stop()
+
+    def read(self):
+        if self._pending_calls:
+            self._run_pending_calls()
+        stats = self.stats
+        if stats is None:
+            return self._mix()
+        started = stats.begin()
+        data = self._mix()
+        stats.end(started, bool(data))
+        return data
+
+    def _mix(self):
+        with self._lock:
+            if self._stopped:
+                return b''
+
+            active = self._active
+            active.clear()
+            finished = None
+            for name, channel in self._channels.items():
+                if channel.fill():
+                    active.append(channel)
+                else:
+                    if finished is None:
+                        finished = []
+                    finished.append(name)
+            if finished:
+                for name in finished:
+                    self._channels.pop(name).close()
+
+            if not active:
+                # 全ソースが終了したら空を返し、再生を終わらせる
+                return b''
+
+            out = self._output_pcm
+            if len(active) == 1:
+                channel = active[0]
+                if channel.gain == 1.0:
+                    np.copyto(out, channel.pcm)
+                    return self._output
+                np.multiply(channel.pcm, channel.gain, out=self._accumulator)
+            else:
+                acc, scratch = self._accumulator, self._scratch
+                first = active[0]
+                np.multiply(first.pcm, first.gain, out=acc)
+                for i in range(1, len(active)):
+                    channel = active[i]
+                    np.multiply(channel.pcm, channel.gain, out=scratch)
+                    np.add(acc, scratch, out=acc)
+
+            np.clip(self._accumulator, -32768, 32767, out=self._accumulator)
+            np.copyto(out, self._accumulator, casting="unsafe")
+            return self._output
@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import itertools
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import discord
+
+from services import audio_mixer
+from services.audio_mixer import FRAME_SECONDS, FRAME_SIZE, FRAME_VALUES, SAMPLES_PER_FRAME
+from services.track_queue import MemoryBudget, TrackQueue
+
+if TYPE_CHECKING:
+    from services.ytdlp_wrapper import Track
+
+logger = logging.getLogger(__name__)
+
+OPUS_SILENCE = b"\xf8\xff\xfe"  # 20ms の無音 Opus パケット (曲の切り替え中や供給待ちに送る)
+
+SourceFactory = Callable[["RadioStation", "Track"], Awaitable[Tuple[discord.AudioSource, float]]]
+
+_station_ids = itertools.count(1)
+
+
+class _VolumeGroup:
+    """同じ音量 (量子化後) のリスナーの集まり。グループごとに1回だけエンコードする。"""
+    __slots__ = ("volume", "encoder", "packets", "listeners")
+
+    def __init__(self, volume: float, ring_frames: int):
+        self.volume = volume
+        self.encoder = discord.opus.Encoder()
+        self.packets: List[Optional[bytes]] = [None] * ring_frames
+        self.listeners = 0
+
+
+class StationListener(discord.AudioSource):
+    """
+    ギルドの VoiceClient で再生する、ラジオ局の受信側ソース。
+
+    局がエンコード済みの Opus パケットを順番に返すだけなので、ボイス送信スレッドでのデコード・
+    エンコードは発生しない (is_opus() が True)。
+    """
+
+    def __init__(self, station: "RadioStation", volume: float):
+        self.station = station
+        self.group: Optional[_VolumeGroup] = None
+        self.cursor: Optional[int] = None
+        self.closed = False
+        station._attach(self, volume)
+
+    def is_opus(self) -> bool:
+        return True
+
+    def set_volume(self, volume: float):
+        self.station._regroup(self, volume)
+
+    def read(self) -> bytes:
+        return self.station._read(self)
+
+    def cleanup(self):
+        self.station._detach(self)
+
+
+class RadioStation:
+    """
+    1つの曲を1回だけデコードし、同じ Opus パケットを複数ギルドの VoiceClient へ配るラジオ局。
+
+    - 専用スレッドが 20ms ごとに FFmpeg から PCM を1フレーム読み、音量グループごとに1回エンコードして
+      リングバッファ (ring_frames 個) に書き込む。CPU 使用量はリスナー数ではなく音量グループ数に比例する
+    - リスナーの音量は volume_step 刻みに丸めて同じグループにまとめる。グループ数が max_volume_groups に
+      達したら、一番近い既存のグループに入れる
+    - 各リスナーは自分の読み位置 (cursor) を持ち、一時停止などで遅れすぎたら最新の位置に追いつく
+    - 局のキューが空になるか、最後のリスナーが抜けると閉局する
+    """
+
+    def __init__(self, name: str, source_factory: SourceFactory, loop: asyncio.AbstractEventLoop, *,
+                 budget: Optional[MemoryBudget] = None, ring_frames: int = 50, volume_step: float = 0.05,
+                 max_volume_groups: int = 8, on_closed: Optional[Callable[["RadioStation"], None]] = None):
+        audio_mixer._load_numpy()
+        self.name = name
+        self.key = -next(_station_ids)  # ギルドIDと衝突しない、メモリ予算・受け入れ制御用のキー
+        self.queue = TrackQueue(budget, self.key)
+        self.current_track: Optional["Track"] = None
+        self.track_gain = 1.0
+        self.ring_frames = ring_frames
+        self.volume_step = volume_step
+        self.max_volume_groups = max_volume_groups
+        self.sequence = 0  # これまでに作ったフレーム数
+        self.encoded_frames = 0
+        self.late_frames = 0
+        self.tracks_played = 0
+        self.closed = False
+        self._source_factory = source_factory
+        self._loop = loop
+        self._on_closed = on_closed
+        self._cond = threading.Condition()
+        self._groups: Dict[int, _VolumeGroup] = {}
+        self._listeners: Set[StationListener] = set()
+        self._source: Optional[discord.AudioSource] = None
+        self._advancing = False
+        self._thread: Optional[threading.Thread] = None
+
+    # --- リスナー (ボイス送信スレッド / イベントループから呼ばれる) ---
+
+    def listen(self, volume: float) -> StationListener:
+        return StationListener(self, volume)
+
+    def listener_count(self) -> int:
+        return len(self._listeners)
+
+    def group_count(self) -> int:
+        return len(self._groups)
+
+    def _group_key(self, volume: float) -> int:
+        key = int(round(volume / self.volume_step))
+        if key not in self._groups and len(self._groups) >= self.max_volume_groups:
+            key = min(self._groups, key=lambda existing: abs(existing - key))
+        return key
+
+    def _join_group(self, listener: StationListener, volume: float):
+        key = self._group_key(volume)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = _VolumeGroup(key * self.volume_step, self.ring_frames)
+        group.listeners += 1
+        listener.group = group
+        # 新しいグループには過去のパケットが無いので、次に作るフレームから読む
+        listener.cursor = self.sequence
+
+    def _leave_group(self, listener: StationListener):
+        group, listener.group = listener.group, None
+        if group is None:
+            return
+        group.listeners -= 1
+        if group.listeners <= 0:
+            for key, existing in list(self._groups.items()):
+                if existing is group:
+                    del self._groups[key]
+
+    def _attach(self, listener: StationListener, volume: float):
+        with self._cond:
+            if self.closed:
+                listener.closed = True
+                return
+            self._listeners.add(listener)
+            self._join_group(listener, volume)
+
+    def _regroup(self, listener: StationListener, volume: float):
+        with self._cond:
+            if listener.closed or self.closed:
+                return
+            self._leave_group(listener)
+            self._join_group(listener, volume)
+
+    def _detach(self, listener: StationListener):
+        with self._cond:
+            if listener.closed:
+                return
+            listener.closed = True
+            self._listeners.discard(listener)
+            self._leave_group(listener)
+            self._cond.notify_all()
+            empty = not self._listeners
+        if empty:
+            self.close()
+
+    def _read(self, listener: StationListener) -> bytes:
+        with self._cond:
+            if listener.closed or self.closed:
+                return b''
+            if listener.cursor is None or listener.cursor < self.sequence - self.ring_frames + 2:
+                # 一時停止などでリングバッファより遅れたので、最新の位置に追いつく
+                listener.cursor = max(0, self.sequence - 2)
+            if listener.cursor >= self.sequence:
+                # 局のスレッドより先に来たので、次のフレームができるまで少しだけ待つ
+                self._cond.wait(FRAME_SECONDS * 3)
+                if listener.closed or self.closed:
+                    return b''
+                if listener.cursor >= self.sequence:
+                    return OPUS_SILENCE
+            group = listener.group
+            packet = group.packets[listener.cursor % self.ring_frames] if group is not None else None
+            listener.cursor += 1
+            return packet or OPUS_SILENCE
+
+    # --- 局の制御 (イベントループから呼ぶ) ---
+
+    def start(self):
+        if self._thread is not None or self.closed:
+            return
+        self._thread = threading.Thread(target=self._run, name=f"radio-{self.name}", daemon=True)
+        self._thread.start()
+        self._request_advance()
+
+    def skip(self):
+        with self._cond:
+            source, self._source = self._source, None
+        if source is not None:
+            source.cleanup()
+        self._request_advance()
+
+    def set_track_gain(self, track_url: str, gain: float):
+        if self.current_track is not None and self.current_track.url == track_url:
+            self.track_gain = gain
+
+    def close(self):
+        with self._cond:
+            if self.closed:
+                return
+            self.closed = True
+            source, self._source = self._source, None
+            self._cond.notify_all()
+        if source is not None:
+            source.cleanup()
+        logger.info(f"Radio '{self.name}': Closed after {self.tracks_played} tracks")
+        # 最後のリスナーのボイス送信スレッドから呼ばれることもあるので、キューの片付けはイベントループで行う
+        self._loop.call_soon_threadsafe(self._finish_close)
+
+    def _finish_close(self):
+        self.queue.clear()
+        if self._on_closed is not None:
+            self._on_closed(self)
+
+    def _request_advance(self):
+        with self._cond:
+            if self._advancing or self.closed:
+                return
+            self._advancing = True
+        asyncio.run_coroutine_threadsafe(self._advance(), self._loop)
+
+    async def _advance(self):
+        try:
+            while not self.closed:
+                if self.queue.empty():
+                    self.current_track = None
+                    self.close()
+                    return
+                track = self.queue.get_nowait()
+                self.queue.task_done()
+                try:
+                    source, gain = await self._source_factory(self, track)
+                except Exception as e:
+                    logger.warning(f"Radio '{self.name}': Failed to start '{track.title}': {e}")
+                    continue
+                with self._cond:
+                    if self.closed:
+                        closed_source = source
+                    else:
+                        closed_source = None
+                        self.current_track = track
+                        self.track_gain = gain
+                        self._source = source
+                if closed_source is not None:
+                    closed_source.cleanup()
+                    return
+                self.tracks_played += 1
+                logger.info(f"Radio '{self.name}': Now broadcasting '{track.title}' "
+                            f"to {self.listener_count()} listeners")
+                return
+        finally:
+            self._advancing = False
+
+    # --- 局のスレッド ---
+
+    def _run(self):
+        np = audio_mixer.np
+        frame = (ctypes.c_char * FRAME_SIZE)()
+        frame_view = memoryview(frame)
+        frame_pcm = np.frombuffer(frame, dtype=np.int16)
+        scaled = (ctypes.c_char * FRAME_SIZE)()
+        scaled_pcm = np.frombuffer(scaled, dtype=np.int16)
+        scratch = np.zeros(FRAME_VALUES, dtype=np.float32)
+
+        started = time.perf_counter()
+        loops = 0
+        while not self.closed:
+            with self._cond:
+                source = self._source
+                groups = list(self._groups.values())
+            has_frame = source is not None and self._fill(source, frame, frame_view)
+            if source is not None and not has_frame:
+                with self._cond:
+                    ended = source is self._source
+                    if ended:
+                        self._source = None
+                if ended:
+                    source.cleanup()
+                    self._request_advance()
+
+            index = self.sequence % self.ring_frames
+            for group in groups:
+                if not has_frame:
+                    group.packets[index] = OPUS_SILENCE
+                    continue
+                gain = group.volume * self.track_gain
+                if gain == 1.0:
+                    group.packets[index] = group.encoder.encode(frame, SAMPLES_PER_FRAME)
+                else:
+                    np.multiply(frame_pcm, np.float32(gain), out=scratch)
+                    np.clip(scratch, -32768, 32767, out=scratch)
+                    np.copyto(scaled_pcm, scratch, casting="unsafe")
+                    group.packets[index] = group.encoder.encode(scaled, SAMPLES_PER_FRAME)
+                self.encoded_frames += 1
+
+            with self._cond:
+                self.sequence += 1
+                self._cond.notify_all()
+
+            loops += 1
+            delay = started + FRAME_SECONDS * loops - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.late_frames += 1
+                if delay < -FRAME_SECONDS * 10:
+                    # 大きく遅れたら取り戻そうとせず、時刻の基準を今に合わせ直す
+                    started = time.perf_counter()
+                    loops = 0
+
+    @staticmethod
+    def _fill(source: discord.AudioSource, frame, frame_view: memoryview) -> bool:
+        try:
+            read_into = getattr(source, "read_into", None)
+            if read_into is not None:
+                return read_into(frame_view) == FRAME_SIZE
+            data = source.read()
+            if len(data) != FRAME_SIZE:
+                return False
+            ctypes.memmove(frame, data, FRAME_SIZE)
+            return True
+        except Exception as e:
+            # スキップ・閉局でソースが片付けられた直後の読み込みはここに来る
+            logger.debug(f"Radio source read failed: {e}")
+            return False
+
+    def format_stats(self) -> str:
+        title = self.current_track.title if self.current_track else "-"
+        return (f"radio {self.name} listeners={self.listener_count()} encoders={self.group_count()} "
+                f"frames={self.sequence} encoded={self.encoded_frames} late={self.late_frames} "
+                f"queue={self.queue.qsize()} track={title[:40]}")
+
+
+class RadioStations:
+    """名前で引けるラジオ局の一覧。閉局した局は自動で取り除かれる。"""
+
+    def __init__(self, *, max_stations: int = 10, budget: Optional[MemoryBudget] = None, ring_frames: int = 50,
+                 volume_step: float = 0.05, max_volume_groups: int = 8,
+                 on_closed: Optional[Callable[[RadioStation], None]] = None):
+        self.max_stations = max_stations
+        self.budget = budget
+        self.ring_frames = ring_frames
+        self.volume_step = volume_step
+        self.max_volume_groups = max_volume_groups
+        self._on_closed = on_closed
+        self.stations: Dict[str, RadioStation] = {}
+
+    def __len__(self) -> int:
+        return len(self.stations)
+
+    def get(self, name: str) -> Optional[RadioStation]:
+        station = self.stations.get(name)
+        return station if station is not None and not station.closed else None
+
+    def create(self, name: str, source_factory: SourceFactory, loop: asyncio.AbstractEventLoop) -> RadioStation:
+        station = RadioStation(name, source_factory, loop, budget=self.budget, ring_frames=self.ring_frames,
+                               volume_step=self.volume_step, max_volume_groups=self.max_volume_groups,
+                               on_closed=self._closed)
+        self.stations[name] = station
+        return station
+
+    def _closed(self, station: RadioStation):
+        if self.stations.get(station.name) is station:
+            del self.stations[station.name]
+        if self._on_closed is not None:
+            self._on_closed(station)
+
+    def format_stats(self) -> List[str]:
+        return [station.format_stats() for station in self.stations.values()]
+
@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import Container, Dict, Optional, Tuple
+
+
+class CoPlayIndex:
+    """
+    「X の次によく再生された曲」の索引。自動再生でキューが空になったときの次の曲選びに使う。
+
+    再生履歴の1件ごとに observe() を呼ぶと、同じギルドで直前に再生された曲 → 今回の曲の回数を数える。
+    前の曲の長さに session_gap 秒を足したより間が空いていれば、別の聞き方 (セッション) とみなして数えない。
+    自動再生で選ばれた曲は、自分の選択を強化しないよう「次の曲」としては数えない。
+
+    曲ごとに保持する「次の曲」は max_followers 件まで。上限を超えたら最も少ない1件と入れ替え、
+    入れ替えた曲はその回数を引き継ぐ (Space-Saving 法)。next_for() は高々 max_followers 件を見るだけなので、
+    再生の切れ目で待たせることはない。
+    """
+
+    def __init__(self, *, max_followers: int = 16, session_gap: int = 600):
+        self.max_followers = max_followers
+        self.session_gap = session_gap
+        self._followers: Dict[str, Dict[str, int]] = {}
+        self._last: Dict[int, Tuple[str, int, int]] = {}  # ギルドID → (URL, 再生時刻, 秒数)
+        self.edge_count = 0
+
+    def observe(self, guild_id: int, url: str, duration: int, played_at: int, autoplay: bool = False):
+        last = self._last.get(guild_id)
+        self._last[guild_id] = (url, played_at, duration)
+        if last is None or autoplay or last[0] == url:
+            return
+        previous_url, previous_at, previous_duration = last
+        if played_at - previous_at > previous_duration + self.session_gap:
+            return
+        followers = self._followers.get(previous_url)
+        if followers is None:
+            followers = self._followers[previous_url] = {}
+        if url in followers:
+            followers[url] += 1
+        elif len(followers) < self.max_followers:
+            followers[url] = 1
+            self.edge_count += 1
+        else:
+            weakest = min(followers, key=followers.get)
+            followers[url] = followers.pop(weakest) + 1
+
+    def next_for(self, url: str, exclude: Container[str] = ()) -> Optional[str]:
+        """url の次に最も多く再生された曲 (exclude に含まれるものを除く)。無ければ None。"""
+        followers = self._followers.get(url)
+        if not followers:
+            return None
+        best, best_count = None, 0
+        for candidate, count in followers.items():
+            if count > best_count and candidate not in exclude:
+                best, best_count = candidate, count
+        return best
+
+    def format_stats(self) -> str:
+        return f"co_play sources={len(self._followers)} edges={self.edge_count}"
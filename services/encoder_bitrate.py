@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Dict, List, Optional
+
+import discord
+
+from services.audio_mixer import FRAME_SECONDS
+
+DEFAULT_KBPS = 128  # VoiceClient.play() の既定値 (チャンネルに合わせる前のエンコード設定)
+
+
+def channel_bitrate_kbps(channel: Optional[discord.abc.Connectable], min_kbps: int = 16,
+                         max_kbps: int = DEFAULT_KBPS) -> int:
+    """ボイスチャンネルのビットレート (kbps) を Opus エンコーダの設定可能範囲に収めて返す。"""
+    bitrate = getattr(channel, "bitrate", None)
+    if not bitrate:
+        return max(16, min(512, max_kbps))
+    return max(16, min_kbps, min(512, max_kbps, bitrate // 1000))
+
+
+class _Bucket:
+    __slots__ = ("frames", "bytes", "encode_seconds")
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.encode_seconds = 0.0
+
+
+class EncoderMeter:
+    """
+    1つの Opus エンコーダの encode() を計測する。encode() はボイス送信スレッドから呼ばれるので、
+    カウンタはそのスレッドだけが書き、flush() で BitrateStats へ移す。
+    """
+    __slots__ = ("kbps", "frames", "bytes", "encode_seconds", "_encode")
+
+    def __init__(self, encoder: discord.opus.Encoder, kbps: int):
+        self.kbps = kbps
+        self.frames = 0
+        self.bytes = 0
+        self.encode_seconds = 0.0
+        self._encode = encoder.encode
+        encoder.encode = self._timed_encode
+
+    def _timed_encode(self, pcm, frame_size: int) -> bytes:
+        started = time.perf_counter()
+        packet = self._encode(pcm, frame_size)
+        self.encode_seconds += time.perf_counter() - started
+        self.frames += 1
+        self.bytes += len(packet)
+        return packet
+
+    def flush(self, stats: BitrateStats):
+        frames, data, seconds = self.frames, self.bytes, self.encode_seconds
+        self.frames, self.bytes, self.encode_seconds = 0, 0, 0.0
+        stats.add(self.kbps, frames, data, seconds)
+
+
+class BitrateStats:
+    """
+    ビットレートごとのエンコード量と encode() の所要時間を集計し、既定のビットレート
+    (baseline_kbps) で送っていた場合との差 (送信量・エンコード CPU) を出す。
+    """
+
+    def __init__(self, baseline_kbps: int = DEFAULT_KBPS):
+        self.baseline_kbps = baseline_kbps
+        self.adaptations = 0
+        self._lock = threading.Lock()
+        self._buckets: Dict[int, _Bucket] = {}
+
+    def add(self, kbps: int, frames: int, data: int, encode_seconds: float):
+        if not frames:
+            return
+        with self._lock:
+            bucket = self._buckets.get(kbps)
+            if bucket is None:
+                bucket = self._buckets[kbps] = _Bucket()
+            bucket.frames += frames
+            bucket.bytes += data
+            bucket.encode_seconds += encode_seconds
+
+    def _snapshot(self, meters: List[EncoderMeter]) -> Dict[int, _Bucket]:
+        with self._lock:
+            buckets = {}
+            for kbps, bucket in self._buckets.items():
+                copy = buckets[kbps] = _Bucket()
+                copy.frames, copy.bytes, copy.encode_seconds = bucket.frames, bucket.bytes, bucket.encode_seconds
+        for meter in meters:  # まだ flush されていない再生中の分
+            bucket = buckets.setdefault(meter.kbps, _Bucket())
+            bucket.frames += meter.frames
+            bucket.bytes += meter.bytes
+            bucket.encode_seconds += meter.encode_seconds
+        return buckets
+
+    def format_stats(self, meters: List[EncoderMeter]) -> List[str]:
+        buckets = self._snapshot(meters)
+        if not buckets:
+            return []
+        baseline = buckets.get(self.baseline_kbps)
+        baseline_us = (baseline.encode_seconds / baseline.frames * 1e6) if baseline and baseline.frames else None
+        saved_bytes = 0.0
+        saved_cpu = 0.0
+        lines = []
+        for kbps in sorted(buckets):
+            bucket = buckets[kbps]
+            if not bucket.frames:
+                continue
+            seconds = bucket.frames * FRAME_SECONDS
+            # Opus は VBR なので、既定のビットレートで送っていた場合の量は公称値から見積もる
+            saved_bytes += self.baseline_kbps * 125 * seconds - bucket.bytes
+            per_frame_us = bucket.encode_seconds / bucket.frames * 1e6
+            if baseline_us is not None:
+                saved_cpu += (baseline_us - per_frame_us) * bucket.frames / 1e6
+            lines.append(f"encoder {kbps}kbps audio={seconds / 60:.1f}min sent={bucket.bytes / 1048576:.1f}MiB "
+                         f"encode_us={per_frame_us:.0f}/frame")
+        summary = (f"encoder_bitrate baseline={self.baseline_kbps}kbps adaptations={self.adaptations} "
+                   f"saved={saved_bytes / 1048576:.1f}MiB")
+        if baseline_us is not None:
+            summary += f" saved_encode_cpu={saved_cpu:.1f}s"
+        return [summary] + lines
@@ -0,0 +1,44 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Optional
+
+import discord
+from discord import app_commands
+
+logger = logging.getLogger(__name__)
+
+
+class MusicCogExceptionHandler:
+    """
+    設定 (music.messages) からユーザー向けのメッセージを作り、例外を表示用の文に変換する。
+    handle_error() の戻り値は error_message_wrapper などのテンプレートに {error} として埋め込まれる。
+    """
+
+    def __init__(self, music_config: dict):
+        self.messages: dict = music_config.get("messages") or {}
+
+    def get_message(self, key: str, **kwargs) -> str:
+        template = self.messages.get(key)
+        if template is None:
+            logger.warning(f"Message '{key}' is not defined in music.messages")
+            return key
+        try:
+            return template.format(**kwargs)
+        except (KeyError, IndexError, ValueError) as e:
+            logger.warning(f"Message '{key}' could not be formatted: {e}")
+            return template
+
+    def handle_error(self, error: Exception, guild: Optional[discord.Guild] = None) -> str:
+        if isinstance(error, app_commands.CommandInvokeError):
+            error = error.original
+        if isinstance(error, asyncio.TimeoutError):
+            return self.get_message("error_timeout")
+        if isinstance(error, discord.Forbidden):
+            return self.get_message("error_missing_permissions")
+        if isinstance(error, (RuntimeError, discord.ClientException)) and str(error):
+            # 抽出・再生処理が送出する RuntimeError は、そのまま利用者に見せられる文になっている
+            return str(error)
+        logger.error(f"Unexpected error in guild {guild.id if guild else '-'}: {error!r}")
+        return self.get_message("error_unexpected")
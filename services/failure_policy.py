@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Tuple
+
+
+class CircuitOpenError(RuntimeError):
+    """抽出元サイトのサーキットが開いているため、抽出を試みなかったことを表す。"""
+
+    def __init__(self, extractor: str, retry_after: float):
+        super().__init__(f"{extractor} の抽出が連続して失敗しているため、{retry_after:.0f}秒後に再試行します。")
+        self.extractor = extractor
+        self.retry_after = retry_after
+
+
+class NegativeCache:
+    """
+    抽出に失敗した URL を TTL 付きで覚えておき、削除済み・地域制限の動画を何度も解決しに行かないようにする。
+    """
+
+    def __init__(self, ttl: float = 600.0, max_entries: int = 5000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+
+    def record(self, key: str, reason: str):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, reason)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """失敗を記録済みで TTL 内なら失敗理由を返す。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, reason = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self.hits += 1
+        return reason
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class _Circuit:
+    __slots__ = ("failures", "opened_at", "cooldown", "probing_since")
+
+    def __init__(self):
+        self.failures: Deque[float] = deque()
+        self.opened_at: Optional[float] = None
+        self.cooldown = 0.0
+        self.probing_since: Optional[float] = None
+
+
+class CircuitBreaker:
+    """
+    抽出元サイト (yt-dlp の抽出器) ごとのサーキットブレーカー。
+
+    window 秒以内に failure_threshold 回失敗するとサーキットを開き、cooldown 秒間はそのサイトへの
+    抽出を行わない。cooldown 後は1件だけ試行 (half-open) し、成功すれば閉じ、失敗すれば
+    cooldown を倍にして (max_cooldown まで) 再び開く。試行の結果が probe_timeout 秒以内に
+    報告されなければ (途中でスキップされた場合など)、次の1件を試行する。
+    """
+
+    def __init__(self, failure_threshold: int = 5, window: float = 60.0, cooldown: float = 30.0,
+                 max_cooldown: float = 600.0, probe_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self._circuits: Dict[str, _Circuit] = {}
+
+    def retry_after(self, name: str) -> float:
+        """抽出してよければ 0、サーキットが開いていれば再試行までの秒数を返す。"""
+        circuit = self._circuits.get(name)
+        if circuit is None or circuit.opened_at is None:
+            return 0.0
+        now = time.monotonic()
+        remaining = circuit.opened_at + circuit.cooldown - now
+        if remaining > 0:
+            return remaining
+        if circuit.probing_since is not None and now - circuit.probing_since < self.probe_timeout:
+            return 1.0  # half-open の試行結果を待つ
+        circuit.probing_since = now
+        return 0.0
+
+    def record_success(self, name: str):
+        circuit = self._circuits.get(name)
+        if circuit is not None and circuit.opened_at is not None:
+            # half-open の試行が成功したので閉じる
+            del self._circuits[name]
+
+    def record_failure(self, name: str):
+        now = time.monotonic()
+        circuit = self._circuits.setdefault(name, _Circuit())
+        if circuit.probing_since is not None:
+            circuit.probing_since = None
+            circuit.opened_at = now
+            circuit.cooldown = min(self.max_cooldown, circuit.cooldown * 2)
+            return
+        circuit.failures.append(now)
+        while circuit.failures and circuit.failures[0] < now - self.window:
+            circuit.failures.popleft()
+        if circuit.opened_at is None and len(circuit.failures) >= self.failure_threshold:
+            circuit.opened_at = now
+            circuit.cooldown = self.base_cooldown
+            circuit.failures.clear()
+
+    def open_circuits(self) -> Dict[str, float]:
+        now = time.monotonic()
+        return {name: max(0.0, c.opened_at + c.cooldown - now)
+                for name, c in self._circuits.items() if c.opened_at is not None}
+
+
+class RetryPolicy:
+    """再生に連続して失敗したときの、次の曲へ進むまでの待ち時間 (指数バックオフ、回数上限付き)。"""
+
+    def __init__(self, max_consecutive_failures: int = 5, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.max_consecutive_failures = max_consecutive_failures
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, consecutive_failures: int) -> Optional[float]:
+        """次に進むまでの秒数。上限に達していれば None (自動で先へ進まない)。"""
+        if consecutive_failures >= self.max_consecutive_failures:
+            return None
+        return min(self.max_delay, self.base_delay * (2 ** max(0, consecutive_failures - 1)))
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import shlex
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# 抽出時に分かったコンテナ (yt-dlp の ext) → FFmpeg のデマルチプレクサ名
+_CONTAINER_FORMATS = {
+    "webm": "matroska",
+    "mkv": "matroska",
+    "m4a": "mp4",
+    "mp4": "mp4",
+    "ogg": "ogg",
+    "opus": "ogg",
+    "mp3": "mp3",
+    "flac": "flac",
+    "wav": "wav",
+}
+
+# 再接続オプションは HTTP 入力にだけ意味がある
+_RECONNECT_OPTIONS = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+
+
+@dataclass(frozen=True)
+class FFmpegInputProfile:
+    """
+    入力ごとの FFmpeg プローブ設定。
+
+    probesize (bytes) / analyzeduration (µs) を小さくすると、FFmpeg が入力の解析に使う時間が減り、
+    最初の音が出るまでが速くなる。コンテナとコーデックが抽出時点で分かっている場合は
+    known_probesize / known_analyzeduration を使い、ほぼ解析なしで開始する。
+    """
+    name: str
+    probesize: Optional[int] = None
+    analyzeduration: Optional[int] = None
+    known_probesize: Optional[int] = None
+    known_analyzeduration: Optional[int] = None
+    input_format: Optional[str] = None  # 常に指定する -f (HLS など)
+    reconnect: bool = True
+    extra_options: str = ""
+
+    def before_options(self, *, container: Optional[str] = None, codec_known: bool = False,
+                       base_options: Optional[str] = None, seek_seconds: Optional[int] = None) -> str:
+        args = []
+        if seek_seconds:
+            args.extend(["-ss", str(seek_seconds)])
+        input_format = self.input_format or _CONTAINER_FORMATS.get((container or "").lower())
+        known = codec_known and input_format is not None
+        probesize = self.known_probesize if known and self.known_probesize else self.probesize
+        analyzeduration = (self.known_analyzeduration if known and self.known_analyzeduration is not None
+                           else self.analyzeduration)
+        if probesize:
+            args.extend(["-probesize", str(probesize)])
+        if analyzeduration is not None:
+            args.extend(["-analyzeduration", str(analyzeduration)])
+        if input_format:
+            args.extend(["-f", input_format])
+        options = " ".join(shlex.quote(a) for a in args)
+        if self.reconnect:
+            options = f"{options} {base_options if base_options is not None else _RECONNECT_OPTIONS}"
+        if self.extra_options:
+            options = f"{options} {self.extra_options}"
+        return options.strip()
+
+
+DEFAULT_PROFILES: Dict[str, FFmpegInputProfile] = {
+    # DASH の webm/m4a はヘッダにコーデック情報があるので解析はほぼ不要
+    "youtube": FFmpegInputProfile("youtube", probesize=262144, analyzeduration=500000,
+                                  known_probesize=32768, known_analyzeduration=0),
+    "soundcloud": FFmpegInputProfile("soundcloud", probesize=262144, analyzeduration=500000,
+                                     known_probesize=32768, known_analyzeduration=0),
+    # HLS はセグメントの取得が遅いので、プレイリストの解析を最小限にする
+    "hls": FFmpegInputProfile("hls", probesize=131072, analyzeduration=1000000, input_format="hls"),
+    "niconico": FFmpegInputProfile("niconico", probesize=131072, analyzeduration=1000000),
+    "local": FFmpegInputProfile("local", probesize=65536, analyzeduration=0, reconnect=False),
+    "default": FFmpegInputProfile("default"),
+}
+
+
+def load_profiles(overrides: Optional[dict]) -> Dict[str, FFmpegInputProfile]:
+    """config.yaml の ffmpeg_profiles で既定のプロファイルを上書き・追加する。"""
+    profiles = dict(DEFAULT_PROFILES)
+    for name, values in (overrides or {}).items():
+        base = profiles.get(name, FFmpegInputProfile(name))
+        fields = {k: v for k, v in (values or {}).items() if k in FFmpegInputProfile.__dataclass_fields__}
+        profiles[name] = replace(base, **fields)
+    return profiles
+
+
+def select_profile_name(*, stream_url: Optional[str], extractor: Optional[str], protocol: Optional[str]) -> str:
+    """Track の抽出元サイト・プロトコルから使うプロファイルを選ぶ。"""
+    if stream_url and not stream_url.startswith(("http://", "https://")):
+        try:
+            if Path(stream_url).is_file():
+                return "local"
+        except OSError:
+            pass
+    if protocol and "m3u8" in protocol:
+        return "hls"
+    extractor = (extractor or "").lower()
+    if extractor.startswith("youtube"):
+        return "youtube"
+    if extractor.startswith("soundcloud"):
+        return "soundcloud"
+    if extractor.startswith("niconico"):
+        return "niconico"
+    if stream_url and ".m3u8" in stream_url:
+        return "hls"
+    return "default"
+
+
+def http_input_options(headers: Optional[Dict[str, str]], cookies: Optional[str]) -> str:
+    """
+    yt-dlp が抽出時に使ったヘッダー・クッキーを FFmpeg の -headers / -cookies に変換する
+    (ニコニコ動画の HLS のように、セグメントの取得にもクッキーが要るサイト用)。
+    """
+    args = []
+    if cookies:
+        args.extend(["-cookies", cookies])
+    if headers:
+        # 各ヘッダーの末尾に CRLF が無いと FFmpeg が警告を出す
+        args.extend(["-headers", "".join(f"{key}: {value}\r\n" for key, value in headers.items())])
+    return " ".join(shlex.quote(a) for a in args)
+
+
+def input_options_for(profiles: Dict[str, FFmpegInputProfile], track, *, base_options: Optional[str] = None,
+                      seek_seconds: Optional[int] = None, relayed: bool = False) -> Tuple[str, str]:
+    """
+    Track に合うプロファイルを選び、(プロファイル名, before_options) を返す。
+    relayed はストリームリレーがヘッダー・クッキーを付けて中継すること (FFmpeg には渡さない)。
+    """
+    name = select_profile_name(stream_url=track.stream_url, extractor=track.extractor, protocol=track.protocol)
+    profile = profiles.get(name) or profiles.get("default") or DEFAULT_PROFILES["default"]
+    if name == "local":
+        # ダウンロード後に変換されたファイルは抽出時の ext と異なることがあるので、拡張子を使う
+        container = Path(track.stream_url).suffix.lstrip(".")
+    elif track.protocol in (None, "http", "https"):
+        container = track.container
+    else:
+        container = None  # DASH などのマニフェストは ext とデマルチプレクサが一致しない
+    options = profile.before_options(container=container, codec_known=bool(track.acodec),
+                                     base_options=base_options, seek_seconds=seek_seconds)
+    if not relayed and track.stream_url and track.stream_url.startswith(("http://", "https://")):
+        http_options = http_input_options(getattr(track, "http_headers", None), getattr(track, "http_cookies", None))
+        if http_options:
+            options = f"{options} {http_options}"
+    return name, options
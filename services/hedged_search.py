@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple
+
+from services.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+SearchFunc = Callable[[str], Awaitable[Any]]
+
+
+def _is_good(result: Any) -> bool:
+    return result is not None and result != []
+
+
+class HedgedSearch:
+    """
+    フリーワード検索を複数のプロバイダへヘッジして投げる。
+
+    まず先頭 (primary) のプロバイダで検索し、ヘッジ遅延を過ぎても結果が無ければ次のプロバイダも
+    並行して検索する。最初に得られた有効な結果を採用し、残りはキャンセルする。
+    プロバイダが失敗した場合は遅延を待たずに次を開始する。
+
+    ヘッジ遅延はプロバイダごとの直近レイテンシのパーセンタイル (既定 p95) から決まるので、
+    primary が普段どおり速い間は追加の検索はほとんど発生しない。
+    プロバイダは「クエリを受け取り結果 (None/空なら失敗扱い) を返す非同期関数」なので、
+    テストやベンチマークでは yt-dlp の代わりに任意の関数を渡せる。
+    """
+
+    def __init__(self, providers: Sequence[Tuple[str, SearchFunc]], *, hedge_percentile: float = 95.0,
+                 initial_delay: float = 1.5, min_delay: float = 0.3, max_delay: float = 5.0,
+                 min_samples: int = 5):
+        if not providers:
+            raise ValueError("HedgedSearch には1つ以上のプロバイダが必要です。")
+        self.providers: List[Tuple[str, SearchFunc]] = list(providers)
+        self.hedge_percentile = hedge_percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.latency: Dict[str, Histogram] = {name: Histogram(window=128) for name, _ in self.providers}
+        self.wins: Dict[str, int] = {name: 0 for name, _ in self.providers}
+        self.hedged_count = 0
+
+    def hedge_delay(self, name: str) -> float:
+        """name のプロバイダの結果を待ってから次のプロバイダを開始するまでの秒数。"""
+        histogram = self.latency[name]
+        if histogram.count < self.min_samples:
+            return self.initial_delay
+        observed = histogram.percentile(self.hedge_percentile) or self.initial_delay
+        return min(self.max_delay, max(self.min_delay, observed))
+
+    async def _timed(self, name: str, func: SearchFunc, query: str) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await func(query)
+        except asyncio.CancelledError:
+            # ヘッジに負けてキャンセルされた: 少なくともここまではかかったので、下限として記録する。
+            # 記録しないと速く終わった結果だけでパーセンタイルが決まり、ヘッジ遅延が min_delay へ縮み続ける
+            self.latency[name].observe(time.perf_counter() - started)
+            raise
+        except Exception as e:
+            logger.debug(f"Search provider {name} failed for {query!r}: {e}")
+            result = None
+        # 失敗も含めて記録する (遅くて失敗するプロバイダほどヘッジが早くなる)
+        self.latency[name].observe(time.perf_counter() - started)
+        return result
+
+    async def search(self, query: str) -> Any:
+        tasks: Dict[asyncio.Task, str] = {}
+        pending_providers = list(self.providers)
+
+        def start_next():
+            name, func = pending_providers.pop(0)
+            tasks[asyncio.create_task(self._timed(name, func, query))] = name
+
+        start_next()
+        try:
+            while tasks:
+                # まだ控えのプロバイダがあれば、直近に開始したプロバイダのヘッジ遅延までだけ待つ
+                timeout = self.hedge_delay(list(tasks.values())[-1]) if pending_providers else None
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.hedged_count += 1
+                    start_next()
+                    continue
+                for task in done:
+                    name = tasks.pop(task)
+                    result = task.result()
+                    if _is_good(result):
+                        self.wins[name] += 1
+                        return result
+                if pending_providers:
+                    # 失敗したプロバイダの分をすぐに補う
+                    start_next()
+            return None
+        finally:
+            # 負けたプロバイダの待機をやめる (実行中の yt-dlp スレッド自体は止められず、結果は捨てられる)
+            for task in tasks:
+                task.cancel()
+
+    def format_stats(self) -> str:
+        parts = []
+        for name, _ in self.providers:
+            p50 = self.latency[name].percentile(50)
+            parts.append(f"{name} wins={self.wins[name]} p50={p50:.2f}s" if p50 is not None
+                         else f"{name} wins={self.wins[name]}")
+        return f"hedged_search hedged={self.hedged_count} " + " ".join(parts)
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import re
+import shlex
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# ebur128 フィルタの最後に出力されるサマリーの統合ラウドネス (例: "I:         -13.9 LUFS")
+_INTEGRATED_RE = re.compile(rb"I:\s+(-?\d+(?:\.\d+)?)\s+LUFS")
+_STDERR_TAIL_BYTES = 4096
+
+
+class LoudnessCache:
+    """
+    トラックごとの統合ラウドネス (LUFS) を一度だけ計測して永続化し、再生時の静的ゲインを返す。
+
+    計測はバックグラウンドの ffmpeg (ebur128) で行い、再生中の ffmpeg にはフィルタを追加しない。
+    計測で読むのは先頭の sample_seconds 秒だけなので (0 なら全体)、曲全体をもう一度ダウンロード・デコードすることはない。
+    未計測のトラックは計測が終わるまでゲイン 1.0 (無補正) として扱う。
+    """
+
+    def __init__(self, path: Path, *, ffmpeg_path: str = "ffmpeg", target_lufs: float = -14.0,
+                 max_boost_db: float = 6.0, max_cut_db: float = 20.0, max_concurrent: int = 2,
+                 sample_seconds: float = 60.0):
+        self.path = Path(path)
+        self.ffmpeg_path = ffmpeg_path
+        self.sample_seconds = sample_seconds
+        self.target_lufs = target_lufs
+        self.max_boost_db = max_boost_db
+        self.max_cut_db = max_cut_db
+        self._measurements: Dict[str, float] = self._load()
+        self._in_flight: Set[str] = set()
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrent))
+        self._save_task: Optional[asyncio.Task] = None
+
+    def _load(self) -> Dict[str, float]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return {str(k): float(v) for k, v in data.items()}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Loudness cache {self.path} could not be loaded, starting empty: {e}")
+            return {}
+
+    def _write(self, snapshot: Dict[str, float]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def _schedule_save(self):
+        if self._save_task and not self._save_task.done():
+            return
+
+        async def _save_later():
+            await asyncio.sleep(5)  # 連続した計測結果をまとめて書き込む
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, dict(self._measurements))
+            except Exception as e:
+                logger.warning(f"Failed to save loudness cache {self.path}: {e}")
+
+        self._save_task = asyncio.create_task(_save_later())
+
+    def has_measurement(self, key: str) -> bool:
+        return key in self._measurements
+
+    def get_gain(self, key: str) -> float:
+        """計測済みなら目標ラウドネスに合わせる線形ゲイン、未計測なら 1.0 を返す。"""
+        measured = self._measurements.get(key)
+        if measured is None:
+            return 1.0
+        gain_db = min(self.max_boost_db, max(-self.max_cut_db, self.target_lufs - measured))
+        return 10 ** (gain_db / 20)
+
+    def request_measurement(self, key: str, source: str, *, before_options: Optional[str] = None,
+                            on_done: Optional[Callable[[str, float], None]] = None):
+        """未計測なら計測をバックグラウンドで開始する。再生開始は待たせない。"""
+        if key in self._measurements or key in self._in_flight:
+            return
+        self._in_flight.add(key)
+        asyncio.create_task(self._measure_and_store(key, source, before_options, on_done))
+
+    async def _measure_and_store(self, key: str, source: str, before_options: Optional[str],
+                                 on_done: Optional[Callable[[str, float], None]]):
+        try:
+            async with self._semaphore:
+                measured = await self.measure(source, before_options=before_options)
+            if measured is None:
+                return
+            self._measurements[key] = measured
+            self._schedule_save()
+            logger.debug(f"Measured loudness {measured:.1f} LUFS for {key}")
+            if on_done:
+                on_done(key, self.get_gain(key))
+        except Exception as e:
+            logger.warning(f"Loudness measurement failed for {key}: {e}")
+        finally:
+            self._in_flight.discard(key)
+
+    async def measure(self, source: str, *, before_options: Optional[str] = None) -> Optional[float]:
+        """ffmpeg の ebur128 フィルタで統合ラウドネスを計測する (デコードのみで出力は捨てる)。"""
+        args = [self.ffmpeg_path, "-hide_banner", "-nostats"]
+        if before_options:
+            args.extend(shlex.split(before_options))
+        if self.sample_seconds > 0:
+            args.extend(["-t", str(self.sample_seconds)])  # 入力オプションなので、それ以降は読み込まない
+        args.extend(["-i", source, "-vn", "-sn", "-dn", "-af", "ebur128", "-f", "null", "-"])
+
+        process = await asyncio.create_subprocess_exec(
+            *args, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        # ebur128 はフレームごとにログを出すので、サマリーが含まれる末尾だけを保持する
+        tail = b""
+        while True:
+            chunk = await process.stderr.read(65536)
+            if not chunk:
+                break
+            tail = (tail + chunk)[-_STDERR_TAIL_BYTES:]
+        await process.wait()
+        if process.returncode != 0:
+            return None
+
+        matches = _INTEGRATED_RE.findall(tail)
+        if not matches:
+            return None
+        # 無音に近いトラック (-70 LUFS 付近) も max_boost_db で頭打ちになるのでそのまま保存する
+        return float(matches[-1])
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """一定期間あたりの送信回数を制限するトークンバケット。"""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = max(1, capacity)
+        self.refill_rate = self.capacity / period  # tokens / sec
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.refill_rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """次のトークンが使えるまでの秒数 (0 なら今すぐ使える)。"""
+        self._refill()
+        if self._tokens >= 1:
+            return 0.0
+        return (1 - self._tokens) / self.refill_rate
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def consume(self):
+        self._refill()
+        self._tokens -= 1
+
+    def penalize(self, retry_after: float):
+        """429 を受けたときはバケットを空にして retry_after 秒待たせる。"""
+        self._refill()
+        self._tokens = min(self._tokens, 1 - retry_after * self.refill_rate)
+
+    async def acquire(self):
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.consume()
+                return
+            await asyncio.sleep(wait)
+
+
+class _Outbound:
+    __slots__ = ("lines", "coalesce_key", "batch_key", "created_at", "dropped")
+
+    def __init__(self, content: str, coalesce_key: Optional[str], batch_key: Optional[str]):
+        self.lines: List[str] = [content]
+        self.coalesce_key = coalesce_key
+        self.batch_key = batch_key
+        self.created_at = time.monotonic()
+        self.dropped = 0  # バッチ上限を超えてまとめられた件数
+
+    def render(self) -> str:
+        content = "\n".join(self.lines)
+        if self.dropped:
+            content += f"\n(+{self.dropped})"
+        return content[:2000]
+
+
+class MessageScheduler:
+    """
+    チャンネルごとの送信キュー。Discord のレート制限を超えないように送信を事前に間引く。
+
+    - coalesce_key が同じ未送信メッセージは新しいもので置き換える (連続した「再生中」通知など)
+    - batch_key が同じ未送信メッセージは1通にまとめる (連続したエラー通知など)
+    - チャンネル単位 (既定 5通/5秒) と全体 (既定 50通/秒) のトークンバケットで送信間隔を制御する
+    """
+
+    def __init__(self, bot: discord.Client, *, channel_rate: int = 5, channel_period: float = 5.0,
+                 global_rate: int = 50, global_period: float = 1.0, batch_window: float = 1.5,
+                 max_batch_lines: int = 10, max_pending_per_channel: int = 20):
+        self.bot = bot
+        self.channel_rate = channel_rate
+        self.channel_period = channel_period
+        self.batch_window = batch_window
+        self.max_batch_lines = max_batch_lines
+        self.max_pending_per_channel = max_pending_per_channel
+        self.global_bucket = TokenBucket(global_rate, global_period)
+        self._pending: Dict[int, Deque[_Outbound]] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self.sent_count = 0
+        self.coalesced_count = 0
+
+    def enqueue(self, channel_id: int, content: str, *, coalesce_key: Optional[str] = None,
+                batch_key: Optional[str] = None):
+        pending = self._pending.setdefault(channel_id, deque())
+
+        if batch_key:
+            for message in reversed(pending):
+                if message.batch_key == batch_key:
+                    if len(message.lines) < self.max_batch_lines:
+                        message.lines.append(content)
+                    else:
+                        message.dropped += 1
+                    self.coalesced_count += 1
+                    return
+
+        if coalesce_key:
+            for message in list(pending):
+                if message.coalesce_key == coalesce_key:
+                    pending.remove(message)
+                    self.coalesced_count += 1
+
+        if len(pending) >= self.max_pending_per_channel:
+            pending.popleft()
+            self.coalesced_count += 1
+        pending.append(_Outbound(content, coalesce_key, batch_key))
+
+        worker = self._workers.get(channel_id)
+        if not worker or worker.done():
+            self._workers[channel_id] = asyncio.create_task(self._run_channel(channel_id))
+
+    def try_acquire(self, channel_id: int) -> bool:
+        """チャンネルと全体の両方に余裕があれば送信枠を消費して True を返す (待たない)。"""
+        bucket = self._bucket_for(channel_id)
+        if bucket.delay() > 0 or self.global_bucket.delay() > 0:
+            return False
+        bucket.consume()
+        self.global_bucket.consume()
+        return True
+
+    def penalize(self, channel_id: int, retry_after: float):
+        self._bucket_for(channel_id).penalize(retry_after)
+
+    def pending_count(self) -> int:
+        return sum(len(p) for p in self._pending.values())
+
+    def _bucket_for(self, channel_id: int) -> TokenBucket:
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._buckets[channel_id] = TokenBucket(self.channel_rate, self.channel_period)
+        return bucket
+
+    async def _run_channel(self, channel_id: int):
+        pending = self._pending.get(channel_id)
+        bucket = self._bucket_for(channel_id)
+        try:
+            while pending:
+                head = pending[0]
+                if head.batch_key:
+                    # まとめられる通知は少しだけ待って後続を集める
+                    remaining = self.batch_window - (time.monotonic() - head.created_at)
+                    if remaining > 0:
+                        await asyncio.sleep(remaining)
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+                if not pending:
+                    break
+                message = pending.popleft()
+                retry_after = await self._send(channel_id, message)
+                if retry_after:
+                    # 予測を超えて 429 を受けた場合は先頭に戻して待つ
+                    pending.appendleft(message)
+                    bucket.penalize(retry_after)
+        finally:
+            if not pending:
+                self._pending.pop(channel_id, None)
+                self._workers.pop(channel_id, None)
+                if bucket.is_full():  # 使われていないチャンネルの状態は持ち続けない
+                    self._buckets.pop(channel_id, None)
+
+    async def _send(self, channel_id: int, message: _Outbound) -> Optional[float]:
+        channel = self.bot.get_channel(channel_id)
+        if not isinstance(channel, discord.abc.Messageable):
+            return None
+        try:
+            await channel.send(message.render())
+            self.sent_count += 1
+        except discord.Forbidden:
+            logger.debug(f"No permission to send to channel {channel_id}")
+        except discord.HTTPException as e:
+            if e.status == 429:
+                return float(getattr(e, "retry_after", None) or self.channel_period)
+            logger.error(f"Background message error: {e}")
+        except Exception as e:
+            logger.error(f"Background message error: {e}")
+        return None
+
+    async def close(self):
+        for worker in list(self._workers.values()):
+            worker.cancel()
+        self._workers.clear()
+        self._pending.clear()
@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_name(name: str, labels: LabelKey) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    """直近 window 件の観測値を保持し、パーセンタイルを計算する。"""
+
+    def __init__(self, window: int = 1024):
+        self._lock = threading.Lock()
+        self._values: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        with self._lock:
+            self._values.append(value)
+            self.count += 1
+            self.total += value
+
+    def percentile(self, p: float) -> Optional[float]:
+        with self._lock:
+            values = sorted(self._values)
+        if not values:
+            return None
+        index = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+        return values[index]
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            values = sorted(self._values)
+            count, total = self.count, self.total
+        if not values:
+            return {"count": count}
+
+        def pick(p: float) -> float:
+            return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+        return {"count": count, "mean": total / count, "p50": pick(50), "p95": pick(95), "p99": pick(99)}
+
+
+class MetricsRegistry:
+    """プロセス内の簡易メトリクス。管理者向けの /music_stats で表示する。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, LabelKey], Counter] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], Histogram] = {}
+
+    def counter(self, name: str, **labels) -> Counter:
+        key = (name, _label_key(labels))
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = Counter()
+            return counter
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            return histogram
+
+    def format_lines(self, prefix: Optional[str] = None) -> List[str]:
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        lines = []
+        for (name, labels), counter in counters:
+            if prefix is None or name.startswith(prefix):
+                lines.append(f"{_format_name(name, labels)} {counter.value:g}")
+        for (name, labels), histogram in histograms:
+            if prefix is not None and not name.startswith(prefix):
+                continue
+            summary = histogram.summary()
+            if summary.get("count", 0) == 0 or "p50" not in summary:
+                continue
+            lines.append(
+                f"{_format_name(name, labels)} n={summary['count']} mean={summary['mean']:.3f} "
+                f"p50={summary['p50']:.3f} p95={summary['p95']:.3f} p99={summary['p99']:.3f}"
+            )
+        return lines
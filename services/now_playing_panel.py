@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional
+
+import discord
+
+from services.message_scheduler import MessageScheduler, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PanelRender:
+    embed: discord.Embed
+    refresh_after: Optional[float] = None  # 進捗更新の間隔 (秒)。None なら定期更新しない (一時停止中など)
+
+
+class _Panel:
+    __slots__ = ("channel_id", "message", "view", "dirty", "next_refresh", "busy")
+
+    def __init__(self, channel_id: int):
+        self.channel_id = channel_id
+        self.message: Optional[discord.Message] = None
+        self.view: Optional[discord.ui.View] = None
+        self.dirty = True
+        self.next_refresh: Optional[float] = None
+        self.busy = False
+
+
+class NowPlayingView(discord.ui.View):
+    """パネルに付ける一時停止/再開・スキップボタン。"""
+
+    def __init__(self, guild_id: int, on_toggle_pause: Callable[[discord.Interaction, int], Awaitable[None]],
+                 on_skip: Callable[[discord.Interaction, int], Awaitable[None]]):
+        super().__init__(timeout=None)
+        self.guild_id = guild_id
+        self._on_toggle_pause = on_toggle_pause
+        self._on_skip = on_skip
+
+    @discord.ui.button(emoji="⏯️", style=discord.ButtonStyle.secondary)
+    async def toggle_pause(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._on_toggle_pause(interaction, self.guild_id)
+
+    @discord.ui.button(emoji="⏭️", style=discord.ButtonStyle.secondary)
+    async def skip(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._on_skip(interaction, self.guild_id)
+
+
+class NowPlayingPanels:
+    """
+    ギルドごとに1つの「再生中」メッセージを持ち、新規投稿の代わりに編集で更新する。
+
+    全ギルドのパネル編集は1つのティッカーがまとめて行い、編集回数の全体予算 (edits_per_second) と
+    MessageScheduler のレート制限の範囲内に収める。パネルが増えて予算が足りなくなると、
+    進捗更新の間隔は自動的に引き伸ばされる。曲の切り替えなどの即時更新は定期更新より優先される。
+    """
+
+    def __init__(self, scheduler: MessageScheduler, render: Callable[[int], Optional[PanelRender]],
+                 view_factory: Callable[[int], discord.ui.View], *, edits_per_second: float = 2.0,
+                 tick_interval: float = 1.0):
+        self.scheduler = scheduler
+        self._render = render
+        self._view_factory = view_factory
+        self.edits_per_second = edits_per_second
+        self.tick_interval = tick_interval
+        self._edit_bucket = TokenBucket(max(1, int(edits_per_second * tick_interval)), tick_interval)
+        self._panels: Dict[int, _Panel] = {}
+        self._ticker: Optional[asyncio.Task] = None
+        self.edit_count = 0
+
+    def show(self, guild_id: int, channel_id: int):
+        """曲が変わったときに呼ぶ。パネルが無ければ作成、あれば次のティックで編集する。"""
+        panel = self._panels.get(guild_id)
+        if panel is None or panel.channel_id != channel_id:
+            if panel is not None:
+                self._schedule_close(panel, None)
+            panel = self._panels[guild_id] = _Panel(channel_id)
+        panel.dirty = True
+        self._ensure_ticker()
+
+    def touch(self, guild_id: int):
+        """一時停止・音量変更など、表示内容が変わったときに呼ぶ。"""
+        panel = self._panels.get(guild_id)
+        if panel:
+            panel.dirty = True
+            self._ensure_ticker()
+
+    def close(self, guild_id: int, content: Optional[str] = None) -> bool:
+        """
+        パネルを最終状態にしてボタンを外す。content を表示できる投稿済みのパネルがあった場合は True
+        (False なら、呼び出し側が通常のメッセージで知らせる)。
+        """
+        panel = self._panels.pop(guild_id, None)
+        if panel is None:
+            return False
+        self._schedule_close(panel, content)
+        return panel.message is not None
+
+    def discard(self, guild_id: int):
+        panel = self._panels.pop(guild_id, None)
+        if panel and panel.view:
+            panel.view.stop()
+
+    def _schedule_close(self, panel: _Panel, content: Optional[str]):
+        if panel.view:
+            panel.view.stop()
+        if panel.message is None:
+            return
+
+        async def _close():
+            while not self.scheduler.try_acquire(panel.channel_id):
+                await asyncio.sleep(self.tick_interval)
+            try:
+                if content:
+                    await panel.message.edit(content=content, embed=None, view=None)
+                else:
+                    await panel.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
+        asyncio.create_task(_close())
+
+    def _ensure_ticker(self):
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._panels:
+            now = time.monotonic()
+            # 即時更新 (dirty) を優先し、次に期限を過ぎた定期更新を古い順に処理する
+            due = [
+                (gid, panel) for gid, panel in self._panels.items()
+                if not panel.busy and (panel.dirty or (panel.next_refresh is not None and panel.next_refresh <= now))
+            ]
+            due.sort(key=lambda item: (not item[1].dirty, item[1].next_refresh or 0))
+            for guild_id, panel in due:
+                if self._edit_bucket.delay() > 0:
+                    break
+                if not self.scheduler.try_acquire(panel.channel_id):
+                    continue
+                self._edit_bucket.consume()
+                panel.busy = True
+                asyncio.create_task(self._refresh(guild_id, panel))
+            await asyncio.sleep(self.tick_interval)
+
+    def _refresh_interval(self, requested: float) -> float:
+        # 予算を超えないよう、アクティブなパネル数に応じて更新間隔を引き伸ばす
+        return max(requested, len(self._panels) / self.edits_per_second)
+
+    async def _refresh(self, guild_id: int, panel: _Panel):
+        try:
+            panel.dirty = False
+            rendered = self._render(guild_id)
+            if rendered is None:
+                return
+            if panel.message is None:
+                channel = self.scheduler.bot.get_channel(panel.channel_id)
+                if not isinstance(channel, discord.abc.Messageable):
+                    self._panels.pop(guild_id, None)
+                    return
+                panel.view = self._view_factory(guild_id)
+                panel.message = await channel.send(embed=rendered.embed, view=panel.view)
+                if self._panels.get(guild_id) is not panel:
+                    # 投稿中にパネルが閉じられた
+                    self._schedule_close(panel, None)
+                    return
+            else:
+                await panel.message.edit(embed=rendered.embed)
+            self.edit_count += 1
+            panel.next_refresh = (time.monotonic() + self._refresh_interval(rendered.refresh_after)
+                                  if rendered.refresh_after else None)
+        except discord.NotFound:
+            # パネルが削除されていたら、次の更新で新しく投稿する
+            panel.message = None
+            panel.dirty = True
+        except discord.Forbidden:
+            logger.debug(f"No permission to update now-playing panel in channel {panel.channel_id}")
+            self._panels.pop(guild_id, None)
+        except discord.HTTPException as e:
+            if e.status == 429:
+                self.scheduler.penalize(panel.channel_id, float(getattr(e, "retry_after", None) or 5.0))
+            panel.dirty = True
+        except Exception as e:
+            logger.error(f"Now-playing panel update error: {e}")
+        finally:
+            panel.busy = False
+
+    async def close_all(self):
+        if self._ticker:
+            self._ticker.cancel()
+        for guild_id in list(self._panels):
+            self.discard(guild_id)
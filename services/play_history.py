@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import json
+import logging
+import time
+from collections import Counter
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional
+
+if TYPE_CHECKING:
+    from services.ytdlp_wrapper import Track
+
+logger = logging.getLogger(__name__)
+
+
+class TrackStats:
+    """履歴から集計した1曲分の情報 (最後に再生したときのメタデータと再生回数)。"""
+    __slots__ = ("url", "title", "duration", "extractor", "plays", "last_played")
+
+    def __init__(self, url: str, title: str, duration: int, extractor: Optional[str]):
+        self.url = url
+        self.title = title
+        self.duration = duration
+        self.extractor = extractor
+        self.plays = 0
+        self.last_played = 0
+
+
+class PlayHistory:
+    """
+    再生履歴の追記専用ログ (JSON Lines)。1行が1回の再生で、キーは短く詰めてある
+    ({"t": UNIX時刻, "g": ギルドID, "u": URL, "n": タイトル, "d": 秒数, "x": 抽出器, 自動再生なら "a": 1})。
+
+    record() はイベントループ上で集計を更新して行をためるだけで、ファイルへの追記は
+    flush_interval 秒ごとにまとめてスレッドで行う。起動時の load() でファイルを読み直して集計を作り、
+    max_entries 行を超えていれば古い行を捨てて書き直す。
+
+    add_listener() で登録した関数は、読み込んだ履歴と新しい再生の1件ごとに古い順で呼ばれる
+    (引数は ギルドID, URL, 秒数, 再生時刻, 自動再生か)。履歴から作る索引はこれで組み立てる。
+    """
+
+    def __init__(self, path: Path, *, max_entries: int = 200000, flush_interval: float = 2.0):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.tracks: Dict[str, TrackStats] = {}
+        self._guild_plays: Dict[int, Counter] = {}
+        self._pending: List[str] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[int, str, int, int, bool], None]] = []
+        self.entry_count = 0
+        self.write_errors = 0
+
+    async def load(self):
+        lines = await asyncio.to_thread(self._read_lines)
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                self._apply(entry["g"], entry["u"], entry.get("n", ""), entry.get("d", 0), entry.get("x"), entry["t"],
+                            bool(entry.get("a")))
+            except (ValueError, KeyError, TypeError):
+                continue  # 書き込み途中で落ちた行など
+        if len(lines) > self.max_entries:
+            await asyncio.to_thread(self._rewrite, lines[-self.max_entries:])
+        logger.info(f"Play history: {self.entry_count} plays of {len(self.tracks)} tracks loaded")
+
+    def add_listener(self, listener: Callable[[int, str, int, int, bool], None]):
+        self._listeners.append(listener)
+
+    def record(self, guild_id: int, track: "Track"):
+        now = int(time.time())
+        self._apply(guild_id, track.url, track.title, track.duration, track.extractor, now, track.autoplay)
+        entry = {"t": now, "g": guild_id, "u": track.url, "n": track.title, "d": track.duration, "x": track.extractor}
+        if track.autoplay:
+            entry["a"] = 1
+        self._pending.append(json.dumps(entry, ensure_ascii=False))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def _apply(self, guild_id: int, url: str, title: str, duration: int, extractor: Optional[str], played_at: int,
+               autoplay: bool = False):
+        stats = self.tracks.get(url)
+        if stats is None:
+            stats = self.tracks[url] = TrackStats(url, title, duration, extractor)
+        else:
+            stats.title, stats.duration, stats.extractor = title, duration, extractor or stats.extractor
+        stats.plays += 1
+        stats.last_played = played_at
+        plays = self._guild_plays.get(guild_id)
+        if plays is None:
+            plays = self._guild_plays[guild_id] = Counter()
+        plays[url] += 1
+        self.entry_count += 1
+        for listener in self._listeners:
+            listener(guild_id, url, duration, played_at, autoplay)
+
+    def top(self, n: int = 10, guild_id: Optional[int] = None) -> List[TrackStats]:
+        """再生回数の多い曲 (guild_id を渡せばそのギルドでの回数) を多い順に n 曲。"""
+        if guild_id is None:
+            return heapq.nlargest(n, self.tracks.values(), key=lambda s: (s.plays, s.last_played))
+        plays = self._guild_plays.get(guild_id)
+        if not plays:
+            return []
+        return [self.tracks[url] for url, _ in plays.most_common(n)]
+
+    def guild_plays(self, guild_id: int, url: str) -> int:
+        plays = self._guild_plays.get(guild_id)
+        return plays[url] if plays else 0
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        lines, self._pending = self._pending, []
+        try:
+            await asyncio.to_thread(self._append, lines)
+        except OSError as e:
+            self.write_errors += 1
+            logger.warning(f"Play history: failed to append {len(lines)} entries: {e}")
+
+    async def close(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+    def _read_lines(self) -> List[str]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return [line for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _append(self, lines: Iterable[str]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+    def _rewrite(self, lines: List[str]):
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("".join(line if line.endswith("\n") else line + "\n" for line in lines))
+        tmp.replace(self.path)
+
+    def format_stats(self) -> str:
+        return (f"play_history plays={self.entry_count} tracks={len(self.tracks)} guilds={len(self._guild_plays)} "
+                f"pending={len(self._pending)} write_errors={self.write_errors}")
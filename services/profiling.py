@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+class Profiler:
+    """
+    本番環境で再起動せずに使うオンデマンドのプロファイラ。
+
+    - CPU: 別スレッドから sys._current_frames() を一定間隔で読み、全スレッドのスタックを
+      flamegraph.pl / speedscope で読める collapsed 形式 ("a;b;c 回数") で書き出す
+    - メモリ: tracemalloc のスナップショットを取り、前回のスナップショットとの差分と上位 N 件を書き出す
+    - タスク: asyncio の全タスクと、それぞれが待っている箇所のスタックを書き出す
+
+    どれも呼ばれたときだけ動く。止まっている間はフックもスレッドも無いので、再生には影響しない
+    (tracemalloc だけは memory_start() から memory_stop() までメモリ確保ごとのコストがかかる)。
+    """
+
+    def __init__(self, output_dir: str, *, sample_interval: float = 0.005, max_seconds: float = 120,
+                 top_n: int = 30, tracemalloc_frames: int = 10):
+        self.output_dir = Path(output_dir)
+        self.sample_interval = sample_interval
+        self.max_seconds = max_seconds
+        self.top_n = top_n
+        self.tracemalloc_frames = tracemalloc_frames
+        self._sampling = False
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def sampling(self) -> bool:
+        return self._sampling
+
+    def _path(self, kind: str, suffix: str) -> Path:
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        return self.output_dir / f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.{suffix}"
+
+    # --- CPU ---
+
+    async def sample_cpu(self, seconds: float) -> Tuple[Path, int, List[Tuple[str, int]]]:
+        """seconds 秒サンプリングし、(出力ファイル, サンプル数, 自身の時間が長い関数の上位) を返す。"""
+        if self._sampling:
+            raise RuntimeError("サンプリングは既に実行中です。")
+        self._sampling = True
+        try:
+            seconds = max(1.0, min(seconds, self.max_seconds))
+            stacks, samples = await asyncio.to_thread(self._sample, seconds)
+            path = self._path("cpu", "collapsed")
+            await asyncio.to_thread(self._write_collapsed, path, stacks)
+        finally:
+            self._sampling = False
+        leaves = Counter()
+        for stack, count in stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return path, samples, leaves.most_common(5)
+
+    def _sample(self, seconds: float) -> Tuple[Counter, int]:
+        stacks: Counter = Counter()
+        me = threading.get_ident()
+        names = {}
+        samples = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    # スレッド名の取得は新しいスレッドが見えたときだけ行う
+                    names.update((t.ident, t.name) for t in threading.enumerate())
+                    name = names.get(ident, str(ident))
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                labels.append(name)
+                labels.reverse()
+                stacks[";".join(labels)] += 1
+            del frames
+            samples += 1
+            time.sleep(self.sample_interval)
+        return stacks, samples
+
+    @staticmethod
+    def _write_collapsed(path: Path, stacks: Counter):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    # --- メモリ ---
+
+    def memory_start(self) -> bool:
+        """tracemalloc を開始する。既に動いていれば False。"""
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start(self.tracemalloc_frames)
+        self._snapshot = None
+        return True
+
+    def memory_stop(self) -> bool:
+        if not tracemalloc.is_tracing():
+            return False
+        tracemalloc.stop()
+        self._snapshot = None
+        return True
+
+    async def memory_snapshot(self) -> Tuple[Path, int]:
+        """
+        スナップショットを取り、上位 N 件と前回からの差分をファイルへ書き出す。
+        (出力ファイル, 追跡中の合計バイト数) を返す。
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc が開始されていません。")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        previous, self._snapshot = self._snapshot, snapshot
+        path = self._path("memory", "txt")
+        total = await asyncio.to_thread(self._write_memory, path, snapshot, previous)
+        return path, total
+
+    def _write_memory(self, path: Path, snapshot: tracemalloc.Snapshot,
+                      previous: Optional[tracemalloc.Snapshot]) -> int:
+        stats = snapshot.statistics("traceback")
+        total = sum(stat.size for stat in stats)
+        out = io.StringIO()
+        out.write(f"# traced={total / 1048576:.1f}MiB peak={tracemalloc.get_traced_memory()[1] / 1048576:.1f}MiB\n")
+        if previous is not None:
+            out.write(f"\n## diff (top {self.top_n})\n")
+            for stat in snapshot.compare_to(previous, "traceback")[:self.top_n]:
+                out.write(f"\n{stat.size_diff / 1024:+.1f}KiB ({stat.count_diff:+d} blocks) "
+                          f"total={stat.size / 1024:.1f}KiB\n")
+                out.writelines(f"  {line}\n" for line in stat.traceback.format())
+        out.write(f"\n## top {self.top_n}\n")
+        for stat in stats[:self.top_n]:
+            out.write(f"\n{stat.size / 1024:.1f}KiB ({stat.count} blocks)\n")
+            out.writelines(f"  {line}\n" for line in stat.traceback.format())
+        path.write_text(out.getvalue(), encoding="utf-8")
+        return total
+
+    # --- asyncio タスク ---
+
+    async def dump_tasks(self) -> Tuple[Path, int]:
+        """実行中の全タスクと待機位置を書き出す。(出力ファイル, タスク数) を返す。"""
+        tasks = sorted(asyncio.all_tasks(), key=lambda t: t.get_name())
+        out = io.StringIO()
+        for task in tasks:
+            coro = task.get_coro()
+            out.write(f"{task.get_name()} {getattr(coro, '__qualname__', coro)} "
+                      f"{'done' if task.done() else 'pending'}\n")
+            for frame in task.get_stack(limit=20):
+                out.write(f"  {frame.f_code.co_filename}:{frame.f_lineno} {frame.f_code.co_name}\n")
+        path = self._path("tasks", "txt")
+        await asyncio.to_thread(path.write_text, out.getvalue(), "utf-8")
+        return path, len(tasks)
@@ -0,0 +1,570 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+import secrets
+import shutil
+from collections import Counter, OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from urllib.parse import quote, urljoin, urlsplit
+
+import aiohttp
+from aiohttp import web
+
+if TYPE_CHECKING:
+    from services.ytdlp_wrapper import Track
+
+logger = logging.getLogger(__name__)
+
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+_RELAYED_PROTOCOLS = ("http", "https")
+_URI_ATTRIBUTE_RE = re.compile(r'URI="([^"]+)"')  # #EXT-X-KEY / #EXT-X-MAP などの URI 属性
+
+
+class UpstreamError(RuntimeError):
+    """上流ホストからブロックを取得できなかった (URL の期限切れ・レンジ非対応など)。"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class _Stream:
+    """リレーが受け持つ1本のストリーム。トークンはトラックの URL から作るので、URL の再解決後も同じ。"""
+    __slots__ = ("token", "upstream", "headers", "host", "size", "content_type", "verified", "readers")
+
+    def __init__(self, token: str, upstream: str, headers: Optional[Dict[str, str]]):
+        self.token = token
+        self.upstream = upstream
+        self.headers = dict(headers or {})
+        self.host = urlsplit(upstream).hostname or ""
+        self.size: Optional[int] = None
+        self.content_type = "application/octet-stream"
+        self.verified = False  # 現在の上流 URL でサイズを確認済みか
+        self.readers = 0  # 読み込み中の HTTP リクエスト数
+
+
+class _ProxiedStream:
+    """
+    クッキーが必要なストリーム (ニコニコ動画の HLS など) の中継先。キャッシュはせず、そのまま中継する。
+    HLS のプレイリストは、中のセグメント・鍵・子プレイリストの URL もリレー経由に書き換えて返す。
+    """
+    __slots__ = ("token", "headers", "cookies", "hosts")
+
+    def __init__(self, token: str, upstream: str, headers: Optional[Dict[str, str]], cookies: Optional[str]):
+        self.token = token
+        self.headers = dict(headers or {})
+        self.cookies: List[Tuple[str, str, str]] = []  # (name=value, ドメイン, パス)
+        for line in (cookies or "").splitlines():
+            # FFmpeg の -cookies 形式: "name=value; path=/; domain=.example.com;"
+            parts = [part.strip() for part in line.split(";") if part.strip()]
+            if not parts or "=" not in parts[0]:
+                continue
+            attributes = dict(part.split("=", 1) for part in parts[1:] if "=" in part)
+            self.cookies.append((parts[0], attributes.get("domain", "").lstrip(".").lower(),
+                                 attributes.get("path", "/")))
+        # 中継してよいのは、元のホストとクッキーのドメインだけ
+        self.hosts = {(urlsplit(upstream).hostname or "").lower()} | {domain for _, domain, _ in self.cookies if domain}
+
+    def allows(self, url: str) -> bool:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        return parts.scheme in _RELAYED_PROTOCOLS and any(
+            host == allowed or host.endswith("." + allowed) for allowed in self.hosts)
+
+    def cookie_header(self, url: str) -> Optional[str]:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        path = parts.path or "/"
+        matched = [pair for pair, domain, cookie_path in self.cookies
+                   if (not domain or host == domain or host.endswith("." + domain)) and path.startswith(cookie_path)]
+        return "; ".join(matched) if matched else None
+
+
+class StreamRelay:
+    """
+    FFmpeg と上流のメディアホストの間に入る、ローカルのキャッシュ付き HTTP リレー。
+
+    - FFmpeg には http://127.0.0.1:<port>/s/<token> を渡し、リレーが上流へレンジリクエストで取りに行く
+    - 上流からは block_size 単位で取得し、ディスクに保存する (合計 max_cache_bytes を超えたら古い順に削除)。
+      同じ曲を別のギルドが再生したとき・シーク・ループ再生ではキャッシュから返す
+    - 同じブロックを同時に要求した読み手は、1回の上流取得を共有する
+    - 読み進める先の readahead_blocks 個のブロックは先に取得しておく
+    - 上流への接続はホストごとに per_host_connections 本まで (接続プールを共有)
+    - 登録したストリームは最後に使った順に max_streams 個まで保持する。キャッシュ済みのブロックが
+      すべて追い出されたストリームも、読み込み中でなければ登録ごと消す
+    - クッキーが必要なストリームは proxy_url() で登録し、クッキーはリレーが上流へのリクエストに付ける
+      (FFmpeg のコマンドラインに載せると、同じホストの他のユーザーからプロセス一覧で見えるため)。
+      progressive=False のリレーはこの中継だけを行い、accepts() は常に False を返す
+    """
+
+    def __init__(self, cache_dir: Path, *, max_cache_bytes: int = 1024 * 1024 * 1024, block_size: int = 512 * 1024,
+                 readahead_blocks: int = 2, per_host_connections: int = 4, request_timeout: float = 20.0,
+                 max_streams: int = 4096, bind_host: str = "127.0.0.1", port: int = 0, progressive: bool = True):
+        self.cache_dir = Path(cache_dir)
+        self.progressive = progressive
+        self.max_cache_bytes = max_cache_bytes
+        self.block_size = block_size
+        self.readahead_blocks = readahead_blocks
+        self.per_host_connections = per_host_connections
+        self.request_timeout = request_timeout
+        self.max_streams = max_streams
+        self.bind_host = bind_host
+        self.port = port
+        self._streams: "OrderedDict[str, _Stream]" = OrderedDict()  # 最後に使った順
+        self._proxied: "OrderedDict[str, _ProxiedStream]" = OrderedDict()  # 同上 (クッキー付きの中継)
+        self._token_blocks: Counter = Counter()  # トークンごとのキャッシュ済みブロック数
+        self._blocks: "OrderedDict[Tuple[str, int], int]" = OrderedDict()  # LRU 順のキャッシュ済みブロック
+        self._cached_bytes = 0
+        self._in_flight: Dict[Tuple[str, int], asyncio.Future] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._runner: Optional[web.AppRunner] = None
+        self.upstream_bytes = 0
+        self.served_bytes = 0
+        self.block_hits = 0
+        self.block_misses = 0
+        self.shared_fetches = 0
+
+    # --- 起動・終了 ---
+
+    @property
+    def running(self) -> bool:
+        return self._runner is not None
+
+    async def start(self):
+        if self._runner is not None:
+            return
+        if self.progressive:
+            await asyncio.to_thread(self._load_index)
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self.per_host_connections),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.request_timeout,
+                                          sock_read=self.request_timeout),
+            auto_decompress=False
+        )
+        app = web.Application()
+        app.router.add_get("/s/{token}", self._handle)
+        app.router.add_get("/p/{token}/{target}/{name}", self._handle_proxied)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.bind_host, self.port)
+        await site.start()
+        self.port = runner.addresses[0][1]
+        self._runner = runner
+        logger.info(f"Stream relay listening on {self.bind_host}:{self.port} "
+                    f"({self._cached_bytes / 1048576:.0f}MiB cached)")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    # --- 登録 ---
+
+    def accepts(self, track: "Track") -> bool:
+        """リレーを通すべきトラックか (HTTP の単一ファイルのみ。HLS やライブ配信、ローカルファイルは対象外)。"""
+        return (self.running and self.progressive and not track.is_live and track.protocol in _RELAYED_PROTOCOLS
+                and bool(track.stream_url) and track.stream_url.startswith(("http://", "https://")))
+
+    def local_url(self, key: str, upstream: str, headers: Optional[Dict[str, str]] = None) -> str:
+        """
+        key (トラックの URL) のストリームを upstream から中継するローカル URL を返す。
+        同じ key で別の upstream (再解決後の URL) が渡されたら、次の読み込み時にサイズを確かめ直す。
+        """
+        token = self._token(key)
+        stream = self._streams.get(token)
+        if stream is None:
+            self._trim_streams()
+            stream = self._streams[token] = _Stream(token, upstream, headers)
+        else:
+            self._streams.move_to_end(token)
+        if stream.upstream != upstream:
+            stream.upstream = upstream
+            stream.headers = dict(headers or {})
+            stream.host = urlsplit(upstream).hostname or ""
+            stream.verified = False
+        return f"http://{self.bind_host}:{self.port}/s/{token}"
+
+    def proxy_url(self, upstream: str, headers: Optional[Dict[str, str]] = None, cookies: Optional[str] = None) -> str:
+        """
+        upstream をキャッシュせずに中継するローカル URL を返す。cookies (FFmpeg の -cookies 形式) は
+        リレーが上流へのリクエストに付ける。トークンは登録ごとの乱数なので、URL から推測されない。
+        """
+        token = secrets.token_hex(16)
+        while len(self._proxied) >= self.max_streams:
+            self._proxied.popitem(last=False)
+        self._proxied[token] = _ProxiedStream(token, upstream, headers, cookies)
+        return self._proxied_url(token, upstream)
+
+    def _proxied_url(self, token: str, upstream: str) -> str:
+        # FFmpeg の HLS デマルチプレクサは拡張子を見るので、元のファイル名をパスの末尾に残す
+        target = base64.urlsafe_b64encode(upstream.encode("utf-8")).decode("ascii").rstrip("=")
+        name = posixpath.basename(urlsplit(upstream).path) or "index"
+        return f"http://{self.bind_host}:{self.port}/p/{token}/{target}/{quote(name)}"
+
+    @staticmethod
+    def _token(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+    def _idle(self, stream: _Stream) -> bool:
+        return stream.readers == 0 and not any(key[0] == stream.token for key in self._in_flight)
+
+    def _trim_streams(self):
+        # 新しく登録する前に、古い順に読み込み中でないものから登録を外す
+        # (ブロックはディスクに残り、同じ曲を再登録すれば使われる)
+        excess = len(self._streams) + 1 - self.max_streams
+        if excess <= 0:
+            return
+        for token in [token for token, stream in self._streams.items() if self._idle(stream)][:excess]:
+            del self._streams[token]
+
+    async def warm(self, key: str, upstream: str, headers: Optional[Dict[str, str]] = None, blocks: int = 1) -> int:
+        """
+        key のストリームの先頭 blocks 個のブロックを、再生より前にキャッシュへ取得しておく。
+        既にキャッシュ済みのブロックは取り直さない。上流から取得したブロック数を返す。
+        """
+        self.local_url(key, upstream, headers)
+        stream = self._streams[self._token(key)]
+        size = await self._ensure_size(stream)
+        fetched = 0
+        for index in range(min(blocks, (size - 1) // self.block_size + 1)):
+            if (stream.token, index) in self._blocks:
+                continue
+            await self._block(stream, index)
+            fetched += 1
+        return fetched
+
+    # --- HTTP ハンドラ ---
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        stream = self._streams.get(request.match_info["token"])
+        if stream is None:
+            return web.Response(status=404)
+        self._streams.move_to_end(stream.token)
+        stream.readers += 1
+        try:
+            return await self._serve(request, stream)
+        finally:
+            stream.readers -= 1
+
+    async def _handle_proxied(self, request: web.Request) -> web.StreamResponse:
+        stream = self._proxied.get(request.match_info["token"])
+        if stream is None:
+            return web.Response(status=404)
+        target = request.match_info["target"]
+        try:
+            upstream = base64.urlsafe_b64decode(target + "=" * (-len(target) % 4)).decode("utf-8")
+        except ValueError:
+            return web.Response(status=400)
+        if not stream.allows(upstream):
+            return web.Response(status=403)
+        self._proxied.move_to_end(stream.token)
+
+        headers = {**stream.headers, "Accept-Encoding": "identity"}  # プレイリストを書き換えるので圧縮させない
+        cookie = stream.cookie_header(upstream)
+        if cookie:
+            headers["Cookie"] = cookie
+        if "Range" in request.headers:
+            headers["Range"] = request.headers["Range"]
+        response: Optional[web.StreamResponse] = None
+        try:
+            async with self._session.get(upstream, headers=headers) as upstream_response:
+                content_type = upstream_response.headers.get("Content-Type", "application/octet-stream")
+                if upstream_response.status == 200 and ("mpegurl" in content_type.lower()
+                                                        or urlsplit(upstream).path.endswith(".m3u8")):
+                    playlist = await upstream_response.text()
+                    self.upstream_bytes += len(playlist)
+                    if playlist.lstrip().startswith("#EXTM3U"):
+                        playlist = self._rewrite_playlist(stream, str(upstream_response.url), playlist)
+                    return web.Response(text=playlist, content_type="application/vnd.apple.mpegurl")
+                response = web.StreamResponse(status=upstream_response.status, headers={
+                    key: upstream_response.headers[key]
+                    for key in ("Content-Type", "Content-Length", "Content-Range", "Accept-Ranges")
+                    if key in upstream_response.headers
+                })
+                await response.prepare(request)
+                async for chunk in upstream_response.content.iter_chunked(65536):
+                    await response.write(chunk)
+                    self.upstream_bytes += len(chunk)
+                    self.served_bytes += len(chunk)
+        except ConnectionResetError:
+            pass  # FFmpeg がシーク・停止で接続を切った
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Stream relay: proxied upstream {urlsplit(upstream).hostname} failed: {e}")
+            if response is None:
+                return web.Response(status=502)
+            if request.transport is not None:
+                request.transport.close()
+        return response if response is not None else web.Response(status=502)
+
+    def _rewrite_playlist(self, stream: _ProxiedStream, base: str, playlist: str) -> str:
+        """HLS プレイリスト中の URL (セグメント・鍵・子プレイリスト) をリレー経由の URL に書き換える。"""
+        def _proxied(uri: str) -> str:
+            return self._proxied_url(stream.token, urljoin(base, uri))
+
+        lines = []
+        for line in playlist.splitlines():
+            stripped = line.strip()
+            if stripped.startswith("#"):
+                line = _URI_ATTRIBUTE_RE.sub(lambda match: f'URI="{_proxied(match.group(1))}"', line)
+            elif stripped:
+                line = _proxied(stripped)
+            lines.append(line)
+        return "\n".join(lines) + "\n"
+
+    async def _serve(self, request: web.Request, stream: _Stream) -> web.StreamResponse:
+        try:
+            size = await self._ensure_size(stream)
+        except UpstreamError as e:
+            logger.warning(f"Stream relay: upstream {stream.host} failed: {e}")
+            return web.Response(status=502)
+
+        start, end = 0, size - 1
+        partial = False
+        match = _RANGE_RE.match(request.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            partial = True
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(end, int(match.group(2)))
+            else:
+                start = max(0, size - int(match.group(2)))  # bytes=-N (末尾 N バイト)
+        if start >= size or start > end:
+            return web.Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+
+        headers = {"Accept-Ranges": "bytes", "Content-Type": stream.content_type,
+                   "Content-Length": str(end - start + 1)}
+        if partial:
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response = web.StreamResponse(status=206 if partial else 200, headers=headers)
+        await response.prepare(request)
+
+        position = start
+        try:
+            while position <= end:
+                index = position // self.block_size
+                self._prefetch(stream, index + 1)
+                data = await self._block(stream, index)
+                offset = position - index * self.block_size
+                chunk = data[offset:offset + end - position + 1]
+                if not chunk:
+                    break
+                await response.write(chunk)
+                position += len(chunk)
+                self.served_bytes += len(chunk)
+        except ConnectionResetError:
+            pass  # FFmpeg がシーク・停止で接続を切った
+        except UpstreamError as e:
+            # ヘッダーは送信済みなので、接続を切って FFmpeg 側の再接続・エラー処理に任せる
+            logger.warning(f"Stream relay: upstream {stream.host} failed at byte {position}: {e}")
+            if request.transport is not None:
+                request.transport.close()
+        return response
+
+    # --- ブロック ---
+
+    async def _ensure_size(self, stream: _Stream) -> int:
+        if stream.verified and stream.size is not None:
+            return stream.size
+        if stream.size is None:
+            # 前回までに記録したサイズ (キャッシュ済みのブロックが今の上流と同じものか確かめるのに使う)
+            await asyncio.to_thread(self._read_meta, stream)
+        size, content_type = await self._probe(stream)
+        if stream.size is not None and stream.size != size:
+            # 再解決で別のフォーマットになった: 古いブロックは使えない
+            logger.info(f"Stream relay: size of {stream.token} changed ({stream.size} -> {size}), dropping cache")
+            for key in [key for key in self._blocks if key[0] == stream.token]:
+                self._forget(key)
+            await asyncio.to_thread(shutil.rmtree, self.cache_dir / stream.token, True)
+        stream.size = size
+        stream.content_type = content_type
+        stream.verified = True
+        await asyncio.to_thread(self._write_meta, stream)
+        return size
+
+    async def _probe(self, stream: _Stream) -> Tuple[int, str]:
+        async with self._session.get(stream.upstream, headers={**stream.headers, "Range": "bytes=0-0"}) as response:
+            if response.status != 206:
+                raise UpstreamError(f"range probe returned HTTP {response.status}", response.status)
+            match = _CONTENT_RANGE_RE.match(response.headers.get("Content-Range", ""))
+            if not match or match.group(3) == "*":
+                raise UpstreamError("upstream did not report the stream size")
+            await response.read()
+            return int(match.group(3)), response.headers.get("Content-Type", "application/octet-stream")
+
+    def _prefetch(self, stream: _Stream, first_index: int):
+        last_index = (stream.size - 1) // self.block_size
+        for index in range(first_index, min(first_index + self.readahead_blocks, last_index + 1)):
+            key = (stream.token, index)
+            if key not in self._blocks and key not in self._in_flight:
+                self._start_fetch(stream, index)
+
+    def _start_fetch(self, stream: _Stream, index: int) -> asyncio.Future:
+        # 読み手とは別のタスクで取得するので、最初に要求した読み手が切断しても他の読み手の取得は続く
+        key = (stream.token, index)
+        task = asyncio.ensure_future(self._fetch_and_store(stream, index))
+        self._in_flight[key] = task
+
+        def _done(finished: asyncio.Future):
+            self._in_flight.pop(key, None)
+            if not finished.cancelled():
+                finished.exception()  # 先読みだけで誰も待っていなかった失敗を警告にしない
+
+        task.add_done_callback(_done)
+        return task
+
+    async def _block(self, stream: _Stream, index: int) -> bytes:
+        key = (stream.token, index)
+        if key in self._blocks:
+            try:
+                data = await asyncio.to_thread(self._block_path(*key).read_bytes)
+                if key in self._blocks:
+                    self._blocks.move_to_end(key)
+                self.block_hits += 1
+                return data
+            except OSError:
+                self._forget(key)  # 読む直前に追い出された
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._start_fetch(stream, index)
+        else:
+            self.shared_fetches += 1
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, stream: _Stream, index: int) -> bytes:
+        data = await self._fetch(stream, index)
+        self.block_misses += 1
+        key = (stream.token, index)
+        if await asyncio.to_thread(self._write_block, key, data) and key not in self._blocks:
+            self._blocks[key] = len(data)
+            self._cached_bytes += len(data)
+            self._token_blocks[key[0]] += 1
+            evicted = self._evict()
+            if evicted:
+                await asyncio.to_thread(self._unlink, evicted)
+        return data
+
+    async def _fetch(self, stream: _Stream, index: int) -> bytes:
+        start = index * self.block_size
+        end = min(start + self.block_size, stream.size) - 1
+        headers = {**stream.headers, "Range": f"bytes={start}-{end}"}
+        try:
+            async with self._session.get(stream.upstream, headers=headers) as response:
+                if response.status != 206:
+                    raise UpstreamError(f"HTTP {response.status} for bytes {start}-{end}", response.status)
+                data = await response.read()
+        except aiohttp.ClientError as e:
+            raise UpstreamError(str(e)) from e
+        if len(data) != end - start + 1:
+            raise UpstreamError(f"short read for bytes {start}-{end} ({len(data)} bytes)")
+        self.upstream_bytes += len(data)
+        return data
+
+    # --- ディスクキャッシュ (索引の操作はイベントループ上で行い、ファイル操作だけをスレッドで行う) ---
+
+    def _block_path(self, token: str, index: int) -> Path:
+        return self.cache_dir / token / f"{index}.blk"
+
+    def _write_block(self, key: Tuple[str, int], data: bytes) -> bool:
+        path = self._block_path(*key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(".tmp")
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            logger.warning(f"Stream relay: could not cache block {key}: {e}")
+            return False
+
+    def _evict(self) -> List[Path]:
+        """
+        上限を超えた分を古い順に索引から外し、削除すべきファイルを返す。
+        ブロックが1つも残らなくなったストリームは、読み込み中でなければ登録とメタデータも消す。
+        """
+        evicted = []
+        while self._cached_bytes > self.max_cache_bytes and self._blocks:
+            key = next(iter(self._blocks))
+            self._forget(key)
+            evicted.append(self._block_path(*key))
+            token = key[0]
+            if token not in self._token_blocks:
+                stream = self._streams.get(token)
+                if stream is None or self._idle(stream):
+                    self._streams.pop(token, None)
+                    evicted.append(self.cache_dir / token / "meta.json")
+        return evicted
+
+    @staticmethod
+    def _unlink(paths: List[Path]):
+        for path in paths:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+        for directory in {path.parent for path in paths}:
+            try:
+                directory.rmdir()  # 空になったストリームのディレクトリ (空でなければ失敗するだけ)
+            except OSError:
+                pass
+
+    def _forget(self, key: Tuple[str, int]):
+        size = self._blocks.pop(key, None)
+        if size is not None:
+            self._cached_bytes -= size
+            self._token_blocks[key[0]] -= 1
+            if self._token_blocks[key[0]] <= 0:
+                del self._token_blocks[key[0]]
+
+    def _read_meta(self, stream: _Stream):
+        try:
+            with open(self.cache_dir / stream.token / "meta.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            stream.size = int(meta["size"])
+            stream.content_type = meta.get("content_type", stream.content_type)
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _write_meta(self, stream: _Stream):
+        try:
+            directory = self.cache_dir / stream.token
+            directory.mkdir(parents=True, exist_ok=True)
+            with open(directory / "meta.json", "w", encoding="utf-8") as f:
+                json.dump({"size": stream.size, "content_type": stream.content_type}, f)
+        except OSError as e:
+            logger.debug(f"Stream relay: could not write metadata for {stream.token}: {e}")
+
+    def _load_index(self):
+        """起動時に、前回までにキャッシュしたブロックを古い順に読み込む。"""
+        if not self.cache_dir.is_dir():
+            return
+        entries = []
+        for path in self.cache_dir.glob("*/*.blk"):
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, (path.parent.name, int(path.stem)), stat.st_size))
+            except (OSError, ValueError):
+                continue
+        for _, key, size in sorted(entries):
+            self._blocks[key] = size
+            self._cached_bytes += size
+            self._token_blocks[key[0]] += 1
+        self._unlink(self._evict())
+
+    def format_stats(self) -> str:
+        return (f"stream_relay cached={self._cached_bytes / 1048576:.0f}/{self.max_cache_bytes / 1048576:.0f}MiB "
+                f"blocks={len(self._blocks)} streams={len(self._streams)} proxied={len(self._proxied)} hits={self.block_hits} misses={self.block_misses} "
+                f"shared={self.shared_fetches} upstream={self.upstream_bytes / 1048576:.1f}MiB "
+                f"served={self.served_bytes / 1048576:.1f}MiB")
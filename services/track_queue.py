@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import asyncio
+import sys
+from collections import deque
+from dataclasses import fields
+from typing import (TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, List, Optional,
+                    Sequence, Tuple, TypeVar)
+
+if TYPE_CHECKING:
+    from services.ytdlp_wrapper import Track
+
+R = TypeVar("R")
+
+
+def _value_bytes(value) -> int:
+    """値のメモリ量。sys.getsizeof は入れ物の大きさしか数えないので、辞書・リストは1段だけ中身も数える。"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(key) + sys.getsizeof(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(sys.getsizeof(item) for item in value)
+    return size
+
+
+def estimate_track_bytes(track: "Track") -> int:
+    """Track 1件が保持しているメモリ量の見積もり (オブジェクト本体・属性辞書・各フィールドの値)。"""
+    size = sys.getsizeof(track) + sys.getsizeof(track.__dict__)
+    for field in fields(track):
+        value = getattr(track, field.name)
+        if value is not None and not isinstance(value, bool):
+            size += _value_bytes(value)
+    return size
+
+
+class MemoryBudget:
+    """
+    全ギルドのキューが保持するトラック情報のバイト数を集計し、プロセス全体の上限を守る。
+
+    - 使用量が soft_ratio を超えると、1回の追加は throttled_batch 件までに絞られる
+    - 上限 (limit_bytes) に達すると追加を受け付けない
+    - 1ギルドが使えるのは上限の max_owner_share まで (一部のギルドの巨大なインポートで他が埋まらないように)
+    """
+
+    def __init__(self, limit_bytes: int, *, soft_ratio: float = 0.8, max_owner_share: float = 0.25,
+                 throttled_batch: int = 50):
+        self.limit_bytes = limit_bytes
+        self.soft_ratio = soft_ratio
+        self.max_owner_share = max_owner_share
+        self.throttled_batch = throttled_batch
+        self.used_bytes = 0
+        self.by_owner: Dict[int, int] = {}
+        self.rejected_count = 0
+
+    def charge(self, owner: int, size: int):
+        self.used_bytes += size
+        self.by_owner[owner] = self.by_owner.get(owner, 0) + size
+
+    def release(self, owner: int, size: int):
+        self.used_bytes -= size
+        remaining = self.by_owner.get(owner, 0) - size
+        if remaining > 0:
+            self.by_owner[owner] = remaining
+        else:
+            self.by_owner.pop(owner, None)
+
+    def allowance(self, owner: int) -> int:
+        """owner が今追加してよいバイト数。"""
+        owner_room = self.limit_bytes * self.max_owner_share - self.by_owner.get(owner, 0)
+        return int(max(0, min(self.limit_bytes - self.used_bytes, owner_room)))
+
+    def max_batch(self) -> Optional[int]:
+        """1回の追加で受け付ける件数の上限 (ソフトリミット以下なら None = 無制限)。"""
+        if self.used_bytes >= self.limit_bytes * self.soft_ratio:
+            return self.throttled_batch
+        return None
+
+    def top_owners(self, n: int = 5) -> List[Tuple[int, int]]:
+        return sorted(self.by_owner.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+class TrackQueue(asyncio.Queue):
+    """
+    ギルドの再生キュー。asyncio.Queue に一括追加 (extend) と、MemoryBudget へのバイト数の計上を加えたもの。
+
+    計上は _put / _get で行うので、put/get/extend のどの経路でも漏れない。
+    """
+
+    def __init__(self, budget: Optional[MemoryBudget] = None, owner: int = 0):
+        super().__init__()
+        self.budget = budget
+        self.owner = owner
+        self.bytes = 0
+        self._sizes: Deque[int] = deque()
+
+    def _put(self, item):
+        size = estimate_track_bytes(item)
+        super()._put(item)
+        self._sizes.append(size)
+        self.bytes += size
+        if self.budget is not None:
+            self.budget.charge(self.owner, size)
+
+    def _get(self):
+        item = super()._get()
+        size = self._sizes.popleft()
+        self.bytes -= size
+        if self.budget is not None:
+            self.budget.release(self.owner, size)
+        return item
+
+    def extend(self, items: Iterable["Track"], max_size: Optional[int] = None) -> int:
+        """
+        max_size とメモリ予算に収まる分だけ items を順に追加し、追加した件数を返す。
+        途中で await しないので、他のコルーチンの追加と混ざらない。
+        """
+        room = None if max_size is None else max(0, max_size - self.qsize())
+        allowance = None
+        if self.budget is not None:
+            allowance = self.budget.allowance(self.owner)
+            batch = self.budget.max_batch()
+            if batch is not None:
+                room = batch if room is None else min(room, batch)
+        added = 0
+        for item in items:
+            if room is not None and added >= room:
+                break
+            if allowance is not None:
+                allowance -= estimate_track_bytes(item)
+                if allowance < 0:
+                    self.budget.rejected_count += 1
+                    break
+            self.put_nowait(item)
+            added += 1
+        return added
+
+    def clear(self):
+        """全件を取り出してメモリ予算から解放する。"""
+        while not self.empty():
+            self.get_nowait()
+            self.task_done()
+
+    def replace(self, items: Iterable["Track"]):
+        """並べ替えた内容でキューを入れ替える (shuffle / remove 用)。"""
+        self.clear()
+        for item in items:
+            self.put_nowait(item)
+
+    def snapshot(self) -> List["Track"]:
+        return list(self._queue)
+
+
+async def resolve_in_order(queries: Sequence[str], resolve: Callable[[str], Awaitable[R]], *,
+                           concurrency: int = 4) -> AsyncIterator[Tuple[str, Optional[R], Optional[BaseException]]]:
+    """
+    queries を最大 concurrency 件ずつ並行して解決し、(クエリ, 結果, 例外) を元の順番で返す。
+
+    先頭から順に揃った分だけすぐに返すので、呼び出し側は全件の解決を待たずにキューへ追加できる。
+    途中でイテレーションをやめると、残りの解決はキャンセルされる。
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _run(query: str) -> R:
+        async with semaphore:
+            return await resolve(query)
+
+    tasks = [asyncio.create_task(_run(query)) for query in queries]
+    try:
+        for query, task in zip(queries, tasks):
+            try:
+                yield query, await task, None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                yield query, None, e
+    finally:
+        for task in tasks:
+            task.cancel()
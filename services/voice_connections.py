@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Optional, Tuple
+
+import discord
+
+from services.metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class VoiceConnectionManager:
+    """
+    ボイス接続の確立・移動をまとめて扱う。
+
+    - 既に接続済みで正常なセッションはそのまま使う (ギルドの voice_client に残っているものも引き継ぐ)
+    - 別のチャンネルへは切断・再接続ではなく move_to で移動する。VoiceClient と再生中のソース
+      (ミキサー) はそのまま残るので、移動後も同じ位置から再生が続く
+    - 異常なセッションを切断したときは固定時間のスリープではなく、ゲートウェイのボイス状態更新を待つ
+    - 接続・移動にかかった時間をヒストグラムに記録する
+    """
+
+    def __init__(self, bot: discord.Client, metrics: MetricsRegistry, *, connect_timeout: float = 30.0,
+                 move_timeout: float = 15.0, self_deaf: bool = True):
+        self.bot = bot
+        self.metrics = metrics
+        self.connect_timeout = connect_timeout
+        self.move_timeout = move_timeout
+        self.self_deaf = self_deaf
+
+    async def ensure(self, channel: discord.VoiceChannel, current: Optional[discord.VoiceClient], *,
+                     connect: bool = True) -> Tuple[Optional[discord.VoiceClient], str]:
+        """
+        channel に接続された VoiceClient を返す。2番目の値は行った操作
+        ("reused" / "moved" / "connected" / "none")。
+        """
+        guild = channel.guild
+        vc = current if current is not None else guild.voice_client
+        if vc is not None and not self._is_healthy(vc):
+            await self._drop(vc)
+            vc = None
+        elif vc is not None and current is None:
+            logger.info(f"Guild {guild.id}: Adopting existing voice connection in {vc.channel}")
+
+        if vc is not None:
+            if vc.channel == channel:
+                return vc, "reused"
+            if not connect:
+                return None, "none"
+            return await self._move(vc, channel), "moved"
+
+        if not connect:
+            return None, "none"
+        stray = guild.voice_client
+        if stray is not None:
+            await self._drop(stray)
+        return await self._connect(channel), "connected"
+
+    @staticmethod
+    def _is_healthy(vc: discord.VoiceClient) -> bool:
+        return vc.is_connected() and vc.channel is not None
+
+    async def _move(self, vc: discord.VoiceClient, channel: discord.VoiceChannel) -> discord.VoiceClient:
+        started = time.perf_counter()
+        try:
+            # move_to は新しいボイスサーバーとの接続が完了するまで待つ (discord.py 2.4+)
+            await vc.move_to(channel, timeout=self.move_timeout)
+        except TypeError:
+            raise  # discord.py が古い (timeout 引数が無い)。移動の失敗として数えずに表に出す
+        except Exception as e:
+            # 移動に失敗したセッションは捨てて接続し直す
+            logger.warning(f"Guild {channel.guild.id}: move_to {channel} failed ({e}), reconnecting")
+            self.metrics.counter("music_voice_move_failures_total").inc()
+            await self._drop(vc)
+            return await self._connect(channel)
+        self.metrics.histogram("music_voice_move_seconds").observe(time.perf_counter() - started)
+        return vc
+
+    async def _connect(self, channel: discord.VoiceChannel) -> discord.VoiceClient:
+        started = time.perf_counter()
+        vc = await asyncio.wait_for(
+            channel.connect(timeout=self.connect_timeout, reconnect=True, self_deaf=self.self_deaf),
+            timeout=self.connect_timeout + 5
+        )
+        self.metrics.histogram("music_voice_connect_seconds").observe(time.perf_counter() - started)
+        return vc
+
+    async def _drop(self, vc: discord.VoiceClient):
+        guild = vc.guild
+        me = guild.me
+        waiter = None
+        if me is not None and me.voice is not None and me.voice.channel is not None:
+            # ゲートウェイ上でボイス状態が消えるまで待つ (すぐに接続し直すと古いセッションと競合する)。
+            # 切断より先に待ち受けを登録して、イベントの取りこぼしを防ぐ
+            def _left(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState) -> bool:
+                return member.id == me.id and member.guild.id == guild.id and after.channel is None
+
+            waiter = asyncio.ensure_future(self.bot.wait_for("voice_state_update", check=_left, timeout=3.0))
+        try:
+            await asyncio.wait_for(vc.disconnect(force=True), timeout=3.0)
+        except Exception:
+            pass
+        if waiter is not None:
+            try:
+                await waiter
+            except asyncio.TimeoutError:
+                logger.debug(f"Guild {guild.id}: No voice state update after disconnect, continuing")
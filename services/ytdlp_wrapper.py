@@ -1,13 +1,21 @@
 from __future__ import annotations
 
 import asyncio
+import hashlib
+import json
 import random
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Union, Optional
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple, Union, Optional
+from urllib.parse import parse_qs, urlparse
 
-import yt_dlp
-from yt_dlp.utils import ExtractorError  # 個別のエラーをキャッチするため
+if TYPE_CHECKING:
+    import yt_dlp
+    from services.hedged_search import HedgedSearch
 
 
 # Trackクラス定義
@@ -20,15 +28,30 @@ class Track:
     stream_url: Optional[str] = None
     requester_id: Optional[int] = None
     original_query: Optional[str] = None
+    acodec: Optional[str] = None  # 選択されたストリームのコーデック (例: "opus")
+    asr: Optional[int] = None  # 選択されたストリームのサンプルレート (Hz)
+    extractor: Optional[str] = None  # yt-dlp の抽出器名 (例: "Youtube")。FFmpeg 入力プロファイルの選択に使う
+    container: Optional[str] = None  # 選択されたストリームのコンテナ (yt-dlp の ext。例: "webm")
+    protocol: Optional[str] = None  # 選択されたストリームのプロトコル (例: "https", "m3u8_native")
+    is_live: bool = False  # ライブ配信 (終わりが無いので、途中で切れたら常に再接続する)
+    http_headers: Optional[dict] = None  # ストリームの取得に必要なヘッダー (ストリームリレーが上流へ送る)
+    http_cookies: Optional[str] = None  # ストリームの取得に必要なクッキー (FFmpeg の -cookies 形式。ニコニコ動画の HLS 用)
+    autoplay: bool = False  # キューが空になったときに自動再生で選ばれた曲
 
 
 # --- yt-dlp 設定 ---
+# ディレクトリ・ファイルの作成はインポート時ではなく初回使用時に行う (_prepare_nico_paths)
 CACHE_DIR = Path("./cache")
-CACHE_DIR.mkdir(parents=True, exist_ok=True)
-
 NICO_COOKIE_PATH = Path("./nico_cookies.txt")
-if not NICO_COOKIE_PATH.exists():
-    NICO_COOKIE_PATH.touch(exist_ok=True)  # 存在しない場合のみ作成
+NICO_MAX_CONCURRENT_DOWNLOADS = 2
+
+_NICO_ID_RE = re.compile(r"(?:sm|nm|so|ss)\d+")
+_PARTIAL_FILE_MARKERS = (".part", ".ytdl", ".temp.")
+_nico_download_executor: Optional[ThreadPoolExecutor] = None
+_nico_downloads: Dict[str, asyncio.Future] = {}  # 動画ID → バックグラウンドでのダウンロード
+_nico_credentials: Tuple[Optional[str], Optional[str]] = (None, None)  # 設定ファイルのログイン情報 (メール, パスワード)
+
+_yt_dlp_module = None
 
 COMMON_YTDL_OPTS: dict = {
     "format": "bestaudio[acodec=opus][asr=48000]/bestaudio/best",  # Opusを優先、48kHz
@@ -49,6 +72,53 @@ COMMON_YTDL_OPTS: dict = {
 
 
 # --- ヘルパー関数 ---
+def _yt_dlp():
+    """yt_dlp は読み込みに時間がかかるため、初回使用時にインポートする"""
+    global _yt_dlp_module
+    if _yt_dlp_module is None:
+        import yt_dlp
+        _yt_dlp_module = yt_dlp
+    return _yt_dlp_module
+
+
+def _extractor_errors() -> tuple:
+    """except 節で使う yt_dlp の ExtractorError / DownloadError クラス (遅延インポート)"""
+    utils = _yt_dlp().utils
+    return utils.ExtractorError, utils.DownloadError
+
+
+def _is_permanent_extractor_error(error: Exception) -> bool:
+    """削除・非公開・地域制限など、時間をおいても結果が変わらない抽出失敗か (通信エラーは含めない)"""
+    utils = _yt_dlp().utils
+    if isinstance(error, utils.DownloadError) and error.exc_info:
+        error = error.exc_info[1]  # extract_info は ExtractorError を DownloadError に包んで送出する
+    if not isinstance(error, utils.ExtractorError) or not error.expected:
+        return False
+    # yt-dlp は通信エラーも expected 扱いにするので、原因が通信エラーのものは除く
+    return not isinstance(error.cause, utils.network_exceptions) and \
+        not isinstance(error.exc_info[1], utils.network_exceptions)
+
+
+def _prepare_nico_paths():
+    """ニコニコ動画のダウンロード先とクッキーファイルを用意する"""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    if not NICO_COOKIE_PATH.exists():
+        NICO_COOKIE_PATH.touch(exist_ok=True)  # 存在しない場合のみ作成
+
+
+_SEARCH_PREFIX_RE = re.compile(r"^[a-z]+search(\d+|all)?:", re.IGNORECASE)
+
+
+def _is_free_text(query: str) -> bool:
+    """URL・検索プレフィックス付きクエリ・ローカルファイルでない、ただの検索語か判定する"""
+    if "://" in query or _SEARCH_PREFIX_RE.match(query):
+        return False
+    try:
+        return not Path(query).exists()
+    except OSError:
+        return True
+
+
 def _is_nico(url_or_query: str) -> bool:
     """ニコニコ動画のURLか判定する"""
     return ("nicovideo.jp" in url_or_query) or ("nico.ms" in url_or_query)
@@ -63,13 +133,12 @@ def _build_nico_opts(login: bool, nico_email: Optional[str] = None, nico_passwor
         "cookiefile": str(NICO_COOKIE_PATH),
         "extract_flat": False,  # ニコニコ動画の場合は詳細情報を取得したい
         "noplaylist": True,  # ニコニコ動画のプレイリストは特殊なので、ここでは単体として扱うことが多い
-        "skip_download": False,  # ニコニコ動画はダウンロードを基本とする (ストリームURLが不安定な場合があるため)
+        "skip_download": False,  # キャッシュ用のダウンロード (再生は HLS から先に始める)
         "postprocessors": [
             {
                 "key": "FFmpegExtractAudio",
-                "preferredcodec": "opus",  # DiscordはOpus推奨
-                "preferredquality": "0",  # 最高品質 (libopusではビットレート指定になることが多い)
-                # "audioquality": "0", # FFmpegExtractAudio の場合
+                # 元の音声コーデックのまま取り出す (再エンコードせずにリマックスするだけ)
+                "preferredcodec": "best",
             },
             {"key": "FFmpegMetadata"},
         ],
@@ -82,29 +151,389 @@ def _build_nico_opts(login: bool, nico_email: Optional[str] = None, nico_passwor
     return opts
 
 
-def _inject_local_path_nico(entry: dict, ytdl: yt_dlp.YoutubeDL):
-    """ニコニコ動画ダウンロード後のローカルパスをentryに注入する"""
-    if not entry: return
-    # yt-dlpがダウンロード後に設定するキーは 'filepath'
-    if entry.get('filepath'):
-        entry['local_path'] = entry['filepath']
-    elif entry.get("requested_downloads"):  # requested_downloads はダウンロード前の情報
-        # 実際にダウンロードされたファイルパスを取得する必要がある
-        # ここでは、ダウンロードが成功したと仮定してファイル名を構築するが、確実ではない
-        # より確実なのは、yt-dlpのダウンロード後の情報を使うこと
+def set_nico_credentials(email: Optional[str], password: Optional[str]):
+    """設定ファイル (music.niconico) のログイン情報を設定する。extract に直接渡されなかったときはこれを使う。"""
+    global _nico_credentials
+    _nico_credentials = (email or None, password or None)
+
+
+def _nico_login_opts(nico_email: Optional[str] = None, nico_password: Optional[str] = None) -> dict:
+    """
+    ログイン情報込みのニコニコ動画用オプション。抽出・ストリームの再取得・キャッシュ用ダウンロードで
+    同じログイン設定を使い、ログインが必要な動画もどの経路でも取得できるようにする。
+    """
+    _prepare_nico_paths()
+    nico_email = nico_email or _nico_credentials[0]
+    nico_password = nico_password or _nico_credentials[1]
+    return _build_nico_opts(
+        login=bool(not NICO_COOKIE_PATH.stat().st_size or (nico_email and nico_password)),
+        nico_email=nico_email,
+        nico_password=nico_password
+    )
+
+
+def _nico_stream_opts(opts: dict) -> dict:
+    """ニコニコ動画のストリーム (HLS) の URL だけを取得するオプション。ダウンロードはバックグラウンドで別に行う。"""
+    opts = opts.copy()
+    opts.update({"skip_download": True, "postprocessors": []})
+    return opts
+
+
+def _nico_video_id(url_or_id: Optional[str]) -> Optional[str]:
+    match = _NICO_ID_RE.search(url_or_id or "")
+    return match.group(0) if match else None
+
+
+def _cached_nico_file(video_id: Optional[str]) -> Optional[Path]:
+    """ダウンロードが完了したニコニコ動画のキャッシュファイル。書き込み中のものは返さない。"""
+    if not video_id or video_id in _nico_downloads:
+        return None
+    for path in CACHE_DIR.glob(f"{video_id}.*"):
+        if any(marker in path.name for marker in _PARTIAL_FILE_MARKERS):
+            continue
         try:
-            # yt-dlp.prepare_filename(entry) は entry['ext'] などが必要
-            # ダウンロード後のファイルパスは ytdl.prepare_filename よりも
-            # 実際に生成されたファイルパスを特定する方が良い
-            # ここでは 'id' と 'ext' (通常 'opus') から推測する
-            if 'id' in entry and 'acodec' in entry:  # 'opus' など
-                entry['local_path'] = str(CACHE_DIR / f"{entry['id']}.{entry['acodec']}")
-            elif 'id' in entry and 'ext' in entry:
-                entry['local_path'] = str(CACHE_DIR / f"{entry['id']}.{entry['ext']}")
+            if path.is_file() and path.stat().st_size > 0:
+                return path
+        except OSError:
+            continue
+    return None
+
+
+def _ffmpeg_cookies(ytdl: "yt_dlp.YoutubeDL", url: Optional[str]) -> Optional[str]:
+    """url に送るクッキーを FFmpeg の -cookies 形式にする (yt-dlp の FFmpegFD と同じ形式)。"""
+    if not url or not url.startswith(("http://", "https://")):
+        return None
+    cookies = ytdl.cookiejar.get_cookies_for_url(url)
+    if not cookies:
+        return None
+    return "".join(f"{c.name}={c.value}; path={c.path}; domain={c.domain};\r\n" for c in cookies)
+
+
+def _prepare_nico_entry(entry: dict, ytdl: "yt_dlp.YoutubeDL"):
+    """ニコニコ動画の entry に、ダウンロード済みならそのパスを、未ダウンロードなら HLS 用のクッキーを付ける。"""
+    if not entry:
+        return
+    cached = _cached_nico_file(entry.get("id"))
+    if cached:
+        entry["local_path"] = str(cached)
+    else:
+        entry["http_cookies"] = _ffmpeg_cookies(ytdl, entry.get("url"))
 
-        except Exception as e:
-            print(f"[ytdlp_wrapper Warning] ニコニコ動画のローカルパス注入に失敗: {e} (Entry: {entry.get('id')})")
-            pass  # 失敗しても処理は続ける
+
+def _start_nico_download(url: str):
+    """
+    キャッシュ用のダウンロードをバックグラウンドで始める (同じ動画は1本だけ)。
+    再生はその間 HLS から行い、次回以降の再生で完成したファイルを使う。
+    """
+    video_id = _nico_video_id(url)
+    if not video_id or video_id in _nico_downloads or _cached_nico_file(video_id):
+        return
+    global _nico_download_executor
+    if _nico_download_executor is None:
+        _nico_download_executor = ThreadPoolExecutor(max_workers=NICO_MAX_CONCURRENT_DOWNLOADS,
+                                                     thread_name_prefix="nico-download")
+    opts = _nico_login_opts()
+    opts["noprogress"] = True
+
+    def _download():
+        with _yt_dlp().YoutubeDL(opts) as ytdl:
+            ytdl.extract_info(url, download=True)
+            try:
+                ytdl.cookiejar.save(str(NICO_COOKIE_PATH), ignore_discard=True, ignore_expires=True)
+            except Exception as e_cookie:
+                print(f"[ytdlp_wrapper Warning] ニコニコ動画のクッキー保存に失敗: {e_cookie}")
+
+    future = asyncio.get_running_loop().run_in_executor(_nico_download_executor, _download)
+    _nico_downloads[video_id] = future
+
+    def _done(finished: asyncio.Future):
+        _nico_downloads.pop(video_id, None)
+        if not finished.cancelled() and finished.exception():
+            print(f"[ytdlp_wrapper Warning] ニコニコ動画のキャッシュ用ダウンロードに失敗: {finished.exception()} "
+                  f"(ID: {video_id})")
+
+    future.add_done_callback(_done)
+
+
+# --- 抽出バックエンド ---
+# extract() / ensure_stream() は info 辞書の取得をバックエンドに任せる。本番は yt-dlp、
+# オフラインのテストやベンチマークでは記録した info 辞書を返す ReplayBackend に差し替える。
+
+ProcessHook = Callable[[dict, "yt_dlp.YoutubeDL"], None]
+
+# フィクスチャのキーに含めるオプション (同じ URL でもフラット抽出と詳細抽出で結果が違う)
+_FIXTURE_KEY_OPTS = ("extract_flat", "noplaylist", "playlistend", "format")
+# 再生に使わない大きな項目はフィクスチャに残さない
+_FIXTURE_DROP_KEYS = frozenset(("formats", "thumbnails", "automatic_captions", "subtitles", "heatmap",
+                                "requested_formats", "requested_downloads", "chapters"))
+
+
+class ExtractionError(Exception):
+    """
+    バックエンドがクエリを処理できなかった (yt-dlp の ExtractorError、フィクスチャが無いなど)。
+    permanent は、動画の削除・非公開・地域制限のように再試行しても結果が変わらない失敗であること。
+    """
+
+    def __init__(self, message: str, *, permanent: bool = False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def is_permanent_failure(error: BaseException) -> bool:
+    """ensure_stream などが送出した例外の原因が、再試行しても変わらない抽出失敗か判定する。"""
+    while error is not None:
+        if isinstance(error, ExtractionError):
+            return error.permanent
+        error = error.__cause__
+    return False
+
+
+class ExtractorBackend:
+    """
+    info 辞書を返す抽出バックエンドの共通インターフェース。
+
+    extract_info() は yt-dlp の extract_info(query, download=False) と同じ形の辞書 (見つからなければ None) を返し、
+    処理できないクエリでは ExtractionError を送出する。process は yt-dlp のインスタンスが必要な後処理
+    (ニコニコ動画のクッキーなど) で、実際に yt-dlp を呼ぶバックエンドだけが呼ぶ。
+    """
+    name = "base"
+    can_download = False  # ニコニコ動画のキャッシュ用ダウンロードを行ってよいか
+
+    async def extract_info(self, query: str, opts: dict, *, process: Optional[ProcessHook] = None) -> Optional[dict]:
+        raise NotImplementedError
+
+    def invalidate(self, query: str):
+        """query について保持している結果があれば捨てる (期限切れのストリーム URL を取り直すとき)。"""
+
+    def format_stats(self) -> str:
+        return f"extractor backend={self.name}"
+
+
+class YtDlpBackend(ExtractorBackend):
+    """本番用。yt-dlp をスレッドプールで実行する。"""
+    name = "yt-dlp"
+    can_download = True
+
+    async def extract_info(self, query: str, opts: dict, *, process: Optional[ProcessHook] = None) -> Optional[dict]:
+        def _run():
+            with _yt_dlp().YoutubeDL(opts) as ytdl:
+                try:
+                    info = ytdl.extract_info(query, download=False)
+                except _extractor_errors() as e:
+                    raise ExtractionError(str(e), permanent=_is_permanent_extractor_error(e)) from e
+                if info and process is not None:
+                    process(info, ytdl)
+                return info
+
+        return await asyncio.get_running_loop().run_in_executor(None, _run)
+
+
+def _fixture_key(query: str, opts: dict) -> str:
+    payload = json.dumps([query, {k: opts.get(k) for k in _FIXTURE_KEY_OPTS}], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _jsonable(value):
+    """info 辞書を JSON にできる形にする (遅延評価のプレイリストも展開する)。"""
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items() if k not in _FIXTURE_DROP_KEYS}
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", "replace")
+    try:
+        return [_jsonable(v) for v in value]
+    except TypeError:
+        return str(value)
+
+
+class RecordingBackend(ExtractorBackend):
+    """
+    別のバックエンド (通常は YtDlpBackend) の結果をフィクスチャファイルに記録しながら返す。
+    返す info 辞書も記録したものと同じ内容にして、記録時と再生時の動作を揃える。
+    """
+    name = "record"
+
+    def __init__(self, inner: ExtractorBackend, fixtures_dir: str):
+        self.inner = inner
+        self.fixtures_dir = Path(fixtures_dir)
+        self.can_download = inner.can_download
+        self.recorded_count = 0
+
+    async def extract_info(self, query: str, opts: dict, *, process: Optional[ProcessHook] = None) -> Optional[dict]:
+        info = await self.inner.extract_info(query, opts, process=process)
+        info = _jsonable(info) if info else None
+        key = _fixture_key(query, opts)
+        fixture = {
+            "query": query,
+            "opts": {k: opts.get(k) for k in _FIXTURE_KEY_OPTS},
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "info": info,
+        }
+        await asyncio.to_thread(self._write, key, fixture)
+        self.recorded_count += 1
+        return info
+
+    def format_stats(self) -> str:
+        return f"extractor backend={self.name} recorded={self.recorded_count} dir={self.fixtures_dir}"
+
+    def _write(self, key: str, fixture: dict):
+        path = self.fixtures_dir / key[:2] / f"{key}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(fixture, ensure_ascii=False, indent=1), encoding="utf-8")
+        tmp.replace(path)
+
+
+class ReplayBackend(ExtractorBackend):
+    """
+    RecordingBackend が記録したフィクスチャを返す (ネットワークを使わない)。
+    latency 秒 (± jitter 秒) 待ってから返すので、抽出の遅さを再現した計測にも使える。
+    記録が無いクエリは ExtractionError になる。
+    """
+    name = "replay"
+
+    def __init__(self, fixtures_dir: str, *, latency: float = 0.0, jitter: float = 0.0,
+                 rng: Optional[random.Random] = None):
+        self.fixtures_dir = Path(fixtures_dir)
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self._cache: Dict[str, Optional[dict]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _read(self, key: str) -> Optional[dict]:
+        path = self.fixtures_dir / key[:2] / f"{key}.json"
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+
+    async def extract_info(self, query: str, opts: dict, *, process: Optional[ProcessHook] = None) -> Optional[dict]:
+        delay = self.latency + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        key = _fixture_key(query, opts)
+        if key not in self._cache:
+            self._cache[key] = await asyncio.to_thread(self._read, key)
+        fixture = self._cache[key]
+        if fixture is None:
+            self.misses += 1
+            raise ExtractionError(f"フィクスチャがありません: {query}")
+        self.hits += 1
+        # 呼び出し側が info 辞書を書き換えるので、毎回コピーを返す
+        info = fixture.get("info")
+        return json.loads(json.dumps(info)) if info else None
+
+    def format_stats(self) -> str:
+        return f"extractor backend={self.name} hits={self.hits} misses={self.misses} dir={self.fixtures_dir}"
+
+
+_STREAM_EXPIRY_MARGIN = 300  # ストリーム URL の期限 (expire=) のこの秒数前にはキャッシュを捨てる
+
+
+class CachingBackend(ExtractorBackend):
+    """
+    別のバックエンドの結果を ttl 秒 (ストリーム URL に期限があればその少し前まで) メモリに保持する。
+    同じクエリの抽出が実行中なら、新しく始めずにその結果を待つ。ライブ配信の結果は保持しない。
+    起動時のウォームアップで人気の曲を解決しておき、最初の再生で yt-dlp を待たずに済ませるのにも使う。
+    """
+    name = "cache"
+
+    def __init__(self, inner: ExtractorBackend, *, ttl: float = 1800, max_entries: int = 2000):
+        self.inner = inner
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.can_download = inner.can_download
+        self._entries: OrderedDict[str, Tuple[float, str, dict]] = OrderedDict()  # キー → (期限, クエリ, info)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+
+    async def extract_info(self, query: str, opts: dict, *, process: Optional[ProcessHook] = None) -> Optional[dict]:
+        key = _fixture_key(query, opts)
+        cached = self._entries.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(json.dumps(cached[2]))
+            del self._entries[key]
+        task = self._in_flight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._in_flight[key] = asyncio.ensure_future(self._fetch(key, query, opts, process))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.joined += 1
+        info = await asyncio.shield(task)
+        # 呼び出し側が info 辞書を書き換えるので、毎回コピーを返す
+        return json.loads(json.dumps(info)) if info else None
+
+    async def _fetch(self, key: str, query: str, opts: dict, process: Optional[ProcessHook]) -> Optional[dict]:
+        info = await self.inner.extract_info(query, opts, process=process)
+        if not info:
+            return None
+        info = _jsonable(info)
+        ttl = self._ttl_for(info)
+        if ttl > 0:
+            self._entries[key] = (time.monotonic() + ttl, query, info)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return info
+
+    def invalidate(self, query: str):
+        for key in [key for key, (_, cached_query, _) in self._entries.items() if cached_query == query]:
+            del self._entries[key]
+
+    def _ttl_for(self, info: dict) -> float:
+        entry = (info.get("entries") or [info])[0] if info.get("_type") == "playlist" else info
+        if not entry or entry.get("is_live") or entry.get("live_status") == "is_live":
+            return 0
+        ttl = self.ttl
+        expire = parse_qs(urlparse(entry.get("url") or "").query).get("expire")
+        if expire and expire[0].isdigit():
+            ttl = min(ttl, int(expire[0]) - time.time() - _STREAM_EXPIRY_MARGIN)
+        return ttl
+
+    def format_stats(self) -> str:
+        return (f"{self.inner.format_stats()} | cache entries={len(self._entries)} hits={self.hits} "
+                f"misses={self.misses} joined={self.joined}")
+
+
+_backend: ExtractorBackend = YtDlpBackend()
+
+
+def set_backend(backend: ExtractorBackend):
+    """extract() / ensure_stream() が使う抽出バックエンドを差し替える。"""
+    global _backend
+    _backend = backend
+
+
+def get_backend() -> ExtractorBackend:
+    return _backend
+
+
+def create_backend(config: Optional[dict]) -> ExtractorBackend:
+    """設定 (music.extractor) からバックエンドを作る。"""
+    config = config or {}
+    kind = config.get("backend", "yt-dlp")
+    fixtures_dir = config.get("fixtures_dir", "./fixtures/extractor")
+    if kind == "record":
+        backend = RecordingBackend(YtDlpBackend(), fixtures_dir)
+    elif kind == "replay":
+        backend = ReplayBackend(fixtures_dir, latency=config.get("replay_latency_ms", 0) / 1000,
+                                jitter=config.get("replay_jitter_ms", 0) / 1000)
+    elif kind == "yt-dlp":
+        backend = YtDlpBackend()
+    else:
+        raise ValueError(f"不明な抽出バックエンド: {kind}")
+    cache_ttl = config.get("cache_ttl", 0)
+    if cache_ttl > 0 and kind != "record":  # 記録時は毎回 yt-dlp を呼んで記録する
+        backend = CachingBackend(backend, ttl=cache_ttl, max_entries=config.get("cache_max_entries", 2000))
+    return backend
 
 
 def _entry_to_track(entry: dict, *, is_downloaded_nico: bool = False) -> Track:
@@ -123,13 +552,27 @@ def _entry_to_track(entry: dict, *, is_downloaded_nico: bool = False) -> Track:
     if title == "タイトルなし" and entry.get("id"):
         title = f"ID: {entry.get('id')}"
 
+    # extract_flat の結果にはフォーマット情報が無いので、その場合は None のまま
+    acodec = entry.get("acodec")
+    if acodec in ("none", ""):
+        acodec = None
+
     return Track(
         url=entry.get("webpage_url") or entry.get("original_url") or entry.get("url", "不明なURL"),
         title=title,
         duration=int(entry.get("duration") or 0),
         thumbnail=entry.get("thumbnail"),
         stream_url=stream_url_val,
-        original_query=entry.get("original_query")  # extractで設定されていれば
+        original_query=entry.get("original_query"),  # extractで設定されていれば
+        acodec=acodec,
+        asr=int(entry["asr"]) if entry.get("asr") else None,
+        extractor=entry.get("extractor_key") or entry.get("ie_key") or entry.get("extractor"),
+        # フラットなプレイリスト項目の ext はストリームのものではないので、コーデックが分かる場合だけ使う
+        container=entry.get("ext") if acodec else None,
+        protocol=entry.get("protocol") if not is_downloaded_nico else None,
+        is_live=bool(entry.get("is_live")) or entry.get("live_status") == "is_live",
+        http_headers=entry.get("http_headers") if acodec and not is_downloaded_nico else None,
+        http_cookies=entry.get("http_cookies") if not is_downloaded_nico else None,
     )
 
 
@@ -142,33 +585,61 @@ async def ensure_stream(track: Track, ytdl_opts_override: Optional[dict] = None)
         return track
     if track.stream_url and Path(track.stream_url).is_file():  # ローカルファイルなら検証不要
         return track
-    if _is_nico(track.url) and track.stream_url and Path(track.stream_url).exists():  # ニコニコダウンロード済みもOK
-        return track
+    is_nico = _is_nico(track.url)
+    if is_nico:
+        cached = _cached_nico_file(_nico_video_id(track.url))
+        if cached:  # バックグラウンドのダウンロードが終わっていればそのファイルを使う
+            track.stream_url = str(cached)
+            track.protocol = None
+            track.container = None
+            track.http_headers = None
+            track.http_cookies = None
+            return track
+        _prepare_nico_paths()
 
-    loop = asyncio.get_running_loop()
     # ensure_stream 用のオプション (常に単一動画の詳細情報を取得、ダウンロードはしない)
-    opts_for_ensure = (ytdl_opts_override or COMMON_YTDL_OPTS).copy()
+    if is_nico and ytdl_opts_override is None:
+        opts_for_ensure = _nico_stream_opts(_nico_login_opts())
+    else:
+        opts_for_ensure = (ytdl_opts_override or COMMON_YTDL_OPTS).copy()
     opts_for_ensure.update({
         "noplaylist": True,
         "extract_flat": False,  # 詳細情報を得るためにFalse
         "skip_download": True,
+        "ignoreerrors": False,  # 単一の動画なので、失敗は None ではなく例外で受け取って理由を判別する
     })
 
-    def _run_extract_single_info():
-        with yt_dlp.YoutubeDL(opts_for_ensure) as ytdl:
-            # extract_info で対象URLの最新情報を取得
-            info = ytdl.extract_info(track.url, download=False)
-            # プレイリストが返ってくる場合もあるので、最初の要素をチェック
-            entry_to_use = info.get("entries")[0] if info.get("_type") == "playlist" and info.get("entries") else info
+    def _first_entry(info: dict) -> dict:
+        # プレイリストが返ってくる場合もあるので、最初の要素をチェック
+        return info.get("entries")[0] if info.get("_type") == "playlist" and info.get("entries") else info
 
-            # _entry_to_track を使って新しいストリームURLを取得
-            temp_track = _entry_to_track(entry_to_use, is_downloaded_nico=False)  # ストリームURLを期待
-            return temp_track.stream_url
+    def _add_nico_cookies(info: dict, ytdl: "yt_dlp.YoutubeDL"):
+        # HLS のセグメント取得にもログイン・セッションのクッキーが要る
+        entry = _first_entry(info)
+        entry["http_cookies"] = _ffmpeg_cookies(ytdl, entry.get("url"))
 
     try:
-        new_stream_url = await loop.run_in_executor(None, _run_extract_single_info)
-        if new_stream_url:
-            track.stream_url = new_stream_url
+        # 対象URLの最新情報を取得
+        info = await _backend.extract_info(track.url, opts_for_ensure, process=_add_nico_cookies if is_nico else None)
+        if not info:
+            raise ExtractionError("情報を取得できませんでした")
+        # _entry_to_track を使って新しいストリームURLを取得
+        resolved = _entry_to_track(_first_entry(info), is_downloaded_nico=False)  # ストリームURLを期待
+        if resolved.stream_url:
+            track.stream_url = resolved.stream_url
+            # パススルー再生の判定に使うので、コーデック情報も最新のものに更新する
+            track.acodec = resolved.acodec
+            track.asr = resolved.asr
+            # FFmpeg 入力プロファイルの選択に使う情報も更新する
+            track.extractor = resolved.extractor or track.extractor
+            track.container = resolved.container
+            track.protocol = resolved.protocol
+            track.is_live = resolved.is_live
+            track.http_headers = resolved.http_headers
+            track.http_cookies = resolved.http_cookies
+            if is_nico and _backend.can_download:
+                # 今回は HLS から再生し、その間にキャッシュ用のファイルを作る
+                _start_nico_download(track.url)
         else:
             # ストリームURLが取得できなかった場合 (元のURLが無効になっている可能性など)
             # ここではエラーを発生させるか、stream_urlをNoneのままにする
@@ -176,7 +647,7 @@ async def ensure_stream(track: Track, ytdl_opts_override: Optional[dict] = None)
             # track.stream_url = None # またはそのまま保持
             raise RuntimeError(f"ストリームURLの再取得に失敗: {track.title}")
 
-    except ExtractorError as e:
+    except ExtractionError as e:
         print(f"[ytdlp_wrapper Error] ストリーム解決中にyt-dlpエラー: {e} (Track: {track.title})")
         raise RuntimeError(f"ストリーム解決エラー: {e}") from e
     except Exception as e:
@@ -191,26 +662,25 @@ async def extract(
         shuffle_playlist: bool = False,
         nico_email: Optional[str] = None,
         nico_password: Optional[str] = None,
-        max_playlist_items: Optional[int] = 50
+        max_playlist_items: Optional[int] = 50,
+        hedged_search: Optional["HedgedSearch"] = None
 ) -> Union[Track, List[Track], None]:
     """
     与えられたクエリ (URLまたは検索語) から音楽情報を抽出する。
-    ニコニコ動画の場合はダウンロードを試み、それ以外はストリームURLを取得する。
+    ストリームURLを取得する。ニコニコ動画はダウンロード済みならそのファイルを、未ダウンロードなら HLS の URL を返す
+    (キャッシュ用のダウンロードは再生時の ensure_stream がバックグラウンドで始める)。
+    hedged_search を渡すと、検索語は複数の検索プロバイダへヘッジして問い合わせる。
     """
-    loop = asyncio.get_running_loop()
+    if hedged_search is not None and _is_free_text(query):
+        return await hedged_search.search(query)
+
     is_nico_query = _is_nico(query)
 
     ytdl_final_opts: dict
-    perform_download_for_nico = False
 
     if is_nico_query:
-        # ニコニコ動画の場合: ダウンロードを試みる
-        ytdl_final_opts = _build_nico_opts(
-            login=bool(not NICO_COOKIE_PATH.stat().st_size or (nico_email and nico_password)),
-            nico_email=nico_email,
-            nico_password=nico_password
-        )
-        perform_download_for_nico = True
+        # ニコニコ動画の場合: ダウンロードを待たずにストリーム情報だけを取得する
+        ytdl_final_opts = _nico_stream_opts(_nico_login_opts(nico_email, nico_password))
         # ニコニコ動画のプレイリストは特殊なので、extract_flat=False, noplaylist=True で1件ずつ処理する想定
         # もしニコニコのプレイリストURLが渡された場合、yt-dlpは個々の動画情報を取得する
         # ytdl_final_opts["noplaylist"] = False # プレイリストも展開させる
@@ -226,35 +696,29 @@ async def extract(
 
     extracted_info: Optional[dict] = None
 
-    def _run_yt_dlp_extraction():
-        nonlocal extracted_info  # クロージャ内の変数を更新するため
+    def _prepare_nico_info(info_result: dict, ytdl: "yt_dlp.YoutubeDL"):
+        # ニコニコ動画: キャッシュ済みファイルまたは HLS 用クッキー
+        if info_result.get("entries"):  # プレイリストの場合
+            for entry in info_result["entries"]:
+                if entry: _prepare_nico_entry(entry, ytdl)
+        else:  # 単一動画の場合
+            _prepare_nico_entry(info_result, ytdl)
+
+        # ニコニコ動画のクッキー保存 (ログイン成功時など)
         try:
-            with yt_dlp.YoutubeDL(ytdl_final_opts) as ytdl:
-                # extract_info を実行
-                info_result = ytdl.extract_info(query, download=perform_download_for_nico)
-
-                if perform_download_for_nico and info_result:  # ニコニコ動画ダウンロード後処理
-                    if info_result.get("entries"):  # プレイリストの場合
-                        for entry in info_result["entries"]:
-                            if entry: _inject_local_path_nico(entry, ytdl)
-                    else:  # 単一動画の場合
-                        _inject_local_path_nico(info_result, ytdl)
-
-                    # ニコニコ動画のクッキー保存 (ログイン成功時など)
-                    try:
-                        ytdl.cookiejar.save(str(NICO_COOKIE_PATH), ignore_discard=True, ignore_expires=True)
-                    except Exception as e_cookie:
-                        print(f"[ytdlp_wrapper Warning] ニコニコ動画のクッキー保存に失敗: {e_cookie}")
-
-                extracted_info = info_result  # 抽出結果を保存
-        except ExtractorError as e_ext:  # yt-dlpが処理できないURLや検索結果なしなど
-            print(f"[ytdlp_wrapper Info] 情報抽出失敗 (ExtractorError): {e_ext} (Query: {query})")
-            # extracted_info は None のまま
-        except Exception as e_gen:  # その他の予期せぬyt-dlpエラー
-            print(f"[ytdlp_wrapper Error] yt-dlp実行中に予期せぬエラー: {e_gen} (Query: {query})", exc_info=True)
-            # extracted_info は None のまま
-
-    await loop.run_in_executor(None, _run_yt_dlp_extraction)
+            ytdl.cookiejar.save(str(NICO_COOKIE_PATH), ignore_discard=True, ignore_expires=True)
+        except Exception as e_cookie:
+            print(f"[ytdlp_wrapper Warning] ニコニコ動画のクッキー保存に失敗: {e_cookie}")
+
+    try:
+        extracted_info = await _backend.extract_info(query, ytdl_final_opts,
+                                                     process=_prepare_nico_info if is_nico_query else None)
+    except ExtractionError as e_ext:  # yt-dlpが処理できないURLや検索結果なしなど
+        print(f"[ytdlp_wrapper Info] 情報抽出失敗 (ExtractorError): {e_ext} (Query: {query})")
+        # extracted_info は None のまま
+    except Exception as e_gen:  # その他の予期せぬyt-dlpエラー
+        print(f"[ytdlp_wrapper Error] yt-dlp実行中に予期せぬエラー: {e_gen} (Query: {query})")
+        # extracted_info は None のまま
 
     if not extracted_info:  # 情報抽出に失敗した場合
         return None
@@ -265,14 +729,40 @@ async def extract(
         valid_entries = [entry for entry in extracted_info["entries"] if entry]  # Noneエントリを除外
         for entry_data in valid_entries:
             entry_data["original_query"] = query  # 元のクエリ情報を付加
-            tracks.append(_entry_to_track(entry_data, is_downloaded_nico=perform_download_for_nico))
+            tracks.append(_entry_to_track(entry_data, is_downloaded_nico="local_path" in entry_data))
 
         if shuffle_playlist and tracks:
             random.shuffle(tracks)
         return tracks if tracks else None  # 空のプレイリストならNone
     elif extracted_info:  # 単一の動画/曲の場合
         extracted_info["original_query"] = query
-        single_track = _entry_to_track(extracted_info, is_downloaded_nico=perform_download_for_nico)
+        single_track = _entry_to_track(extracted_info, is_downloaded_nico="local_path" in extracted_info)
         return single_track
 
-    return None  # 何も見つからなかった場合
\ No newline at end of file
+    return None  # 何も見つからなかった場合
+
+
+_YOUTUBE_VIDEO_ID_RE = re.compile(r"(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/)|youtu\.be/)([\w-]{11})")
+
+
+def related_mix_url(url: str) -> Optional[str]:
+    """YouTube の動画 URL から、その動画を起点にした関連曲のミックス (RD プレイリスト) の URL を作る。"""
+    match = _YOUTUBE_VIDEO_ID_RE.search(url or "")
+    if not match:
+        return None
+    video_id = match.group(1)
+    return f"https://www.youtube.com/watch?v={video_id}&list=RD{video_id}"
+
+
+def search_provider(prefix: str, **extract_kwargs):
+    """
+    HedgedSearch 用のプロバイダを作る。検索語に yt-dlp の検索プレフィックス
+    (例: "ytsearch", "scsearch") を付けて extract() する。
+    """
+    async def _search(query: str) -> Union[Track, List[Track], None]:
+        result = await extract(f"{prefix}:{query}", **extract_kwargs)
+        for track in (result if isinstance(result, list) else [result] if result else []):
+            track.original_query = query  # プレフィックスなしの検索語を残す
+        return result
+
+    return _search
@@ -0,0 +1,99 @@
+"""
+AudioMixer のマイクロベンチマーク。
+
+ボイス送信スレッドと同じように read() を呼び続け、1コアあたりの処理可能フレーム数
+(frames/sec) と、1フレームあたりのメモリ確保数を計測する。
+1ギルドの再生には 50 frames/sec 必要なので、「frames/sec ÷ 50」がおおよその
+1コアで捌けるギルド数になる。
+
+使い方:
+    python tools/bench_mixer.py [--frames 20000]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.audio_mixer import AudioMixer, FRAME_SIZE, FRAME_LENGTH_MS  # noqa: E402
+
+
+class _NoiseSource:
+    """同じ PCM フレームを無限に返すソース (デコードコストを除外して合成処理のみを測る)"""
+
+    def __init__(self, seed: int):
+        rng = np.random.default_rng(seed)
+        self._frame = rng.integers(-20000, 20000, FRAME_SIZE // 2, dtype=np.int16).tobytes()
+
+    def read_into(self, buffer: memoryview) -> int:
+        buffer[:] = self._frame
+        return FRAME_SIZE
+
+    def read(self) -> bytes:
+        return self._frame
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        pass
+
+
+def _build_mixer(sources: int, volume: float) -> AudioMixer:
+    mixer = AudioMixer()
+
+    async def _add():
+        for i in range(sources):
+            await mixer.add_source(f"src{i}", _NoiseSource(i), volume=volume)
+
+    asyncio.run(_add())
+    return mixer
+
+
+def bench(sources: int, volume: float, frames: int) -> tuple[float, float]:
+    mixer = _build_mixer(sources, volume)
+    read = mixer.read
+    for _ in range(200):  # ウォームアップ
+        read()
+
+    start = time.process_time()
+    for _ in range(frames):
+        read()
+    elapsed = time.process_time() - start
+
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    for _ in range(1000):
+        read()
+    snapshot_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(
+        stat.size_diff for stat in snapshot_after.compare_to(snapshot_before, "filename")
+        if "audio_mixer" in str(stat.traceback) and stat.size_diff > 0
+    )
+
+    mixer.stop()
+    return frames / elapsed if elapsed > 0 else float("inf"), allocated / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AudioMixer microbenchmark")
+    parser.add_argument("--frames", type=int, default=20000, help="計測するフレーム数")
+    args = parser.parse_args()
+
+    realtime_fps = 1000 / FRAME_LENGTH_MS
+    print(f"{'sources':>7} {'volume':>6} {'frames/sec/core':>16} {'guilds/core':>12} {'bytes/frame':>12}")
+    for sources, volume in ((1, 1.0), (1, 0.2), (2, 0.5), (4, 0.5), (8, 0.5)):
+        fps, bytes_per_frame = bench(sources, volume, args.frames)
+        print(f"{sources:>7} {volume:>6.2f} {fps:>16,.0f} {fps / realtime_fps:>12,.0f} {bytes_per_frame:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
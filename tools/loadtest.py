@@ -0,0 +1,658 @@
+"""
+多数のギルドを模擬して MusicBot のコマンド処理に負荷をかけるロードテスト。
+
+Discord・yt-dlp・FFmpeg には接続せず、偽のインタラクション・ボイスクライアント・抽出器で
+MusicBot のスラッシュコマンドのハンドラ (play / skip / queue / seek など) を直接呼び出す。
+ネットワーク無しで動くので CI でも実行できる。
+
+- 抽出器: 遅延 (平均とばらつき) と失敗率を指定できる。再生用のストリーム URL の解決も同様
+- ボイスクライアント: 実際の送信スレッドの代わりに --tick 秒ごとにソースを読み、曲の終わりで after を呼ぶ。
+  曲の長さは --speed 倍速で進む (180秒の曲が --speed 30 なら6秒で終わる)
+- 結果: コマンドごとの応答 (ack) と完了までの時間のパーセンタイル、スループット、イベントループの遅延、
+  メモリ使用量の推移
+
+使い方:
+    python tools/loadtest.py [--guilds 1000] [--duration 60] [--think 2.0] [--speed 30]
+                             [--extract-latency 0.3] [--extract-failure-rate 0.0]
+                             [--resolve-latency 0.2] [--resolve-failure-rate 0.0] [--json result.json]
+                             [--max-p99-ms 0]
+
+--max-p99-ms を指定すると、いずれかのコマンドの完了時間の p99 がそれを超えたときに終了コード 1 で終わる。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import discord
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import bot as bot_module  # noqa: E402
+
+if bot_module.Track is None:
+    # bot.py はインポートの失敗を表示して続行するので、ここで止める (原因は直前に表示されたエラー)
+    sys.exit("loadtest: bot.py のコンポーネントを読み込めませんでした。requirements.txt の依存関係を確認してください。")
+
+from services.audio_mixer import FRAME_SECONDS, FRAME_SIZE  # noqa: E402
+from services.ytdlp_wrapper import Track  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+OPUS_SILENCE = b"\xf8\xff\xfe"
+_SEEK_RE = re.compile(r"-ss\s+(\d+(?:\.\d+)?)")
+_DURATION_RE = re.compile(r"[?&]d=(\d+)")
+
+# (コマンド, 重み)
+COMMAND_WEIGHTS = (
+    ("play", 30), ("queue", 15), ("nowplaying", 10), ("skip", 10), ("seek", 8), ("volume", 8),
+    ("pause", 5), ("resume", 5), ("shuffle", 4), ("playmany", 3), ("stop", 2),
+)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def rss_bytes() -> int:
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# --- 偽の抽出器 ---
+
+class FakeExtractor:
+    """extract() / ensure_stream() の代わり。遅延と失敗率を指定できる。"""
+
+    def __init__(self, rng: random.Random, *, extract_latency: float, extract_failure_rate: float,
+                 resolve_latency: float, resolve_failure_rate: float, playlist_rate: float, playlist_size: int):
+        self.rng = rng
+        self.extract_latency = extract_latency
+        self.extract_failure_rate = extract_failure_rate
+        self.resolve_latency = resolve_latency
+        self.resolve_failure_rate = resolve_failure_rate
+        self.playlist_rate = playlist_rate
+        self.playlist_size = playlist_size
+        self._next_id = 0
+        self.extract_calls = 0
+        self.resolve_calls = 0
+
+    async def _delay(self, mean: float):
+        if mean > 0:
+            await asyncio.sleep(self.rng.expovariate(1 / mean))
+
+    def _track(self) -> Track:
+        self._next_id += 1
+        video_id = f"lt{self._next_id:09d}"
+        return Track(url=f"https://www.youtube.com/watch?v={video_id}", title=f"Load test track {self._next_id}",
+                     duration=self.rng.randint(60, 360), extractor="Youtube", acodec="opus", asr=48000,
+                     container="webm", protocol="https")
+
+    async def extract(self, query: str, **kwargs):
+        self.extract_calls += 1
+        await self._delay(self.extract_latency)
+        if self.rng.random() < self.extract_failure_rate:
+            raise RuntimeError(f"simulated extraction failure for '{query}'")
+        if self.rng.random() < self.playlist_rate:
+            return [self._track() for _ in range(self.playlist_size)]
+        return self._track()
+
+    async def ensure_stream(self, track: Track, ytdl_opts_override: Optional[dict] = None) -> Track:
+        self.resolve_calls += 1
+        await self._delay(self.resolve_latency)
+        if self.rng.random() < self.resolve_failure_rate:
+            raise RuntimeError(f"simulated stream resolve failure for '{track.title}'")
+        track.stream_url = f"https://loadtest.invalid/{track.url.rsplit('=', 1)[-1]}?d={track.duration}"
+        return track
+
+
+# --- 偽の音源 (FFmpeg を起動しない) ---
+
+class _FakeStream:
+    """
+    ボイスクライアントに読まれた分だけ --speed 倍速で進む音源。読まれない間 (一時停止中) は進まない。
+    drop_rate の確率で途中で終わり、ストリームの自動復旧を通る。
+    """
+    speed = 30.0
+    max_step = 0.5  # 長く読まれなかった後の1回で進める最大の実時間 (秒)
+    drop_rate = 0.0
+    rng = random.Random(0)
+
+    def __init__(self, source: str, *, title: str, guild_id: int, on_first_frame=None, stats=None,
+                 before_options: Optional[str] = None, **kwargs):
+        self._spawned_at = time.perf_counter()
+        self.title = title
+        self.guild_id = guild_id
+        self.stats = stats
+        self._on_first_frame = on_first_frame
+        match = _DURATION_RE.search(source)
+        duration = float(match.group(1)) if match else 180.0
+        seek = _SEEK_RE.search(before_options or "")
+        self._remaining = max(0.0, duration - (float(seek.group(1)) if seek else 0.0))
+        if self.rng.random() < self.drop_rate:
+            self._remaining *= self.rng.random()
+        self._position = 0.0
+        self._last_read: Optional[float] = None
+
+    @property
+    def frames_read(self) -> int:
+        return int(self._position / FRAME_SECONDS)
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return self._position
+
+    def _advance(self) -> bool:
+        now = time.perf_counter()
+        if self._last_read is not None:
+            self._position += min(now - self._last_read, self.max_step) * self.speed
+        self._last_read = now
+        if self._position >= self._remaining:
+            return False
+        if self._on_first_frame is not None:
+            callback, self._on_first_frame = self._on_first_frame, None
+            callback(now - self._spawned_at)
+        return True
+
+    def cleanup(self):
+        pass
+
+
+class FakePCMSource(_FakeStream, discord.AudioSource):
+    def read_into(self, buffer: memoryview) -> int:
+        return FRAME_SIZE if self._advance() else 0
+
+    def read(self) -> bytes:
+        return bytes(FRAME_SIZE) if self._advance() else b""
+
+    def is_opus(self) -> bool:
+        return False
+
+
+class FakeOpusSource(_FakeStream, discord.AudioSource):
+    def read(self) -> bytes:
+        return OPUS_SILENCE if self._advance() else b""
+
+    def is_opus(self) -> bool:
+        return True
+
+
+# --- 偽の Discord オブジェクト ---
+
+class FakeMessage:
+    _ids = 0
+
+    def __init__(self, channel: "FakeTextChannel"):
+        FakeMessage._ids += 1
+        self.id = FakeMessage._ids
+        self.channel = channel
+
+    async def edit(self, **kwargs):
+        self.channel.fleet.stats.message_edits += 1
+        return self
+
+    async def delete(self, **kwargs):
+        pass
+
+
+class FakeTextChannel(discord.abc.Messageable):
+    def __init__(self, fleet: "Fleet", channel_id: int, guild: "FakeGuild"):
+        self.fleet = fleet
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"text-{channel_id}"
+
+    async def _get_channel(self):
+        return self
+
+    async def send(self, content=None, **kwargs):
+        self.fleet.stats.messages_sent += 1
+        return FakeMessage(self)
+
+
+class FakeVoiceChannel:
+    def __init__(self, fleet: "Fleet", channel_id: int, guild: "FakeGuild", bitrate: int):
+        self.fleet = fleet
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"voice-{channel_id}"
+        self.bitrate = bitrate
+        self.members: List[FakeMember] = []
+
+    async def connect(self, *, timeout: float = 60.0, reconnect: bool = True, self_deaf: bool = False, **kwargs):
+        await asyncio.sleep(self.fleet.args.connect_latency)
+        vc = FakeVoiceClient(self.fleet, self)
+        self.guild.voice_client = vc
+        return vc
+
+
+class FakeVoiceState:
+    def __init__(self, channel: FakeVoiceChannel):
+        self.channel = channel
+
+
+class FakeMember:
+    def __init__(self, member_id: int, channel: FakeVoiceChannel):
+        self.id = member_id
+        self.bot = False
+        self.name = self.display_name = f"user{member_id}"
+        self.mention = f"<@{member_id}>"
+        self.voice = FakeVoiceState(channel)
+
+
+class FakeGuild:
+    def __init__(self, fleet: "Fleet", guild_id: int):
+        self.id = guild_id
+        self.name = f"guild-{guild_id}"
+        self.voice_client: Optional[FakeVoiceClient] = None
+        self.me = None
+        self.voice = FakeVoiceChannel(fleet, guild_id * 10 + 1, self, fleet.rng.choice((64000, 96000, 128000)))
+        self.text = FakeTextChannel(fleet, guild_id * 10 + 2, self)
+        self.member = FakeMember(guild_id * 10 + 3, self.voice)
+        self.voice.members.append(self.member)
+
+    def get_member(self, member_id: int):
+        return self.member if member_id == self.member.id else None
+
+
+class FakeVoiceClient:
+    """
+    VoiceClient の代わり。実際のように 20ms ごとに読む代わりに Fleet が --tick 秒ごとに pump() を呼び、
+    ソースが終われば cleanup() と after を呼ぶ (discord.py の AudioPlayer と同じ順序)。
+    """
+
+    def __init__(self, fleet: "Fleet", channel: FakeVoiceChannel):
+        self.fleet = fleet
+        self.channel = channel
+        self.guild = channel.guild
+        self.encoder = None
+        self.source: Optional[discord.AudioSource] = None
+        self._after = None
+        self._playing = False
+        self._paused = False
+        self._connected = True
+
+    def play(self, source: discord.AudioSource, *, after=None, **kwargs):
+        if self.is_playing():
+            raise discord.ClientException("Already playing audio.")
+        self.source = source
+        self._after = after
+        self._playing = True
+        self._paused = False
+        self.fleet.voice_clients.add(self)
+        self.fleet.stats.plays += 1
+
+    def _finish(self):
+        self._playing = False
+        self.fleet.voice_clients.discard(self)
+        source, after = self.source, self._after
+        self._after = None
+        try:
+            source.cleanup()
+        except Exception:
+            pass
+        if after is not None:
+            # 実物は送信スレッドから呼ぶ。イベントループ上で後から呼んで同じ非同期性にする
+            asyncio.get_running_loop().call_soon(after, None)
+
+    def pump(self):
+        if self._playing and not self._paused and not self.source.read():
+            self.fleet.stats.tracks_finished += 1
+            self._finish()
+
+    def stop(self):
+        if self._playing:
+            self._finish()
+        self.source = None
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def is_playing(self) -> bool:
+        return self._playing and not self._paused
+
+    def is_paused(self) -> bool:
+        return self._playing and self._paused
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def move_to(self, channel, *, timeout: float = 30.0):
+        self.channel = channel
+
+    async def disconnect(self, *, force: bool = False):
+        self.stop()
+        self._connected = False
+        if self.guild.voice_client is self:
+            self.guild.voice_client = None
+
+
+class _Response:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+        self._done = False
+
+    def _ack(self):
+        if self._done:
+            raise discord.errors.InteractionResponded(self._interaction)
+        self._done = True
+        self._interaction.acked_at = time.perf_counter()
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, **kwargs):
+        self._ack()
+
+    async def send_message(self, content=None, **kwargs):
+        self._ack()
+
+    async def edit_message(self, **kwargs):
+        self._ack()
+
+
+class _Followup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        return FakeMessage(self._interaction.channel)
+
+
+class FakeInteraction:
+    def __init__(self, guild: FakeGuild):
+        self.guild = guild
+        self.channel = guild.text
+        self.user = guild.member
+        self.response = _Response(self)
+        self.followup = _Followup(self)
+        self.created_at = time.perf_counter()
+        self.acked_at: Optional[float] = None
+
+
+# --- 集計 ---
+
+class Stats:
+    def __init__(self):
+        self.completed: Dict[str, List[float]] = defaultdict(list)
+        self.acked: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.unacked: Dict[str, int] = defaultdict(int)
+        self.loop_lag: List[float] = []
+        self.timeline: List[dict] = []
+        self.messages_sent = 0
+        self.message_edits = 0
+        self.plays = 0
+        self.tracks_finished = 0
+
+    def commands(self) -> int:
+        return sum(len(v) for v in self.completed.values())
+
+
+class Fleet:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.stats = Stats()
+        self.voice_clients = set()
+        self.channels: Dict[int, FakeTextChannel] = {}
+        self.guilds = [FakeGuild(self, 1_000_000 + i) for i in range(args.guilds)]
+        for guild in self.guilds:
+            self.channels[guild.text.id] = guild.text
+        self.extractor = FakeExtractor(
+            self.rng, extract_latency=args.extract_latency, extract_failure_rate=args.extract_failure_rate,
+            resolve_latency=args.resolve_latency, resolve_failure_rate=args.resolve_failure_rate,
+            playlist_rate=args.playlist_rate, playlist_size=args.playlist_size)
+        self.bot: Optional[bot_module.MusicBot] = None
+        self._running = True
+
+    def build_bot(self) -> bot_module.MusicBot:
+        with open(ROOT / "config.default.yaml", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+        music = config.setdefault("music", {})
+        music["max_guilds"] = self.args.guilds
+        music.setdefault("loudness_normalization", {})["enabled"] = False  # 測定は FFmpeg を起動する
+        music.setdefault("stream_relay", {})["enabled"] = False
+        # 実行したディレクトリの ./cache に履歴を書き込まない (起動後のウォームアップも履歴を使う)
+        music.setdefault("play_history", {})["enabled"] = False
+        music.setdefault("warm_up", {})["enabled"] = False
+        admission = music.setdefault("admission", {})
+        admission["enabled"] = not self.args.no_admission
+        # 既定では全ギルドが同時に再生できる枠を用意する (実機の上限で試すときは --max-transcodes を指定)
+        admission["max_transcodes"] = self.args.max_transcodes or self.args.guilds
+        if not self.args.host_load:
+            # 偽の音源は CPU を使わないので、ホストの負荷ではなく同時トランスコード数だけで受け入れを決める
+            admission["max_load"] = float("inf")
+
+        # モジュールの名前を差し替えるだけで、ボット側のコードは本番と同じものが動く
+        bot_module.extract_audio_data = self.extractor.extract
+        bot_module.ensure_stream = self.extractor.ensure_stream
+        bot_module.MusicAudioSource = FakePCMSource
+        bot_module.OpusPassthroughSource = FakeOpusSource
+        _FakeStream.speed = self.args.speed
+        _FakeStream.drop_rate = self.args.stream_drop_rate
+        _FakeStream.max_step = max(0.5, self.args.tick * 2)
+        _FakeStream.rng = random.Random(self.args.seed + 1)
+
+        self.bot = bot_module.MusicBot(config=config, intents=discord.Intents.default())
+        self.bot.get_channel = self.channels.get
+        return self.bot
+
+    async def _run_command(self, name: str, guild: FakeGuild):
+        cls = bot_module.MusicBot
+        interaction = FakeInteraction(guild)
+        rng = self.rng
+        if name == "play":
+            call = cls.play_slash.callback(self.bot, interaction, f"load test {rng.randrange(10 ** 6)}")
+        elif name == "playmany":
+            queries = "; ".join(f"load test {rng.randrange(10 ** 6)}" for _ in range(rng.randint(2, 5)))
+            call = cls.playmany_slash.callback(self.bot, interaction, queries)
+        elif name == "seek":
+            position = rng.randint(0, 240)
+            call = cls.seek_slash.callback(self.bot, interaction, f"{position // 60}:{position % 60:02d}")
+        elif name == "volume":
+            call = cls.volume_slash.callback(self.bot, interaction, rng.choice((10, 20, 50, 100)))
+        else:
+            call = getattr(cls, f"{name}_slash").callback(self.bot, interaction)
+        try:
+            await call
+        except Exception as e:
+            self.stats.errors[f"{name}:{type(e).__name__}"] += 1
+        finished = time.perf_counter()
+        self.stats.completed[name].append(finished - interaction.created_at)
+        if interaction.acked_at is not None:
+            self.stats.acked[name].append(interaction.acked_at - interaction.created_at)
+        else:
+            self.stats.unacked[name] += 1
+
+    async def _guild_session(self, guild: FakeGuild, deadline: float):
+        names = [name for name, _ in COMMAND_WEIGHTS]
+        weights = [weight for _, weight in COMMAND_WEIGHTS]
+        # 開始を散らして、全ギルドが同時に /play する瞬間を作らない
+        await asyncio.sleep(self.rng.uniform(0, self.args.ramp_up))
+        await self._run_command("play", guild)
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(self.rng.expovariate(1 / self.args.think))
+            await self._run_command(self.rng.choices(names, weights)[0], guild)
+
+    async def _pump_voice(self):
+        while self._running:
+            for vc in list(self.voice_clients):
+                vc.pump()
+            await asyncio.sleep(self.args.tick)
+
+    async def _measure_loop_lag(self):
+        interval = 0.1
+        while self._running:
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.stats.loop_lag.append(time.perf_counter() - started - interval)
+
+    async def _sample_memory(self, started: float):
+        while self._running:
+            self._record_sample(started)
+            await asyncio.sleep(self.args.sample_every)
+
+    def _record_sample(self, started: float):
+        bot = self.bot
+        recent_lag = self.stats.loop_lag[-50:]
+        self.stats.timeline.append({
+            "t": round(time.perf_counter() - started, 1),
+            "rss_mib": round(rss_bytes() / 1048576, 1),
+            "guild_states": len(bot.guild_states),
+            "playing": len(self.voice_clients),
+            "queue_mib": round(bot.memory_budget.used_bytes / 1048576, 2),
+            "pending_messages": bot.message_scheduler.pending_count(),
+            "commands": self.stats.commands(),
+            "loop_lag_max_ms": round(max(recent_lag, default=0.0) * 1000, 1),
+        })
+
+    async def run(self):
+        self.build_bot()
+        await self.bot._async_setup_hook()  # ログインせずに bot.loop などを設定する
+        started = time.perf_counter()
+        deadline = started + self.args.duration
+        background = [asyncio.create_task(self._pump_voice()), asyncio.create_task(self._measure_loop_lag()),
+                      asyncio.create_task(self._sample_memory(started))]
+        sessions = [asyncio.create_task(self._guild_session(guild, deadline)) for guild in self.guilds]
+        await asyncio.wait(sessions)
+        elapsed = time.perf_counter() - started
+        self._record_sample(started)
+        self._running = False
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        # 本番の切断と同じ後片付けを通す (状態を先に外すので、止めた再生が次の曲へ進むことはない)
+        await asyncio.gather(*(self.bot._cleanup_guild_state(guild.id) for guild in self.guilds))
+        await asyncio.sleep(self.args.tick)
+        await self.bot.message_scheduler.close()
+        return elapsed
+
+
+def report(fleet: Fleet, elapsed: float) -> dict:
+    stats = fleet.stats
+    result = {
+        "guilds": fleet.args.guilds,
+        "elapsed_seconds": round(elapsed, 1),
+        "commands": stats.commands(),
+        "commands_per_second": round(stats.commands() / elapsed, 1) if elapsed else 0.0,
+        "plays": stats.plays,
+        "tracks_finished": stats.tracks_finished,
+        "extract_calls": fleet.extractor.extract_calls,
+        "resolve_calls": fleet.extractor.resolve_calls,
+        "messages_sent": stats.messages_sent,
+        "message_edits": stats.message_edits,
+        "loop_lag_ms": {f"p{p}": round(percentile(stats.loop_lag, p) * 1000, 1) for p in (50, 95, 99)},
+        "loop_lag_max_ms": round(max(stats.loop_lag, default=0.0) * 1000, 1),
+        "errors": dict(stats.errors),
+        "commands_detail": {},
+        "timeline": stats.timeline,
+    }
+    result["loop_lag_ms"]["max"] = result.pop("loop_lag_max_ms")
+    for name in sorted(stats.completed):
+        completed, acked = stats.completed[name], stats.acked[name]
+        result["commands_detail"][name] = {
+            "count": len(completed),
+            "unacked": stats.unacked.get(name, 0),
+            "ack_ms": {f"p{p}": round(percentile(acked, p) * 1000, 1) for p in (50, 95, 99)},
+            "done_ms": {f"p{p}": round(percentile(completed, p) * 1000, 1) for p in (50, 95, 99)},
+        }
+
+    print(f"guilds={result['guilds']} elapsed={result['elapsed_seconds']}s commands={result['commands']} "
+          f"throughput={result['commands_per_second']}/s plays={stats.plays} finished={stats.tracks_finished} "
+          f"extract={fleet.extractor.extract_calls} resolve={fleet.extractor.resolve_calls} "
+          f"messages={stats.messages_sent} edits={stats.message_edits}")
+    print()
+    print(f"{'command':>10} {'count':>7} {'ack p50':>8} {'p95':>8} {'p99':>8} {'done p50':>9} {'p95':>8} {'p99':>8}")
+    for name, detail in result["commands_detail"].items():
+        ack, done = detail["ack_ms"], detail["done_ms"]
+        print(f"{name:>10} {detail['count']:>7} {ack['p50']:>8.1f} {ack['p95']:>8.1f} {ack['p99']:>8.1f} "
+              f"{done['p50']:>9.1f} {done['p95']:>8.1f} {done['p99']:>8.1f}")
+    print()
+    lag = result["loop_lag_ms"]
+    print(f"event loop lag ms: p50={lag['p50']} p95={lag['p95']} p99={lag['p99']} max={lag['max']}")
+    if stats.errors:
+        print("errors: " + " ".join(f"{k}={v}" for k, v in sorted(stats.errors.items())))
+    print()
+    print(f"{'t':>6} {'rss MiB':>8} {'guilds':>7} {'playing':>8} {'queue MiB':>10} {'pending':>8} "
+          f"{'commands':>9} {'lag max':>8}")
+    for row in stats.timeline:
+        print(f"{row['t']:>6} {row['rss_mib']:>8} {row['guild_states']:>7} {row['playing']:>8} "
+              f"{row['queue_mib']:>10} {row['pending_messages']:>8} {row['commands']:>9} "
+              f"{row['loop_lag_max_ms']:>8}")
+    print()
+    for line in fleet.bot.metrics.format_lines():
+        print(line)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MusicBot simulated guild fleet load test")
+    parser.add_argument("--guilds", type=int, default=1000, help="模擬するギルド数")
+    parser.add_argument("--duration", type=float, default=60, help="コマンドを送り続ける秒数")
+    parser.add_argument("--ramp-up", type=float, default=5, help="全ギルドが最初の /play を送り終えるまでの秒数")
+    parser.add_argument("--think", type=float, default=2.0, help="ギルドごとのコマンド間隔の平均 (秒)")
+    parser.add_argument("--speed", type=float, default=30, help="曲を何倍速で進めるか")
+    parser.add_argument("--tick", type=float, default=0.2, help="ボイスクライアントがソースを読む間隔 (秒)")
+    parser.add_argument("--connect-latency", type=float, default=0.05, help="ボイス接続にかかる秒数")
+    parser.add_argument("--extract-latency", type=float, default=0.3, help="抽出の平均遅延 (秒)")
+    parser.add_argument("--extract-failure-rate", type=float, default=0.0, help="抽出が失敗する確率")
+    parser.add_argument("--resolve-latency", type=float, default=0.2, help="ストリーム URL 解決の平均遅延 (秒)")
+    parser.add_argument("--resolve-failure-rate", type=float, default=0.0, help="ストリーム URL 解決が失敗する確率")
+    parser.add_argument("--stream-drop-rate", type=float, default=0.0, help="再生中のストリームが途中で切れる確率")
+    parser.add_argument("--playlist-rate", type=float, default=0.1, help="/play がプレイリストになる確率")
+    parser.add_argument("--playlist-size", type=int, default=50, help="プレイリストの曲数")
+    parser.add_argument("--no-admission", action="store_true", help="再生開始の受け入れ制御を無効にする")
+    parser.add_argument("--max-transcodes", type=int, default=0,
+                        help="同時トランスコード数の上限 (0 ならギルド数)")
+    parser.add_argument("--host-load", action="store_true",
+                        help="受け入れ制御でホストの CPU 負荷も見る (既定では同時トランスコード数のみ)")
+    parser.add_argument("--sample-every", type=float, default=5, help="メモリ等を記録する間隔 (秒)")
+    parser.add_argument("--seed", type=int, default=1, help="乱数のシード")
+    parser.add_argument("--json", help="結果を JSON で書き出すファイル")
+    parser.add_argument("--max-p99-ms", type=float, default=0, help="完了時間 p99 の上限 (超えたら終了コード 1)")
+    parser.add_argument("--log-level", default="WARNING", help="ボットのログレベル")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    fleet = Fleet(args)
+    elapsed = asyncio.run(fleet.run())
+    result = report(fleet, elapsed)
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    if args.max_p99_ms > 0:
+        slow = {name: detail["done_ms"]["p99"] for name, detail in result["commands_detail"].items()
+                if detail["done_ms"]["p99"] > args.max_p99_ms}
+        if slow:
+            print(f"p99 over {args.max_p99_ms}ms: " + " ".join(f"{k}={v}" for k, v in slow.items()))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
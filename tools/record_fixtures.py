@@ -0,0 +1,57 @@
+"""
+抽出結果のフィクスチャを記録する。
+
+クエリ (URL または検索語) ごとに、ボットと同じ extract() と、再生時の ensure_stream() を
+RecordingBackend 経由で実行し、yt-dlp が返した info 辞書を fixtures_dir に保存する。
+記録したフィクスチャは music.extractor.backend: "replay" で、ネットワーク無しに再生できる。
+
+使い方:
+    python tools/record_fixtures.py [--dir ./fixtures/extractor] [--resolve 5] QUERY... | --file queries.txt
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.ytdlp_wrapper import (RecordingBackend, YtDlpBackend, ensure_stream, extract,  # noqa: E402
+                                    get_backend, set_backend)
+
+
+async def record(queries, fixtures_dir: str, resolve: int):
+    set_backend(RecordingBackend(YtDlpBackend(), fixtures_dir))
+    for query in queries:
+        result = await extract(query)
+        tracks = result if isinstance(result, list) else [result] if result else []
+        print(f"{query}: {len(tracks)} track(s)")
+        # 再生時と同じく、ストリーム URL は ensure_stream で取り直したものを記録する
+        for track in tracks[:resolve]:
+            try:
+                await ensure_stream(track)
+                print(f"  {track.title} ({track.extractor}, {track.acodec})")
+            except RuntimeError as e:
+                print(f"  {track.title}: {e}")
+    print(get_backend().format_stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record extractor fixtures for offline replay")
+    parser.add_argument("queries", nargs="*", help="URL または検索語")
+    parser.add_argument("--file", help="1行に1クエリを書いたファイル")
+    parser.add_argument("--dir", default="./fixtures/extractor", help="フィクスチャの保存先")
+    parser.add_argument("--resolve", type=int, default=5, help="クエリごとにストリーム URL を解決する曲数")
+    args = parser.parse_args()
+
+    queries = list(args.queries)
+    if args.file:
+        queries += [line.strip() for line in Path(args.file).read_text(encoding="utf-8").splitlines() if line.strip()]
+    if not queries:
+        parser.error("クエリを1つ以上指定してください")
+    asyncio.run(record(queries, args.dir, args.resolve))
+
+
+if __name__ == "__main__":
+    main()